@@ -0,0 +1,197 @@
+"""Content-addressed embedding cache: in-memory LRU backed by SQLite.
+
+Sub-questions from `query_translation` repeat across users, and
+re-indexing embeds mostly unchanged chunks. Vectors are keyed on the
+model name, the call kind, and the text after whitespace/Unicode
+normalization. The kind matters because Gemini embeds queries and
+documents with different task types. Vectors are stored as float32
+blobs. Only the misses of a batch reach the wrapped model.
+
+`cached_embeddings(model)` returns one shared instance per model. Query
+retrieval, indexing and the semantic router/cache all use it.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+from app.core.observability import TimedEmbeddings
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an `Embeddings` model; vectors are cached per (model, kind, text)."""
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        model: str,
+        path: str,
+        max_memory_entries: int = 4096,
+    ):
+        self.inner = inner
+        self.model = model
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self._conn.commit()
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\x00{kind}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: list[str]) -> dict[str, np.ndarray]:
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+
+            missing = [k for k in dict.fromkeys(keys) if k not in found]
+            # SQLite giới hạn số tham số mỗi câu lệnh: tra theo lô
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embedding_cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    found[key] = vector
+        return found
+
+    def _store(self, items: dict[str, list[float]]):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, values in items.items():
+                vector = np.asarray(values, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, self.model, vector.tobytes(), now))
+            self._conn.executemany("INSERT OR REPLACE INTO embedding_cache VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def _split(self, kind: str, texts: list[str]) -> tuple[list[str], dict, list[int]]:
+        keys = [self._key(kind, t) for t in texts]
+        found = self._lookup(keys)
+        # Mỗi văn bản thiếu chỉ embed một lần dù lặp lại trong cùng lô
+        miss_index: dict[str, int] = {}
+        for i, key in enumerate(keys):
+            if key not in found and key not in miss_index:
+                miss_index[key] = i
+        with self._lock:
+            self.hits += len(texts) - len(miss_index)
+            self.misses += len(miss_index)
+        return keys, found, list(miss_index.values())
+
+    @staticmethod
+    def _assemble(keys: list[str], found: dict) -> list[list[float]]:
+        return [found[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, misses = self._split("document", texts)
+        if misses:
+            vectors = self.inner.embed_documents([texts[i] for i in misses])
+            fresh = {keys[i]: v for i, v in zip(misses, vectors)}
+            self._store(fresh)
+            found.update({k: np.asarray(v, dtype=np.float32) for k, v in fresh.items()})
+        return self._assemble(keys, found)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys, found, misses = self._split("document", texts)
+        if misses:
+            vectors = await self.inner.aembed_documents([texts[i] for i in misses])
+            fresh = {keys[i]: v for i, v in zip(misses, vectors)}
+            self._store(fresh)
+            found.update({k: np.asarray(v, dtype=np.float32) for k, v in fresh.items()})
+        return self._assemble(keys, found)
+
+    def embed_query(self, text: str) -> list[float]:
+        keys, found, misses = self._split("query", [text])
+        if misses:
+            vector = self.inner.embed_query(text)
+            self._store({keys[0]: vector})
+            return list(vector)
+        return found[keys[0]].tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        keys, found, misses = self._split("query", [text])
+        if misses:
+            vector = await self.inner.aembed_query(text)
+            self._store({keys[0]: vector})
+            return list(vector)
+        return found[keys[0]].tolist()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            disk_entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embedding_cache WHERE model = ?", (self.model,)
+            ).fetchone()[0]
+        return {
+            "model": self.model,
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+@lru_cache(maxsize=None)
+def cached_embeddings(model: str) -> Embeddings:
+    """Shared, timed (and cached unless disabled) Gemini embeddings for `model`."""
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    # TimedEmbeddings nằm bên trong: chỉ những lần gọi mạng thật mới được đo
+    timed = TimedEmbeddings(GoogleGenerativeAIEmbeddings(model=model))
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return timed
+    return CachedEmbeddings(
+        timed,
+        model=model,
+        path=settings.EMBEDDING_CACHE_PATH,
+        max_memory_entries=settings.EMBEDDING_CACHE_MEMORY_ENTRIES,
+    )
@@ -0,0 +1,186 @@
+"""Exact-match LLM response cache: in-memory LRU backed by SQLite.
+
+Plugs into LangChain's `BaseCache` hook, so it is attached per client with
+`ChatOpenAI(cache=...)`. LangChain keys lookups on the serialized messages
+(`prompt`) and the model parameters including bound tools (`llm_string`),
+so two calls only share an entry when model, messages and tool bindings are
+identical. That is safe here because every client runs at temperature 0.
+
+`track_hits()` tells a caller whether its own call was answered from the
+cache. For example, the indexer uses it to count only the tokens of
+requests that actually reached the model.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# List dùng chung qua copy_context, nên lookup chạy trong executor vẫn ghi được vào
+_lookups: ContextVar[Optional[List[bool]]] = ContextVar("llm_cache_lookups", default=None)
+
+
+@contextmanager
+def track_hits() -> Iterator[List[bool]]:
+    """One bool per cache lookup made inside the block, True when it was a hit."""
+    lookups: List[bool] = []
+    token = _lookups.set(lookups)
+    try:
+        yield lookups
+    finally:
+        _lookups.reset(token)
+
+
+def _record(hit: bool):
+    lookups = _lookups.get()
+    if lookups is not None:
+        lookups.append(hit)
+
+
+class TieredLLMCache(BaseCache):
+    """Two-level cache; each instance owns one `namespace` inside the SQLite file."""
+
+    def __init__(
+        self,
+        path: str,
+        namespace: str,
+        ttl: Optional[float] = None,
+        max_memory_entries: int = 1024,
+        max_disk_entries: int = 50_000,
+    ):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory: "OrderedDict[str, tuple[Optional[float], RETURN_VAL_TYPE]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                generations TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )"""
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, expires_at: Optional[float], value: RETURN_VAL_TYPE):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                expires_at, value = cached
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    _record(True)
+                    return value
+                del self._memory[key]
+
+            row = self._conn.execute(
+                "SELECT generations, expires_at FROM llm_cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+
+            if row is None or (row[1] is not None and row[1] <= now):
+                self.misses += 1
+                _record(False)
+                return None
+
+            try:
+                value = [loads(g) for g in json.loads(row[0])]
+            except Exception as e:
+                logger.warning(f"Dropping unreadable LLM cache entry: {e}")
+                self.misses += 1
+                _record(False)
+                return None
+
+            self._remember(key, row[1], value)
+            self.hits += 1
+            _record(True)
+            return value
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._remember(key, expires_at, return_val)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps([dumps(g) for g in return_val]), now, expires_at),
+            )
+            self._conn.commit()
+
+            self._writes_since_prune += 1
+            if self._writes_since_prune >= 100:
+                self._prune(now)
+                self._writes_since_prune = 0
+
+    def _prune(self, now: float):
+        """Drop expired rows, then the oldest ones beyond `max_disk_entries`."""
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, now),
+        )
+        self._conn.execute(
+            """DELETE FROM llm_cache WHERE namespace = ? AND key IN (
+                SELECT key FROM llm_cache WHERE namespace = ?
+                ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.namespace, self.namespace, self.max_disk_entries),
+        )
+        self._conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_cache WHERE namespace = ?", (self.namespace,))
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "memory_entries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,258 @@
+"""Cache of generated MongoDB queries keyed on normalized question templates.
+
+Analytics questions repeat with different literals ("tồn kho giày Nike size
+42" vs "... Adidas size 40"). When a generated query has run successfully,
+every value literal it shares with the question (product names, colors,
+numbers) is lifted into a parameter on both sides:
+
+    question: "Giày Nike size 42 còn bao nhiêu?"
+    template: r"giày (.+?) size (-?\\d+(?:\\.\\d+)?) còn bao nhiêu"
+    query:    db.products.aggregate([{"$match": {"brand": "{{p0}}", "size": {{p1}}}}])
+
+A later question matching the template gets the stored query with its own
+values bound in, skipping both `generate_query` and `check_query`. Entries
+are tied to a schema fingerprint and dropped when the schema changes.
+
+Only values compared in `$match` (and the `$limit` count) are lifted.
+Structural constants such as `{"$sum": 1}`, `$sort` directions and
+`$project` flags stay fixed even when the question contains the same number.
+Literals are lifted only where the question spells them exactly as the
+query does, because `$match` compares strings case-sensitively. The fixed
+words of a template still match in any case. A cached query that returns
+no rows is evicted by the flow and the question is regenerated.
+"""
+
+import logging
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Chuỗi, số (ngoài chuỗi), tên không có ngoặc (key kiểu JS) và dấu câu cấu trúc
+_QUERY_TOKEN = re.compile(
+    r"""(?P<str>(["'])(?P<body>(?:\\.|(?!\2).)*)\2)"""
+    r"""|(?P<num>(?<![\w$.])-?\d+(?:\.\d+)?(?![\w.]))"""
+    r"""|(?P<name>[A-Za-z_$][\w$]*)"""
+    r"""|(?P<punct>[{}\[\]])"""
+)
+_IS_KEY = re.compile(r"\s*:")
+_NUMBER_PATTERN = r"(-?\d+(?:\.\d+)?)"
+_STRING_PATTERN = r"(.+?)"
+
+# Vị trí giá trị được phép thành tham số: so sánh trong $match và $limit.
+# Đối số accumulator ($sum: 1), hướng $sort, cờ $project luôn giữ nguyên
+_COMPARISONS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}
+_STRING_OPERATORS = _COMPARISONS | {"$regex", "$search"}
+
+# Số ký tự cố định tối thiểu của template, để "(.+?)" không khớp mọi câu hỏi
+_MIN_LITERAL_CHARS = 8
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFC", question or "")
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?.!。 ")
+
+
+@dataclass
+class _Template:
+    pattern: re.Pattern
+    kinds: list[str]  # "str" | "num" cho từng tham số
+    quotes: list[str]
+    query: str
+    llm_seconds: float
+    hits: int = 0
+
+
+def _liftable(kind: str, path: list[str]) -> bool:
+    """Whether a value under the key path `path` may become a parameter."""
+    if not path:
+        return False
+    key = path[-1]
+    if kind == "num" and key == "$limit":
+        return True
+    if "$match" not in path[:-1]:
+        return False
+    if not key.startswith("$"):
+        return True  # {"size": 42}
+    return key in (_COMPARISONS if kind == "num" else _STRING_OPERATORS)
+
+
+def _literals(query: str) -> list[tuple[str, str, str, list[tuple[int, int]]]]:
+    """Liftable value literals in `query` as (kind, value, quote, spans), longest first.
+
+    Only values in `$match` comparisons and `$limit` qualify; spans are the
+    offsets of every such occurrence (string spans exclude the quotes).
+    """
+    found: dict = {}
+    frames: list[list] = []  # [ngoặc, key hiện tại] cho mỗi object/array đang mở
+    for m in _QUERY_TOKEN.finditer(query):
+        punct = m.group("punct")
+        if punct in ("{", "["):
+            frames.append([punct, None])
+            continue
+        if punct:
+            if frames:
+                frames.pop()
+            continue
+        if _IS_KEY.match(query, m.end()):
+            if frames and frames[-1][0] == "{":
+                frames[-1][1] = m.group("body") if m.group("str") else m.group(0)
+            continue
+        if m.group("name"):
+            continue  # true / false / null / db.products...
+        path = [key for bracket, key in frames if bracket == "{" and key is not None]
+        if m.group("str"):
+            kind, value, quote, span = "str", m.group("body"), m.group(2), m.span("body")
+            # Bỏ qua tham chiếu field ("$price")
+            if value.startswith("$") or len(value) < 2:
+                continue
+        else:
+            kind, value, quote, span = "num", m.group(0), "", m.span()
+        if _liftable(kind, path):
+            found.setdefault((kind, value), (quote, []))[1].append(span)
+    return sorted(
+        ((kind, value, quote, spans) for (kind, value), (quote, spans) in found.items()),
+        key=lambda item: -len(item[1]),
+    )
+
+
+def _fixed(text: str) -> str:
+    # Phần chữ cố định khớp không phân biệt hoa thường; giá trị bắt được giữ nguyên
+    return f"(?i:{re.escape(text)})" if text else ""
+
+
+def _build_template(question: str, query: str, llm_seconds: float) -> Optional[_Template]:
+    spans = []  # (start, end, kind, quote, offsets trong query)
+    for kind, value, quote, offsets in _literals(query):
+        m = re.search(rf"(?<!\w){re.escape(value)}(?!\w)", question)
+        if m is None or any(s < m.end() and m.start() < e for s, e, *_ in spans):
+            continue
+        spans.append((m.start(), m.end(), kind, quote, offsets))
+    spans.sort()
+
+    pattern, literal_chars, cursor = "", 0, 0
+    kinds, quotes, replacements = [], [], []
+    for i, (start, end, kind, quote, offsets) in enumerate(spans):
+        piece = question[cursor:start]
+        literal_chars += len(piece.replace(" ", ""))
+        pattern += _fixed(piece) + (_NUMBER_PATTERN if kind == "num" else _STRING_PATTERN)
+        cursor = end
+
+        # Chỉ thay đúng các vị trí đã chọn; cùng giá trị ở chỗ khác (vd. $sum: 1) giữ nguyên
+        replacements.extend((s, e, "{{p%d}}" % i) for s, e in offsets)
+        kinds.append(kind)
+        quotes.append(quote)
+
+    tail = question[cursor:]
+    literal_chars += len(tail.replace(" ", ""))
+    pattern += _fixed(tail)
+
+    if spans and literal_chars < _MIN_LITERAL_CHARS:
+        return None
+
+    templated_query = query
+    for s, e, placeholder in sorted(replacements, reverse=True):
+        templated_query = templated_query[:s] + placeholder + templated_query[e:]
+
+    return _Template(
+        pattern=re.compile(pattern),
+        kinds=kinds,
+        quotes=quotes,
+        query=templated_query,
+        llm_seconds=llm_seconds,
+    )
+
+
+def _bind(template: _Template, values: tuple) -> str:
+    query = template.query
+    for i, (kind, quote, value) in enumerate(zip(template.kinds, template.quotes, values)):
+        if kind == "str":
+            value = value.replace("\\", "\\\\").replace(quote, "\\" + quote)
+        query = query.replace("{{p%d}}" % i, value)
+    return query
+
+
+class PipelineCache:
+    """LRU of question templates -> parameterized MongoDB queries."""
+
+    def __init__(self, max_entries: int = 500, enabled: bool = True):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.schema_fingerprint: Optional[str] = None
+
+        self._templates: "OrderedDict[str, _Template]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.schema_evictions = 0
+        self.seconds_saved = 0.0
+
+    def set_schema(self, fingerprint: str):
+        """Drop every template when the collection schema changes."""
+        with self._lock:
+            if fingerprint == self.schema_fingerprint:
+                return
+            if self._templates:
+                logger.info(f"Schema changed; evicting {len(self._templates)} cached pipelines.")
+                self.schema_evictions += len(self._templates)
+                self._templates.clear()
+            self.schema_fingerprint = fingerprint
+
+    def lookup(self, question: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        text = normalize_question(question)
+        with self._lock:
+            for key in reversed(self._templates):
+                template = self._templates[key]
+                m = template.pattern.fullmatch(text)
+                if m is None:
+                    continue
+                self._templates.move_to_end(key)
+                template.hits += 1
+                self.hits += 1
+                self.seconds_saved += template.llm_seconds
+                logger.info(
+                    f"Pipeline cache hit for '{text}' (saved ~{template.llm_seconds:.2f}s)"
+                )
+                return _bind(template, m.groups())
+            self.misses += 1
+            return None
+
+    def store(self, question: str, query: str, llm_seconds: float):
+        """Remember a query that ran successfully for `question`."""
+        if not self.enabled:
+            return
+        template = _build_template(normalize_question(question), query, llm_seconds)
+        if template is None:
+            return
+        with self._lock:
+            self._templates[template.pattern.pattern] = template
+            self._templates.move_to_end(template.pattern.pattern)
+            while len(self._templates) > self.max_entries:
+                self._templates.popitem(last=False)
+
+    def evict(self, question: str):
+        """Drop the template(s) matching `question`, e.g. after a failed run."""
+        text = normalize_question(question)
+        with self._lock:
+            for key in [k for k, t in self._templates.items() if t.pattern.fullmatch(text)]:
+                del self._templates[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "templates": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "schema_evictions": self.schema_evictions,
+            "latency_saved_seconds": round(self.seconds_saved, 3),
+        }
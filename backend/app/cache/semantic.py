@@ -0,0 +1,249 @@
+"""Semantic answer cache in front of the RAG graph.
+
+Answers are keyed on the embedding of the user's question. A lookup returns
+the cached answer of the most similar stored question when the cosine
+similarity clears `threshold`. Every entry remembers which retrievers
+produced it, which drives both its TTL (e.g. web answers go stale,
+policy answers do not) and per-source invalidation.
+
+A source can also have a generation function (the vector DB's is the
+document store's sha256). An entry records the generations it was built
+from and is dropped at lookup once one of them changes, so a re-index run
+by another process invalidates old policy answers. Sources in
+`excluded_sources` are never cached: Mongo answers hinge on the exact
+product or code in the question, which a 0.95 cosine match does not
+guarantee.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    question: str
+    answer: str
+    sources: frozenset
+    vector: np.ndarray
+    expires_at: Optional[float]
+    generations: dict
+
+
+def _unit(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class SemanticAnswerCache:
+    """LRU of (question embedding -> answer) with per-source TTLs."""
+
+    def __init__(
+        self,
+        embedder,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        ttls: Optional[dict] = None,
+        default_ttl: Optional[float] = 3600,
+        enabled: bool = True,
+        generations: Optional[dict[str, Callable[[], Optional[str]]]] = None,
+        excluded_sources: Iterable[str] = (),
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # None = không hết hạn (chỉ bị xoá khi invalidate)
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.enabled = enabled
+        self.generations = generations or {}
+        self.excluded_sources = frozenset(excluded_sources)
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_key = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: list[int] = []
+        # Embedding của các câu hỏi vừa tra cứu, để store() không phải embed lại
+        self._recent_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale = 0
+
+    # --- embedding -------------------------------------------------------
+
+    def _remember_vector(self, question: str, vector: np.ndarray):
+        self._recent_vectors[question] = vector
+        self._recent_vectors.move_to_end(question)
+        while len(self._recent_vectors) > 256:
+            self._recent_vectors.popitem(last=False)
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = self._recent_vectors.get(question)
+        if vector is None:
+            vector = _unit(self.embedder.embed_query(question))
+            self._remember_vector(question, vector)
+        return vector
+
+    async def _aembed(self, question: str) -> np.ndarray:
+        vector = self._recent_vectors.get(question)
+        if vector is None:
+            vector = _unit(await self.embedder.aembed_query(question))
+            self._remember_vector(question, vector)
+        return vector
+
+    # --- core ------------------------------------------------------------
+
+    def _ttl_for(self, sources: Iterable[str]) -> Optional[float]:
+        ttls = [self.ttls.get(s, self.default_ttl) for s in sources] or [self.default_ttl]
+        finite = [t for t in ttls if t is not None]
+        return min(finite) if finite else None
+
+    def _current_generations(self, sources: Iterable[str]) -> dict:
+        return {s: self.generations[s]() for s in sources if s in self.generations}
+
+    def _purge_expired(self, now: float):
+        expired = [
+            k for k, e in self._entries.items() if e.expires_at is not None and e.expires_at <= now
+        ]
+        for k in expired:
+            del self._entries[k]
+        if expired:
+            self.expirations += len(expired)
+            self._matrix = None
+
+    def _similarity_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[k].vector for k in self._keys])
+        return self._matrix
+
+    def _match(self, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            self._purge_expired(time.time())
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            sims = self._similarity_matrix() @ vector
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            key = self._keys[best]
+            entry = self._entries[key]
+            if entry.generations != self._current_generations(entry.generations):
+                # Dữ liệu nguồn đã được index lại sau khi lưu câu trả lời
+                del self._entries[key]
+                self._matrix = None
+                self.stale += 1
+                self.misses += 1
+                logger.info(f"Semantic cache entry for '{entry.question}' is stale, dropped")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.info(f"Semantic cache hit ({sims[best]:.3f}): '{entry.question}'")
+            return entry.answer
+
+    def _insert(self, question: str, vector: np.ndarray, answer: str, sources: Iterable[str]):
+        sources = frozenset(sources)
+        ttl = self._ttl_for(sources)
+        generations = self._current_generations(sources)
+        with self._lock:
+            self._entries[self._next_key] = _Entry(
+                question=question,
+                answer=answer,
+                sources=sources,
+                vector=vector,
+                expires_at=time.time() + ttl if ttl is not None else None,
+                generations=generations,
+            )
+            self._next_key += 1
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    # --- public API ------------------------------------------------------
+
+    def lookup(self, question: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            return self._match(self._embed(question))
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup skipped: {e}")
+            return None
+
+    async def alookup(self, question: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        try:
+            return self._match(await self._aembed(question))
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup skipped: {e}")
+            return None
+
+    def _cacheable(self, answer: str, sources: set) -> bool:
+        return self.enabled and bool(answer) and not (set(sources) & self.excluded_sources)
+
+    def store(self, question: str, answer: str, sources: Iterable[str]):
+        sources = set(sources)
+        if not self._cacheable(answer, sources):
+            return
+        try:
+            self._insert(question, self._embed(question), answer, sources)
+        except Exception as e:
+            logger.warning(f"Semantic cache store skipped: {e}")
+
+    async def astore(self, question: str, answer: str, sources: Iterable[str]):
+        sources = set(sources)
+        if not self._cacheable(answer, sources):
+            return
+        try:
+            self._insert(question, await self._aembed(question), answer, sources)
+        except Exception as e:
+            logger.warning(f"Semantic cache store skipped: {e}")
+
+    def invalidate(self, source: Optional[str] = None) -> int:
+        """Drop every entry produced by `source` (or everything if None)."""
+        with self._lock:
+            if source is None:
+                keys = list(self._entries.keys())
+            else:
+                keys = [k for k, e in self._entries.items() if source in e.sources]
+            for k in keys:
+                del self._entries[k]
+            self._matrix = None
+        logger.info(f"Semantic cache invalidated {len(keys)} entries (source={source}).")
+        return len(keys)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "stale": self.stale,
+        }
@@ -1,21 +1,93 @@
-from typing import List, Union
+from pathlib import Path
+from typing import List, Optional, Union
 
 from pydantic import AnyHttpUrl, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+# Thư mục backend/: đường dẫn tương đối trong settings tính từ đây, không phụ thuộc cwd
+BACKEND_DIR = Path(__file__).resolve().parents[2]
+
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Shate Shop RAG System"
     API_V1_STR: str = "/api/v1"
 
     DEBUG: bool = False
+    LOG_LEVEL: str = "INFO"
+    # Dựng retriever song song ngay khi khởi động; False: dựng ở request đầu tiên cần tới
+    WARMUP_ON_STARTUP: bool = True
 
     # --- DATABASE (MongoDB) ---
     MONGO_URI: str
     MONGO_DB_NAME: str = "test"
 
-    DOC_DIRECTORY: str = "../data/contextual_docs.json"
+    DOC_DIRECTORY: str = "../data/contextual_docs.jsonl"  # đường dẫn .json cũ được tự chuyển sang .jsonl
     RERANK_TOP_N: int = 3
+    RERANKER: str = "cohere"  # "cohere" | "cross_encoder" | "lexical"
+    RERANK_MODEL: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # dùng khi RERANKER=cross_encoder
+    RERANK_BUDGET_MS: Optional[float] = None  # vd. 800: quá hạn thì xếp hạng lexical; None = chờ đến khi xong
+    RERANK_EMBEDDING_WEIGHT: float = 0.0  # trọng số cosine embedding trong reranker lexical
+
+    # --- QUERY ROUTING ---
+    ROUTER_MAX_CONCURRENCY: int = 8  # số câu hỏi con được phân loại song song
+    SEMANTIC_ROUTER_ENABLED: bool = True
+    ROUTER_CENTROIDS_PATH: str = "../data/router_centroids.json"
+    ROUTER_LOG_PATH: str = "../data/routing_log.jsonl"
+    ROUTER_LOG_MAX_BYTES: int = 5_000_000  # quá dung lượng thì xoay vòng sang routing_log.jsonl.1
+    ROUTER_LOG_BACKUPS: int = 3
+    ROUTER_CONFIDENCE: float = 0.80  # cosine tối thiểu để bỏ qua LLM
+    ROUTER_MARGIN: float = 0.05  # khoảng cách tối thiểu so với nhãn đứng thứ hai
+    # Gộp query_translation + classify_query thành một lần gọi LLM (node plan_query)
+    USE_QUERY_PLANNER: bool = False
+
+    # --- LLM RESPONSE CACHE (exact match, temperature=0) ---
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = "../data/llm_cache.sqlite"
+    LLM_CACHE_MEMORY_ENTRIES: int = 1024
+    LLM_CACHE_MAX_ENTRIES: int = 50_000  # giới hạn số bản ghi trên đĩa cho mỗi model
+    # TTL (giây) theo model; None = không hết hạn
+    LLM_CACHE_TTLS: dict = {
+        "fast-model": 24 * 3600,
+        "best-model": 3600,
+        "mql-model": 24 * 3600,
+    }
+
+    # --- EMBEDDING CACHE (model + loại + văn bản đã chuẩn hoá -> vector float32) ---
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str = "../data/embedding_cache.sqlite"
+    EMBEDDING_CACHE_MEMORY_ENTRIES: int = 4096
+
+    # --- MONGODB QUERY VALIDATION ---
+    MQL_DEFAULT_LIMIT: int = 50  # $limit được thêm vào khi pipeline không có
+    MQL_MAX_LIMIT: int = 200  # $limit lớn hơn sẽ bị giảm xuống mức này
+
+    # --- MONGODB QUERY EXECUTION ---
+    MQL_MAX_TIME_MS: int = 5000  # maxTimeMS gửi kèm mỗi aggregate
+    MQL_MAX_DOCS: int = 200  # số document tối đa đọc về
+    MQL_MAX_BYTES: int = 256 * 1024  # dung lượng JSON tối đa của kết quả
+    MQL_BATCH_SIZE: int = 50  # số document mỗi lần lấy từ cursor
+    # Ngân sách token cho kết quả đưa vào format_answer
+    FORMAT_TOKEN_BUDGET: int = 2000
+    FORMAT_MAX_ROWS: int = 20  # số dòng mẫu tối đa khi kết quả lớn
+
+    # --- MONGODB PIPELINE CACHE ---
+    PIPELINE_CACHE_ENABLED: bool = True
+    PIPELINE_CACHE_MAX_ENTRIES: int = 500
+
+    # --- SEMANTIC ANSWER CACHE ---
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.95  # cosine tối thiểu để coi là cùng câu hỏi
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000
+    SEMANTIC_CACHE_DEFAULT_TTL: int = 3600  # giây
+    # TTL (giây) theo nguồn dữ liệu; None = không hết hạn.
+    # Câu trả lời từ vector DB tự mất hiệu lực khi document store được index lại
+    SEMANTIC_CACHE_TTLS: dict = {
+        "internet_retriever": 3600,
+        "vectordb_retriever": None,
+        "greeting": 86400,
+    }
+    # Không cache: câu trả lời phụ thuộc đúng tên sản phẩm / mã trong câu hỏi
+    SEMANTIC_CACHE_EXCLUDED_SOURCES: list = ["mongodb_retriever"]
 
     ALLOWED_COLLECTIONS: list = [
         # "orderitems",
@@ -24,6 +96,9 @@ class Settings(BaseSettings):
         "promotions",
     ]
 
+    # Schema của các collection được cache trong bộ nhớ, làm mới sau TTL (giây)
+    SCHEMA_REGISTRY_TTL: int = 3600
+
     # --- SECURITY (JWT) ---
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
@@ -32,6 +107,16 @@ class Settings(BaseSettings):
     # --- CORS (Cross-Origin Resource Sharing) ---
     BACKEND_CORS_ORIGINS: List[AnyHttpUrl] = ["http://localhost:3000"]
 
+    @field_validator(
+        "DOC_DIRECTORY",
+        "ROUTER_CENTROIDS_PATH",
+        "ROUTER_LOG_PATH",
+        "LLM_CACHE_PATH",
+        "EMBEDDING_CACHE_PATH",
+    )
+    def anchor_data_paths(cls, v: str) -> str:
+        return str((BACKEND_DIR / v).resolve()) if not Path(v).is_absolute() else v
+
     @field_validator("BACKEND_CORS_ORIGINS", mode="before")
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> List[str]:
         if isinstance(v, str) and not v.startswith("["):
@@ -12,30 +12,40 @@ from app.models.models import (
 
 logger = logging.getLogger(__name__)
 
+DOCUMENT_MODELS = [
+    User, Session, Address, Category, 
+    Product, ProductVariantImage, ProductVariant, 
+    Promotion, Order, OrderItem, Review, 
+    CartItem, Favourite, Post, Contact
+]
+
+_client: AsyncIOMotorClient = None
+
+
+def get_database():
+    """Shared Motor database handle, created on first use."""
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            settings.MONGO_URI,
+            uuidRepresentation="standard"
+        )
+    return _client[getattr(settings, "MONGO_DB_NAME", "test")]
+
+
 async def init_db():
     """
     Initialize a MongoDB connection and load the Beanie Models.
     This function is called in the FastAPI lifespan startup event.
     """
     try:
-        client = AsyncIOMotorClient(
-            settings.MONGO_URI,
-            uuidRepresentation="standard"
-        )
-        
-        db_name = getattr(settings, "MONGO_DB_NAME", "test")
-        database = client[db_name]
-        
-        document_models = [
-            User, Session, Address, Category, 
-            Product, ProductVariantImage, ProductVariant, 
-            Promotion, Order, OrderItem, Review, 
-            CartItem, Favourite, Post, Contact
-        ]
+        database = get_database()
+        client = database.client
+        db_name = database.name
 
         await init_beanie(
             database=database,
-            document_models=document_models,
+            document_models=DOCUMENT_MODELS,
             allow_index_dropping=settings.DEBUG  # True if you're in development, False if you're in production.
         )
 
@@ -0,0 +1,125 @@
+"""Deferred construction and concurrent warmup of heavy subsystems.
+
+Retrievers used to be built when `app.graph.nodes` was imported. That
+meant loading the JSON documents, opening Chroma, loading BM25 and
+connecting to MongoDB one after another before `lifespan` even ran. They
+are now registered as `Lazy` handles. `warmup()` builds them concurrently
+in worker threads during startup, and a request that arrives earlier
+builds (or waits for) the one it needs. `/ready` reports `status()`.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PENDING, WARMING, READY, FAILED = "pending", "warming", "ready", "failed"
+
+
+class Lazy(Generic[T]):
+    """Thread-safe build-once handle around a factory."""
+
+    def __init__(self, name: str, factory: Callable[[], T], critical: bool = True):
+        self.name = name
+        self.factory = factory
+        self.critical = critical   # /ready chỉ trả 200 khi mọi subsystem critical đã sẵn sàng
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.build_ms: Optional[float] = None
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def get(self) -> T:
+        if self.state == READY:
+            return self._value
+        with self._lock:
+            if self.state != READY:
+                self._build()
+            return self._value
+
+    async def aget(self) -> T:
+        """Like `get`, but never blocks the event loop while building."""
+        if self.state == READY:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def _build(self):
+        self.state = WARMING
+        started = time.perf_counter()
+        try:
+            self._value = self.factory()
+        except Exception as e:
+            # Lần gọi sau sẽ thử dựng lại
+            self.state = FAILED
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception(f"Subsystem {self.name} failed to start")
+            raise
+        finally:
+            self.build_ms = round((time.perf_counter() - started) * 1000, 2)
+        self.state = READY
+        self.error = None
+        logger.info(f"Subsystem {self.name} ready in {self.build_ms:.0f} ms")
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "critical": self.critical,
+            "build_ms": self.build_ms,
+            "error": self.error,
+        }
+
+
+class SubsystemRegistry:
+    def __init__(self):
+        self._subsystems: dict[str, Lazy] = {}
+        self.profile: dict[str, Optional[float]] = {
+            "import_ms": None,
+            "startup_ms": None,
+            "warmup_ms": None,
+        }
+
+    def register(self, name: str, factory: Callable[[], T], critical: bool = True) -> Lazy[T]:
+        lazy = Lazy(name, factory, critical=critical)
+        self._subsystems[name] = lazy
+        return lazy
+
+    def record(self, phase: str, started: float):
+        """Store the time elapsed since `started` (perf_counter) under `phase`."""
+        self.profile[f"{phase}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def warmup(self) -> dict:
+        """Build every pending subsystem concurrently; failures are reported, not raised."""
+        started = time.perf_counter()
+        pending = [s for s in self._subsystems.values() if s.state != READY]
+        results = await asyncio.gather(*(s.aget() for s in pending), return_exceptions=True)
+        self.record("warmup", started)
+
+        failed = [s.name for s, r in zip(pending, results) if isinstance(r, Exception)]
+        if failed:
+            logger.warning(f"Warmup finished with failures: {', '.join(failed)}")
+        else:
+            logger.info(f"Warmup finished in {self.profile['warmup_ms']:.0f} ms")
+        return self.status()
+
+    @property
+    def ready(self) -> bool:
+        return all(s.ready for s in self._subsystems.values() if s.critical)
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "subsystems": {name: s.status() for name, s in self._subsystems.items()},
+            "profile": dict(self.profile),
+        }
+
+
+subsystems = SubsystemRegistry()
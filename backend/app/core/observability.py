@@ -0,0 +1,253 @@
+"""Latency, token and error instrumentation for the RAG graph.
+
+Two complementary sources feed the same Prometheus metrics:
+
+- `MetricsCallbackHandler`, attached to the compiled graph and to every
+  LLM client, times each LangGraph node and each LLM call (with token
+  usage) from LangChain callbacks, and logs one structured JSON trace per
+  request when the root run finishes.
+- `observe(service, operation)`, an explicit timer for external calls that
+  do not go through LangChain callbacks: embeddings, Cohere rerank,
+  Chroma/BM25, Tavily and MongoDB.
+
+`/metrics` in `app.main` exposes everything in Prometheus text format.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("app.trace")
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "rag_request_seconds", "End-to-end latency of one graph run", buckets=_LATENCY_BUCKETS
+)
+NODE_LATENCY = Histogram(
+    "rag_node_seconds", "Wall time per LangGraph node", ["node"], buckets=_LATENCY_BUCKETS
+)
+EXTERNAL_LATENCY = Histogram(
+    "rag_external_call_seconds",
+    "Wall time per external call",
+    ["service", "operation"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens", ["model", "direction"])
+ERRORS = Counter("rag_errors_total", "Errors by component", ["component"])
+
+
+def record_error(component: str):
+    ERRORS.labels(component=component).inc()
+
+
+@contextmanager
+def observe(service: str, operation: str):
+    """Time an external call; usable around both sync and awaited code."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(f"{service}.{operation}")
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        EXTERNAL_LATENCY.labels(service=service, operation=operation).observe(elapsed)
+        logger.debug(f"{service}.{operation} took {elapsed * 1000:.1f} ms")
+
+
+class TimedEmbeddings(Embeddings):
+    """Wraps an `Embeddings` model so every call is timed under `service`."""
+
+    def __init__(self, inner: Embeddings, service: str = "embeddings"):
+        self.inner = inner
+        self.service = service
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with observe(self.service, "embed_documents"):
+            return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        with observe(self.service, "embed_query"):
+            return self.inner.embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        with observe(self.service, "embed_documents"):
+            return await self.inner.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        with observe(self.service, "embed_query"):
+            return await self.inner.aembed_query(text)
+
+
+def _token_usage(response) -> tuple[int, int]:
+    """(input, output) tokens from an LLMResult, 0 when the provider omits them."""
+    tokens_in = tokens_out = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                tokens_in += usage.get("input_tokens", 0)
+                tokens_out += usage.get("output_tokens", 0)
+    if not (tokens_in or tokens_out):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        tokens_in = usage.get("prompt_tokens", 0)
+        tokens_out = usage.get("completion_tokens", 0)
+    return tokens_in, tokens_out
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Prometheus metrics plus one structured trace per root run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: dict[UUID, dict] = {}      # run đang chạy: node/LLM cần đo
+        self._roots: dict[UUID, UUID] = {}     # run_id -> run gốc của request
+        self._traces: dict[UUID, dict] = {}
+
+    # --- helpers ---------------------------------------------------------
+
+    def _root_of(self, run_id: UUID, parent_run_id: Optional[UUID]) -> UUID:
+        with self._lock:
+            root = self._roots.get(parent_run_id, parent_run_id) if parent_run_id else run_id
+            self._roots[run_id] = root
+            return root
+
+    def _start(self, run_id: UUID, kind: str, name: str, root: UUID):
+        with self._lock:
+            self._runs[run_id] = {
+                "kind": kind, "name": name, "root": root, "started": time.perf_counter()
+            }
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None, **extra) -> Optional[dict]:
+        with self._lock:
+            self._roots.pop(run_id, None)
+            run = self._runs.pop(run_id, None)
+            if run is None:
+                return None
+            span = {
+                "kind": run["kind"],
+                "name": run["name"],
+                "ms": round((time.perf_counter() - run["started"]) * 1000, 2),
+                **extra,
+            }
+            if error is not None:
+                span["error"] = f"{type(error).__name__}: {error}"
+            trace = self._traces.get(run["root"])
+            if trace is not None:
+                trace["spans"].append(span)
+            return span
+
+    # --- chains / graph nodes -------------------------------------------
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        root = self._root_of(run_id, parent_run_id)
+        if parent_run_id is None:
+            question = inputs.get("question") if isinstance(inputs, dict) else None
+            with self._lock:
+                self._traces[run_id] = {
+                    "trace_id": str(run_id),
+                    "question": question,
+                    "started": time.perf_counter(),
+                    "spans": [],
+                }
+            return
+
+        node = (metadata or {}).get("langgraph_node")
+        if node and kwargs.get("name") == node:
+            # RunnableLambda bên trong node mang cùng tên: chỉ đo run ngoài cùng
+            parent = self._runs.get(parent_run_id)
+            if parent is None or parent["kind"] != "node" or parent["name"] != node:
+                self._start(run_id, "node", node, root)
+
+    def _end_chain(self, run_id: UUID, error: Optional[BaseException] = None):
+        span = self._finish(run_id, error)
+        if span is not None:
+            NODE_LATENCY.labels(node=span["name"]).observe(span["ms"] / 1000)
+            if error is not None:
+                record_error(f"node.{span['name']}")
+
+        with self._lock:
+            trace = self._traces.pop(run_id, None)
+        if trace is not None:
+            self._emit_trace(trace, error)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_chain(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_chain(run_id, error)
+
+    # --- LLM calls -------------------------------------------------------
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        root = self._root_of(run_id, parent_run_id)
+        model = (metadata or {}).get("ls_model_name") or kwargs.get("name") or "unknown"
+        self._start(run_id, "llm", model, root)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self.on_chat_model_start(
+            serialized, prompts, run_id=run_id, parent_run_id=parent_run_id, metadata=metadata, **kwargs
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        tokens_in, tokens_out = _token_usage(response)
+        span = self._finish(run_id, tokens_in=tokens_in, tokens_out=tokens_out)
+        if span is None:
+            return
+        EXTERNAL_LATENCY.labels(service="llm", operation=span["name"]).observe(span["ms"] / 1000)
+        LLM_TOKENS.labels(model=span["name"], direction="in").inc(tokens_in)
+        LLM_TOKENS.labels(model=span["name"], direction="out").inc(tokens_out)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        span = self._finish(run_id, error)
+        if span is not None:
+            record_error(f"llm.{span['name']}")
+
+    # --- tools / retrievers (chỉ ghi vào trace; Prometheus đo bằng observe) --
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self._start(run_id, "tool", name, self._root_of(run_id, parent_run_id))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or "retriever"
+        self._start(run_id, "retriever", name, self._root_of(run_id, parent_run_id))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._finish(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    # --- per-request trace ----------------------------------------------
+
+    def _emit_trace(self, trace: dict, error: Optional[BaseException]):
+        total = time.perf_counter() - trace.pop("started")
+        REQUEST_LATENCY.observe(total)
+        spans = trace["spans"]
+        trace.update(
+            total_ms=round(total * 1000, 2),
+            tokens_in=sum(s.get("tokens_in", 0) for s in spans),
+            tokens_out=sum(s.get("tokens_out", 0) for s in spans),
+            error=f"{type(error).__name__}: {error}" if error is not None else None,
+        )
+        trace_logger.info(json.dumps(trace, ensure_ascii=False, default=str))
+
+
+metrics_handler = MetricsCallbackHandler()
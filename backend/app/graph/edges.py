@@ -1,6 +1,12 @@
 from app.graph.state import GraphState
 from langgraph.types import Send
 from langchain_core.messages import HumanMessage
+from typing import Literal
+
+
+def route_after_cache(state: GraphState) -> Literal["hit", "miss"]:
+    return "hit" if state.get("cache_hit") else "miss"
+
 
 def route_to_agents(state: GraphState) -> list[Send]:
     sends = []
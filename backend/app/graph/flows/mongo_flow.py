@@ -1,18 +1,49 @@
-import json
+import logging
+import re
+import time
 from typing import Literal
 
+from app.cache.mql import PipelineCache
 from app.core.config import settings
+from app.core.database import get_database
+from app.core.lifecycle import subsystems
+from app.core.observability import observe, record_error
 from app.graph.llms import best_llm, fast_llm, mql_llm
+from app.graph.flows.mql_executor import QueryExecutor
+from app.graph.flows.mql_validator import (
+    MQLParseError,
+    MQLValidationError,
+    normalize_query,
+    parse_query,
+    validate_pipeline,
+)
+from app.graph.flows.result_shaper import EMPTY_RESULT_ANSWER, shape_result
 from app.graph.prompts.prompts import FORMAT_SYS
 from app.graph.retrievers.mongodb import MongoDBRetriever
 from app.graph.state import MongoState
-from langchain_core.messages import AIMessage
+from app.utils.schema_helper import schema_registry
+from app.utils.table_encoder import prompt_savings
+from langchain_core.messages import AIMessage, ToolMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_mongodb.agent_toolkit import MONGODB_AGENT_SYSTEM_PROMPT
 from langgraph.graph import StateGraph
 
-mongo_retriever = MongoDBRetriever(best_llm)
+logger = logging.getLogger(__name__)
+
+# Toolkit chỉ dùng cho schema của tool mongodb_query; nó kết nối MongoDB nên dựng lười
+mongo_retriever = subsystems.register("mongodb_toolkit", lambda: MongoDBRetriever(best_llm))
+pipeline_cache = PipelineCache(
+    max_entries=settings.PIPELINE_CACHE_MAX_ENTRIES,
+    enabled=settings.PIPELINE_CACHE_ENABLED,
+)
+query_executor = QueryExecutor(
+    max_time_ms=settings.MQL_MAX_TIME_MS,
+    max_docs=settings.MQL_MAX_DOCS,
+    max_bytes=settings.MQL_MAX_BYTES,
+    batch_size=settings.MQL_BATCH_SIZE,
+)
 
 
 def list_collections(state: dict):
@@ -31,31 +62,99 @@ def list_collections(state: dict):
     return {"messages": [summary]}
 
 
-def call_get_schema(state: dict):
-    """Deterministic call to fetch schema for allowed collections"""
-
-    call = {
+def _schema_call() -> dict:
+    return {
         "name": "mongodb_schema",
         "args": {"collection_names": ", ".join(settings.ALLOWED_COLLECTIONS)},
         "id": "schema_call_1",
         "type": "tool_call",
     }
 
+
+def _schema_messages() -> list:
+    # Giữ cặp tool call / tool result như trước để prompt MQL không đổi,
+    # nhưng nội dung lấy từ schema registry trong bộ nhớ thay vì sample DB.
+    call = _schema_call()
     call_msg = AIMessage(content="", tool_calls=[call])
+    resp = ToolMessage(
+        content=schema_registry.render(), name="mongodb_schema", tool_call_id=call["id"]
+    )
+    return [call_msg, resp]
+
+
+def call_get_schema(state: dict):
+    """Deterministic schema for allowed collections, served from the registry"""
+    return {"messages": _schema_messages()}
+
+
+async def acall_get_schema(state: dict):
+    """Async variant of `call_get_schema`; refreshes the registry once its TTL expires."""
+    await schema_registry.aensure_fresh(get_database())
+    return {"messages": _schema_messages()}
+
 
-    resp = mongo_retriever.tool_map["mongodb_schema"].invoke(call)
+def lookup_query(state: dict):
+    """Reuse a cached pipeline for questions matching a known template"""
+    pipeline_cache.set_schema(schema_registry.fingerprint)
 
-    return {"messages": [call_msg, resp]}
+    cached = pipeline_cache.lookup(state.get("query", ""))
+    if cached is None:
+        return {"cached_query": False, "mql_started_at": time.perf_counter()}
+
+    call = {
+        "name": "mongodb_query",
+        "args": {"query": cached},
+        "id": "cached_query_1",
+        "type": "tool_call",
+    }
+    return {"cached_query": True, "messages": [AIMessage(content="", tool_calls=[call])]}
+
+
+def _last_query_call(messages: list):
+    for m in reversed(messages):
+        for call in getattr(m, "tool_calls", None) or []:
+            if call["name"] == "mongodb_query":
+                return call["args"]["query"]
+    return None
+
+
+def remember_query(state: dict):
+    """Cache the pipeline once it has run successfully (or drop a failing cached one)"""
+    messages = state.get("messages", [])
+    result = messages[-1]
+    failed = getattr(result, "status", "success") == "error" or str(
+        result.content
+    ).startswith("Error")
+
+    if state.get("cached_query"):
+        stats = (state.get("query_stats") or [{}])[-1]
+        if failed or not stats.get("rows_returned"):
+            # Giá trị ghép vào template có thể sai (vd. khác hoa thường): bỏ template, sinh lại
+            logger.info("Cached pipeline failed or returned no rows; evicting and regenerating")
+            pipeline_cache.evict(state.get("query", ""))
+            return {"cached_query": False, "regenerate": True, "mql_started_at": time.perf_counter()}
+        return {}
+
+    query = _last_query_call(messages)
+    rows = (state.get("query_stats") or [{}])[-1].get("rows_returned")
+    # Kết quả rỗng không chứng minh được giá trị đã ghép đúng: không lưu thành template
+    if query and not failed and rows:
+        started = state.get("mql_started_at") or time.perf_counter()
+        pipeline_cache.store(state.get("query", ""), query, time.perf_counter() - started)
+    return {"regenerate": False}
+
+
+def _query_generator(toolkit: MongoDBRetriever):
+    return mql_llm.bind_tools(
+        [toolkit.tool_map["mongodb_query"]], tool_choice="mongodb_query"
+    )
 
 
 def generate_query(state: dict):
     """Generate MongoDB aggregation pipeline"""
     # messages = state.get("messages", [])
     # print("messages get schema:", messages)
-    llm_with = mql_llm.bind_tools(
-        [mongo_retriever.tool_map["mongodb_query"]], tool_choice="mongodb_query"
-    )
-    resp = llm_with.invoke(
+    resp = _query_generator(mongo_retriever.get()).invoke(
         [{"role": "system", "content": MONGODB_AGENT_SYSTEM_PROMPT}]
         + state.get("messages", [])
     )
@@ -66,125 +165,215 @@ def generate_query(state: dict):
     return {"messages": [resp]}
 
 
+async def agenerate_query(state: dict):
+    """Async variant of `generate_query`."""
+    resp = await _query_generator(await mongo_retriever.aget()).ainvoke(
+        [{"role": "system", "content": MONGODB_AGENT_SYSTEM_PROMPT}]
+        + state.get("messages", [])
+    )
+    return {"messages": [resp]}
+
+
+# Thay null/true/false bằng literal Python, chỉ khi nằm ngoài chuỗi
+_JS_LITERALS = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|\b(null|true|false)\b""")
+_PY_LITERALS = {"null": "None", "true": "True", "false": "False"}
+
+
+def _checker_input(original: str) -> list[dict]:
+    # Convert JavaScript literals to Python syntax
+    # null → None, true → True, false → False
+    sanitized = _JS_LITERALS.sub(
+        lambda m: m.group(1) or _PY_LITERALS[m.group(2)], original
+    )
+
+    return [
+        {"role": "system", "content": MONGODB_AGENT_SYSTEM_PROMPT},
+        {"role": "user", "content": sanitized},
+    ]
+
+
+def _query_checker(toolkit: MongoDBRetriever):
+    return mql_llm.bind_tools(
+        [toolkit.tool_map["mongodb_query"]], tool_choice="any"
+    )
+
+
+def _normalize(query: str) -> str:
+    return normalize_query(
+        query,
+        settings.ALLOWED_COLLECTIONS,
+        default_limit=settings.MQL_DEFAULT_LIMIT,
+        max_limit=settings.MQL_MAX_LIMIT,
+    )
+
+
+def _with_query(message: AIMessage, query: str) -> AIMessage:
+    call = dict(message.tool_calls[0], args={"query": query})
+    return AIMessage(content="", tool_calls=[call], id=message.id)
+
+
+def _rejected(message: AIMessage, error: Exception) -> AIMessage:
+    logger.warning(f"MongoDB query rejected: {error}")
+    return AIMessage(content=f"Query rejected: {error}", id=message.id)
+
+
+def _check_locally(message: AIMessage):
+    """Validate with the local parser; None means it could not be parsed."""
+    try:
+        return _with_query(message, _normalize(message.tool_calls[0]["args"]["query"]))
+    except MQLParseError as e:
+        logger.info(f"Local MQL validation could not parse query, using LLM checker: {e}")
+        return None
+    except MQLValidationError as e:
+        return _rejected(message, e)
+
+
+def _check_llm_output(original: AIMessage, resp: AIMessage) -> AIMessage:
+    resp.id = original.id
+    if not resp.tool_calls:
+        return resp
+    try:
+        return _with_query(resp, _normalize(resp.tool_calls[0]["args"]["query"]))
+    except MQLParseError:
+        # Giữ nguyên câu lệnh của LLM checker như trước đây
+        return resp
+    except MQLValidationError as e:
+        return _rejected(original, e)
+
+
 def check_query(state: dict):
     """Validate and sanitize generated query"""
     messages = state.get("messages", [])
+    checked = _check_locally(messages[-1])
+    if checked is not None:
+        return {"messages": [checked]}
+
     original = messages[-1].tool_calls[0]["args"]["query"]
-    
-    # Convert JavaScript literals to Python syntax
-    # null → None, true → True, false → False
-    sanitized = original.replace("null", "None")
-    sanitized = sanitized.replace("true", "True")
-    sanitized = sanitized.replace("false", "False")
-    
-    resp = mql_llm.bind_tools(
-        [mongo_retriever.tool_map["mongodb_query"]], tool_choice="any"
-    ).invoke(
-        [
-            {"role": "system", "content": MONGODB_AGENT_SYSTEM_PROMPT},
-            {"role": "user", "content": sanitized},
-        ]
+    resp = _query_checker(mongo_retriever.get()).invoke(_checker_input(original))
+
+    return {"messages": [_check_llm_output(messages[-1], resp)]}
+
+
+async def acheck_query(state: dict):
+    """Async variant of `check_query`."""
+    messages = state.get("messages", [])
+    checked = _check_locally(messages[-1])
+    if checked is not None:
+        return {"messages": [checked]}
+
+    original = messages[-1].tool_calls[0]["args"]["query"]
+    resp = await _query_checker(await mongo_retriever.aget()).ainvoke(_checker_input(original))
+
+    return {"messages": [_check_llm_output(messages[-1], resp)]}
+
+
+def _execution_plan(state: dict):
+    """(tool call, collection, pipeline) for the query to run, or an error message."""
+    call = state.get("messages", [])[-1].tool_calls[0]
+    try:
+        collection, pipeline = parse_query(call["args"]["query"])
+        pipeline = validate_pipeline(
+            collection,
+            pipeline,
+            settings.ALLOWED_COLLECTIONS,
+            default_limit=settings.MQL_DEFAULT_LIMIT,
+            max_limit=settings.MQL_MAX_LIMIT,
+        )
+    except (MQLParseError, MQLValidationError) as e:
+        return call, None, None, f"Error: {e}"
+    return call, collection, pipeline, None
+
+
+def _query_result(call: dict, content: str, stats: dict) -> dict:
+    logger.info(
+        f"MongoDB query on '{stats['collection']}': {stats['rows_returned']} rows kept of "
+        f"{stats['docs_returned']} read from the cursor, {stats['execution_ms']} ms"
+    )
+    if stats["error"]:
+        record_error("mongodb.timeout" if stats["timed_out"] else "mongodb.aggregate")
+    message = ToolMessage(
+        content=content,
+        name="mongodb_query",
+        tool_call_id=call["id"],
+        status="error" if stats["error"] else "success",
     )
-    resp.id = messages[-1].id
+    return {"messages": [message], "query_stats": [stats]}
 
-    return {"messages": [resp]}
 
+def _rejected_run(call: dict, collection: str, error: str) -> dict:
+    stats = query_executor.empty_stats(collection)
+    stats["error"] = error
+    return _query_result(call, error, stats)
 
-def format_answer(state: dict):
+
+def run_query(state: dict):
+    """Execute the validated pipeline with time, row and byte limits"""
+    call, collection, pipeline, error = _execution_plan(state)
+    if error:
+        return _rejected_run(call, collection, error)
+
+    with observe("mongodb", "aggregate"):
+        content, stats = query_executor.run(get_database().delegate, collection, pipeline)
+    return _query_result(call, content, stats)
+
+
+async def arun_query(state: dict):
+    """Async variant of `run_query` on the Motor client."""
+    call, collection, pipeline, error = _execution_plan(state)
+    if error:
+        return _rejected_run(call, collection, error)
+
+    with observe("mongodb", "aggregate"):
+        content, stats = await query_executor.arun(get_database(), collection, pipeline)
+    return _query_result(call, content, stats)
+
+
+format_chain = ChatPromptTemplate.from_template(FORMAT_SYS) | fast_llm | StrOutputParser()
+
+
+def _shape(state: dict):
     messages = state.get("messages", [])
     # print("messages check query:", messages)
-    raw_json = messages[-1].content
-    question = state.get("query", "the user's query")
+    stats = (state.get("query_stats") or [{}])[-1]
+    shaped = shape_result(
+        messages[-1].content,
+        token_budget=settings.FORMAT_TOKEN_BUDGET,
+        max_rows=settings.FORMAT_MAX_ROWS,
+        truncated_at=stats.get("rows_returned") if stats.get("truncated") else None,
+    )
 
-    try:
-        data = json.loads(raw_json)
-        docs_str = json.dumps(data, indent=2)
+    logger.info(
+        f"Query result: {shaped.total_rows} rows, showing {shaped.shown_rows} as {shaped.format} "
+        f"(~{shaped.tokens} tokens, raw ~{shaped.raw_tokens})"
+    )
+    prompt_savings.record("format_answer", shaped.raw_tokens, shaped.tokens)
+    return shaped
 
-    except Exception:
-        docs_str = raw_json
 
-    print("==================================================")
-    print("Raw query result:", docs_str)
+def _format_input(state: dict, shaped) -> dict:
+    question = state.get("query", "the user's query")
+    return {"question": question, "docs": shaped.docs}
 
-    format_prompt = ChatPromptTemplate.from_template(FORMAT_SYS)
 
-    format_chain = format_prompt | fast_llm | StrOutputParser()
+def format_answer(state: dict):
+    shaped = _shape(state)
+    if shaped.empty:
+        # Không cần gọi LLM cho kết quả rỗng
+        return {"messages": [AIMessage(content=EMPTY_RESULT_ANSWER)]}
 
-    response = format_chain.invoke({"question": question, "docs": docs_str})
+    response = format_chain.invoke(_format_input(state, shaped))
 
     return {"messages": [AIMessage(content=response)]}
 
 
-# def format_answer(state: dict):
-#     """Enhanced format function with large dataset handling"""
-#     import json
-
-#     raw_json = state["messages"][-1].content
-#     question = state.get("query", "the user's query")
-
-#     try:
-#         data = json.loads(raw_json)
-
-#         if isinstance(data, list):
-#             data_size = len(data)
-
-#             if data_size == 0:
-#                 return {
-#                     "messages": [
-#                         AIMessage(
-#                             content=f'**Answer to:** "{question}"\n\nI couldn\'t find any matching documents.'
-#                         )
-#                     ]
-#                 }
-
-#             elif data_size > 50:  # Large dataset threshold
-#                 # Show first 10 + summary
-#                 sample_data = data[:10]
-#                 response_parts = [
-#                     f'**Answer to:** "{question}"',
-#                     f"Found **{data_size}** results. Showing first 10:",
-#                     "",
-#                 ]
-
-#                 for i, item in enumerate(sample_data, 1):
-#                     if isinstance(item, dict) and "_id" in item:
-#                         if "movieCount" in item:
-#                             response_parts.append(
-#                                 f"{i}. {item['_id']}: {item['movieCount']} movies"
-#                             )
-#                         else:
-#                             response_parts.append(f"{i}. {item['_id']}")
-
-#                 response_parts.extend(
-#                     [
-#                         "",
-#                         f"... and {data_size - 10} more results.",
-#                         "💡 **Tip**: Try 'Show me the top 10...' for more manageable results",
-#                     ]
-#                 )
-
-#                 formatted_response = "\n".join(response_parts)
-
-#             else:  # Normal size dataset
-#                 response_parts = [f'**Answer to:** "{question}"', ""]
-#                 for i, item in enumerate(data, 1):
-#                     if isinstance(item, dict) and "_id" in item:
-#                         if "movieCount" in item:
-#                             response_parts.append(
-#                                 f"{i}. {item['_id']}: {item['movieCount']} movies"
-#                             )
-#                         else:
-#                             response_parts.append(f"{i}. {item['_id']}")
-
-#                 formatted_response = "\n".join(response_parts)
-#         else:
-#             formatted_response = f'**Answer to:** "{question}"\n\n{data!s}'
-
-#     except Exception as e:
-#         # Graceful error handling
-#         formatted_response = f"**Answer to:** \"{question}\"\n\n⚠️ Large dataset found but too big to display. Try limiting your query (e.g., 'top 10', 'first 5')."
-
-#     return {"messages": [AIMessage(content=formatted_response)]}
+async def aformat_answer(state: dict):
+    shaped = _shape(state)
+    if shaped.empty:
+        return {"messages": [AIMessage(content=EMPTY_RESULT_ANSWER)]}
+
+    response = await format_chain.ainvoke(_format_input(state, shaped))
+
+    return {"messages": [AIMessage(content=response)]}
 
 
 def need_checker(state: dict) -> Literal["generate_query", "check_query"]:
@@ -193,25 +382,49 @@ def need_checker(state: dict) -> Literal["generate_query", "check_query"]:
     return "check_query" if messages[-1].tool_calls else "generate_query"
 
 
-def build_mongo_app():
-    mongo_retriever = MongoDBRetriever(mql_llm)
+def need_run(state: dict) -> Literal["run_query", "format_answer"]:
+    """Conditional edge: only run queries that passed validation"""
+    messages = state.get("messages", [])
+    return "run_query" if messages[-1].tool_calls else "format_answer"
+
+
+def need_format(state: dict) -> Literal["generate_query", "format_answer"]:
+    """Conditional edge: regenerate once when a cached pipeline came back empty"""
+    return "generate_query" if state.get("regenerate") else "format_answer"
+
 
+def need_generation(state: dict) -> Literal["generate_query", "run_query"]:
+    """Conditional edge: skip both LLM hops on a pipeline cache hit"""
+    return "run_query" if state.get("cached_query") else "generate_query"
+
+
+def build_mongo_app():
     mongo_flow = StateGraph(MongoState)
 
+    # Each IO-bound node carries an async twin so the flow can be driven
+    # with ainvoke/astream without parking a worker thread per request.
     mongo_flow.add_node("list_collections", list_collections)
-    mongo_flow.add_node("call_get_schema", call_get_schema)
-    mongo_flow.add_node("get_schema", mongo_retriever.schema_node)
-    mongo_flow.add_node("generate_query", generate_query)
-    mongo_flow.add_node("check_query", check_query)
-    mongo_flow.add_node("run_query", mongo_retriever.run_node)
-    mongo_flow.add_node("format_answer", format_answer)
+    mongo_flow.add_node(
+        "call_get_schema", RunnableLambda(call_get_schema, afunc=acall_get_schema)
+    )
+    mongo_flow.add_node(
+        "generate_query", RunnableLambda(generate_query, afunc=agenerate_query)
+    )
+    mongo_flow.add_node("check_query", RunnableLambda(check_query, afunc=acheck_query))
+    mongo_flow.add_node("lookup_query", lookup_query)
+    mongo_flow.add_node("run_query", RunnableLambda(run_query, afunc=arun_query))
+    mongo_flow.add_node("remember_query", remember_query)
+    mongo_flow.add_node(
+        "format_answer", RunnableLambda(format_answer, afunc=aformat_answer)
+    )
 
     mongo_flow.set_entry_point("list_collections")
     mongo_flow.add_edge("list_collections", "call_get_schema")
-    mongo_flow.add_edge("call_get_schema", "get_schema")
-    mongo_flow.add_edge("get_schema", "generate_query")
+    mongo_flow.add_edge("call_get_schema", "lookup_query")
+    mongo_flow.add_conditional_edges("lookup_query", need_generation)
     mongo_flow.add_conditional_edges("generate_query", need_checker)
-    mongo_flow.add_edge("check_query", "run_query")
-    mongo_flow.add_edge("run_query", "format_answer")
+    mongo_flow.add_conditional_edges("check_query", need_run)
+    mongo_flow.add_edge("run_query", "remember_query")
+    mongo_flow.add_conditional_edges("remember_query", need_format)
 
     return mongo_flow.compile()
@@ -0,0 +1,129 @@
+"""Bounded execution of validated aggregation pipelines.
+
+Replaces the `mongodb_query` ToolNode, which ran pipelines through the
+synchronous `MongoDBDatabase` with no time limit and serialized the whole
+result at once. Here every pipeline runs with a server-side `maxTimeMS`,
+the cursor is consumed batch by batch, and reading stops as soon as either
+the document cap or the serialized byte cap is reached, so a bad generated
+pipeline can neither pin the database nor blow up process memory.
+
+The async path uses Motor; the sync path (graph `invoke`) uses the pymongo
+client Motor wraps, so both share one connection pool.
+"""
+
+import logging
+import time
+from typing import Optional
+
+from bson import json_util
+from pymongo.errors import ExecutionTimeout, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class QueryExecutor:
+    """Runs one aggregation with time, document and byte limits."""
+
+    def __init__(
+        self,
+        max_time_ms: int = 5000,
+        max_docs: int = 200,
+        max_bytes: int = 256 * 1024,
+        batch_size: int = 50,
+    ):
+        self.max_time_ms = max_time_ms
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+
+    def _aggregate_options(self) -> dict:
+        return {"maxTimeMS": self.max_time_ms, "batchSize": self.batch_size}
+
+    def empty_stats(self, collection: str) -> dict:
+        return {
+            "collection": collection,
+            "docs_returned": 0,  # số document server trả về cursor (không phải số document server đã quét)
+            "rows_returned": 0,  # số document giữ lại trong kết quả
+            "bytes_returned": 0,
+            "execution_ms": 0.0,
+            "truncated": False,
+            "timed_out": False,
+            "error": None,
+        }
+
+    def _accept(self, doc: dict, rows: list[str], stats: dict) -> bool:
+        """Serialize one document; False once a cap has been reached."""
+        stats["docs_returned"] += 1
+        if stats["rows_returned"] >= self.max_docs:
+            stats["truncated"] = True
+            return False
+
+        row = json_util.dumps(doc, ensure_ascii=False)
+        size = len(row.encode("utf-8"))
+        if stats["bytes_returned"] + size > self.max_bytes:
+            stats["truncated"] = True
+            return False
+
+        rows.append(row)
+        stats["rows_returned"] += 1
+        stats["bytes_returned"] += size
+        return True
+
+    def _finish(self, rows: list[str], stats: dict, started: float) -> tuple[str, dict]:
+        stats["execution_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if stats["truncated"]:
+            logger.info(
+                f"Query on '{stats['collection']}' truncated at "
+                f"{stats['rows_returned']} rows / {stats['bytes_returned']} bytes."
+            )
+        return "[" + ",\n".join(rows) + "]", stats
+
+    def _failed(self, error: Exception, stats: dict, started: float) -> tuple[str, dict]:
+        stats["execution_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if isinstance(error, ExecutionTimeout):
+            stats["timed_out"] = True
+            message = f"Error: query exceeded the {self.max_time_ms} ms time limit"
+        else:
+            message = f"Error: {error}"
+        stats["error"] = message
+        logger.warning(f"Query on '{stats['collection']}' failed: {message}")
+        return message, stats
+
+    def run(self, database, collection: str, pipeline: list) -> tuple[str, dict]:
+        """Execute on a pymongo `Database`; returns (JSON array text, stats)."""
+        stats = self.empty_stats(collection)
+        rows: list[str] = []
+        started = time.perf_counter()
+        cursor = None
+        try:
+            cursor = database[collection].aggregate(pipeline, **self._aggregate_options())
+            for doc in cursor:
+                if not self._accept(doc, rows, stats):
+                    break
+        except PyMongoError as e:
+            return self._failed(e, stats, started)
+        finally:
+            if cursor is not None:
+                cursor.close()
+        return self._finish(rows, stats, started)
+
+    async def arun(self, database, collection: str, pipeline: list) -> tuple[str, dict]:
+        """Execute on a Motor `AsyncIOMotorDatabase`; returns (JSON array text, stats)."""
+        stats = self.empty_stats(collection)
+        rows: list[str] = []
+        started = time.perf_counter()
+        cursor: Optional[object] = None
+        try:
+            cursor = database[collection].aggregate(pipeline, **self._aggregate_options())
+            while True:
+                batch = await cursor.to_list(length=self.batch_size)
+                if not batch:
+                    break
+                if not all(self._accept(doc, rows, stats) for doc in batch):
+                    break
+        except PyMongoError as e:
+            return self._failed(e, stats, started)
+        finally:
+            if cursor is not None:
+                await cursor.close()
+        return self._finish(rows, stats, started)
@@ -0,0 +1,394 @@
+"""Deterministic parser and validator for LLM-generated MongoDB queries.
+
+`generate_query` emits JavaScript-style shell commands such as
+
+    db.products.aggregate([{ $match: { price: { $gt: 100 } } }, ...])
+
+This module parses them into Python objects without any `eval`, checks every
+stage and operator against an allow-list, enforces `ALLOWED_COLLECTIONS`,
+injects or clamps `$limit`, and re-serializes the command in the
+Python-literal form the `mongodb_query` tool accepts.
+"""
+
+import json
+import re
+from datetime import datetime, timezone
+from typing import Any
+
+from bson import ObjectId
+
+
+class MQLParseError(ValueError):
+    """The command could not be parsed; the LLM checker may still fix it."""
+
+
+class MQLValidationError(ValueError):
+    """The command parsed but is not allowed to run."""
+
+
+ALLOWED_STAGES = {
+    "$match", "$project", "$group", "$sort", "$limit", "$skip", "$unwind",
+    "$lookup", "$count", "$addFields", "$set", "$unset", "$facet",
+    "$sortByCount", "$replaceRoot", "$replaceWith", "$bucket", "$bucketAuto",
+    "$sample", "$graphLookup", "$unionWith", "$densify", "$fill",
+    "$setWindowFields",
+}
+
+# Stage có thể làm tăng số dòng (hoặc kích thước dòng) sau một $limit
+FAN_OUT_STAGES = {"$unwind", "$lookup", "$graphLookup", "$unionWith", "$densify"}
+
+# Stage nào cũng không được phép: ghi dữ liệu hoặc chạy code JS trên server
+FORBIDDEN_OPERATORS = {"$out", "$merge", "$where", "$function", "$accumulator"}
+
+ALLOWED_OPERATORS = {
+    # query
+    "$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin", "$and", "$or",
+    "$nor", "$not", "$exists", "$type", "$regex", "$options", "$elemMatch",
+    "$size", "$all", "$expr", "$mod", "$text", "$search", "$language",
+    "$caseSensitive", "$diacriticSensitive",
+    # accumulators
+    "$sum", "$avg", "$min", "$max", "$first", "$last", "$push", "$addToSet",
+    "$count", "$stdDevPop", "$stdDevSamp", "$top", "$bottom", "$topN",
+    "$bottomN", "$firstN", "$lastN", "$maxN", "$minN", "$median", "$percentile",
+    # arithmetic
+    "$add", "$subtract", "$multiply", "$divide", "$round", "$trunc", "$abs",
+    "$ceil", "$floor", "$pow", "$sqrt", "$exp", "$ln", "$log", "$log10",
+    # strings
+    "$concat", "$toLower", "$toUpper", "$substr", "$substrCP", "$substrBytes",
+    "$strLenCP", "$strLenBytes", "$split", "$trim", "$ltrim", "$rtrim",
+    "$indexOfCP", "$regexMatch", "$regexFind", "$regexFindAll", "$replaceOne",
+    "$replaceAll", "$strcasecmp",
+    # dates
+    "$dateToString", "$dateFromString", "$dateDiff", "$dateAdd",
+    "$dateSubtract", "$dateTrunc", "$year", "$month", "$dayOfMonth",
+    "$dayOfWeek", "$dayOfYear", "$week", "$hour", "$minute", "$second",
+    "$isoWeek", "$isoWeekYear", "$isoDayOfWeek",
+    # conditionals / types
+    "$cond", "$ifNull", "$switch", "$cmp", "$toString", "$toInt", "$toLong",
+    "$toDouble", "$toDecimal", "$toBool", "$toDate", "$toObjectId", "$convert",
+    "$isNumber", "$literal", "$let",
+    # arrays / objects
+    "$arrayElemAt", "$filter", "$map", "$reduce", "$slice", "$concatArrays",
+    "$isArray", "$indexOfArray", "$reverseArray", "$sortArray", "$range",
+    "$zip", "$arrayToObject", "$objectToArray", "$mergeObjects", "$getField",
+    "$setField", "$setUnion", "$setIntersection", "$setDifference",
+    "$setEquals", "$setIsSubset", "$anyElementTrue", "$allElementsTrue",
+    # window ($setWindowFields) / misc
+    "$rand", "$documentNumber", "$rank", "$denseRank", "$shift",
+    "$expMovingAvg", "$derivative", "$integral", "$covariancePop",
+    "$covarianceSamp", "$locf", "$linearFill",
+}
+
+_COMMAND = re.compile(
+    r"""^\s*db\.(?:getCollection\(\s*(["'])(?P<quoted>[^"']+)\1\s*\)|(?P<name>[A-Za-z_][\w-]*))"""
+    r"""\s*\.\s*aggregate\s*\((?P<body>.*)\)\s*;?\s*$""",
+    re.DOTALL,
+)
+_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+_IDENT = re.compile(r"[A-Za-z_$][\w$.]*")
+
+
+class _Parser:
+    """Recursive-descent parser for the JavaScript literal subset LLMs emit."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pos = 0
+
+    def error(self, message: str):
+        snippet = self.text[max(0, self.pos - 20): self.pos + 20]
+        raise MQLParseError(f"{message} at position {self.pos}: ...{snippet}...")
+
+    def skip(self):
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if ch.isspace():
+                self.pos += 1
+            elif self.text.startswith("//", self.pos):
+                end = self.text.find("\n", self.pos)
+                self.pos = len(self.text) if end == -1 else end
+            elif self.text.startswith("/*", self.pos):
+                end = self.text.find("*/", self.pos)
+                if end == -1:
+                    self.error("Unterminated comment")
+                self.pos = end + 2
+            else:
+                break
+
+    def peek(self) -> str:
+        self.skip()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            self.error(f"Expected '{ch}'")
+        self.pos += 1
+
+    def parse(self) -> Any:
+        value = self.value()
+        if self.peek():
+            self.error("Unexpected trailing input")
+        return value
+
+    def value(self) -> Any:
+        ch = self.peek()
+        if ch == "{":
+            return self.object()
+        if ch == "[":
+            return self.array()
+        if ch in "\"'":
+            return self.string()
+        if ch == "/":
+            return self.regex()
+        if ch == "-" or ch == "." or ch.isdigit():
+            return self.number()
+        if ch and (ch.isalpha() or ch in "_$"):
+            return self.identifier()
+        self.error("Unexpected token")
+
+    def object(self) -> dict:
+        self.expect("{")
+        result = {}
+        while self.peek() != "}":
+            ch = self.peek()
+            if ch in "\"'":
+                key = self.string()
+            else:
+                m = _IDENT.match(self.text, self.pos) or _NUMBER.match(self.text, self.pos)
+                if not m:
+                    self.error("Expected object key")
+                key = m.group(0)
+                self.pos = m.end()
+            self.expect(":")
+            result[key] = self.value()
+            if self.peek() == ",":
+                self.pos += 1
+            elif self.peek() != "}":
+                self.error("Expected ',' or '}'")
+        self.pos += 1
+        return result
+
+    def array(self) -> list:
+        self.expect("[")
+        result = []
+        while self.peek() != "]":
+            result.append(self.value())
+            if self.peek() == ",":
+                self.pos += 1
+            elif self.peek() != "]":
+                self.error("Expected ',' or ']'")
+        self.pos += 1
+        return result
+
+    def string(self) -> str:
+        quote = self.text[self.pos]
+        self.pos += 1
+        chars = []
+        escapes = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "/": "/"}
+        while self.pos < len(self.text):
+            ch = self.text[self.pos]
+            if ch == "\\":
+                nxt = self.text[self.pos + 1: self.pos + 2]
+                if nxt == "u":
+                    digits = self.text[self.pos + 2: self.pos + 6]
+                    if not re.fullmatch(r"[0-9A-Fa-f]{4}", digits):
+                        self.error(f"Invalid unicode escape '\\u{digits}'")
+                    chars.append(chr(int(digits, 16)))
+                    self.pos += 6
+                    continue
+                chars.append(escapes.get(nxt, nxt))
+                self.pos += 2
+                continue
+            if ch == quote:
+                self.pos += 1
+                return "".join(chars)
+            chars.append(ch)
+            self.pos += 1
+        self.error("Unterminated string")
+
+    def regex(self) -> dict:
+        m = re.compile(r"/((?:\\.|[^/\\\n])+)/([a-z]*)").match(self.text, self.pos)
+        if not m:
+            self.error("Invalid regular expression")
+        self.pos = m.end()
+        result = {"$regex": m.group(1)}
+        if m.group(2):
+            result["$options"] = m.group(2)
+        return result
+
+    def number(self):
+        m = _NUMBER.match(self.text, self.pos)
+        if not m:
+            self.error("Invalid number")
+        self.pos = m.end()
+        text = m.group(0)
+        return float(text) if any(c in text for c in ".eE") else int(text)
+
+    def call_args(self) -> list:
+        self.expect("(")
+        args = []
+        while self.peek() != ")":
+            args.append(self.value())
+            if self.peek() == ",":
+                self.pos += 1
+        self.pos += 1
+        return args
+
+    def identifier(self) -> Any:
+        m = _IDENT.match(self.text, self.pos)
+        if not m:
+            self.error("Expected identifier")
+        name = m.group(0)
+        self.pos = m.end()
+
+        if name in ("true", "True"):
+            return True
+        if name in ("false", "False"):
+            return False
+        if name in ("null", "None", "undefined"):
+            return None
+        if name == "new":
+            self.skip()
+            return self.identifier()
+        if self.peek() != "(":
+            self.error(f"Unknown identifier '{name}'")
+
+        args = self.call_args()
+        if name in ("ISODate", "Date"):
+            if not args:
+                return datetime.now(timezone.utc)
+            try:
+                return datetime.fromisoformat(str(args[0]).replace("Z", "+00:00"))
+            except ValueError:
+                self.error(f"Invalid date {args[0]!r}")
+        if name == "ObjectId" and len(args) == 1:
+            try:
+                return ObjectId(str(args[0]))
+            except Exception:
+                self.error(f"Invalid ObjectId {args[0]!r}")
+        if name in ("NumberInt", "NumberLong", "NumberDecimal") and len(args) == 1:
+            try:
+                return float(args[0]) if name == "NumberDecimal" else int(args[0])
+            except (TypeError, ValueError):
+                self.error(f"Invalid {name} argument {args[0]!r}")
+        self.error(f"Unsupported function '{name}'")
+
+
+def parse_query(command: str) -> tuple[str, list]:
+    """Split `db.<collection>.aggregate([...])` into (collection, pipeline)."""
+    m = _COMMAND.match(command or "")
+    if m is None:
+        raise MQLParseError("Expected a command of the form db.<collection>.aggregate([...])")
+
+    collection = m.group("quoted") or m.group("name")
+    pipeline = _Parser(m.group("body")).parse()
+    if isinstance(pipeline, dict):
+        pipeline = [pipeline]
+    if not isinstance(pipeline, list):
+        raise MQLParseError("Aggregation pipeline must be a list of stages")
+    return collection, pipeline
+
+
+def _check_operators(node: Any, allowed_collections: list[str]):
+    if isinstance(node, list):
+        for item in node:
+            _check_operators(item, allowed_collections)
+        return
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        if key.startswith("$"):
+            if key in FORBIDDEN_OPERATORS:
+                raise MQLValidationError(f"Operator {key} is not allowed")
+            if key not in ALLOWED_OPERATORS and key not in ALLOWED_STAGES:
+                raise MQLValidationError(f"Unknown operator {key}")
+        _check_operators(value, allowed_collections)
+
+
+def _check_stages(pipeline: list, allowed_collections: list[str]):
+    for stage in pipeline:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise MQLValidationError(f"Each stage must be an object with one operator: {stage!r}")
+        name, spec = next(iter(stage.items()))
+        if name in FORBIDDEN_OPERATORS:
+            raise MQLValidationError(f"Stage {name} is not allowed")
+        if name not in ALLOWED_STAGES:
+            raise MQLValidationError(f"Unknown stage {name}")
+
+        # Các stage đọc collection khác cũng phải nằm trong ALLOWED_COLLECTIONS
+        if name in ("$lookup", "$graphLookup", "$unionWith"):
+            target = spec if isinstance(spec, str) else (spec or {}).get("from") or (spec or {}).get("coll")
+            if target is not None and target not in allowed_collections:
+                raise MQLValidationError(f"Collection '{target}' is not allowed in {name}")
+            if isinstance(spec, dict) and isinstance(spec.get("pipeline"), list):
+                _check_stages(spec["pipeline"], allowed_collections)
+        if name == "$facet" and isinstance(spec, dict):
+            for sub_pipeline in spec.values():
+                if not isinstance(sub_pipeline, list):
+                    raise MQLValidationError("$facet values must be pipelines")
+                _check_stages(sub_pipeline, allowed_collections)
+
+    _check_operators(pipeline, allowed_collections)
+
+
+def validate_pipeline(
+    collection: str,
+    pipeline: list,
+    allowed_collections: list[str],
+    default_limit: int,
+    max_limit: int,
+) -> list:
+    """Check the pipeline and return it with a bounded top-level `$limit`.
+
+    Every `$limit` is clamped to `max_limit`. A `$limit` only bounds the
+    result if no fan-out stage ($unwind, $lookup, ...) follows it; otherwise
+    `default_limit` is appended as the last stage.
+    """
+    if collection not in allowed_collections:
+        raise MQLValidationError(f"Collection '{collection}' is not allowed")
+    _check_stages(pipeline, allowed_collections)
+
+    pipeline = [dict(stage) for stage in pipeline]
+    has_limit = False
+    for stage in pipeline:
+        if any(name in FAN_OUT_STAGES for name in stage):
+            has_limit = False
+        if "$limit" in stage:
+            has_limit = True
+            limit = stage["$limit"]
+            if not isinstance(limit, int) or limit <= 0:
+                raise MQLValidationError(f"Invalid $limit {limit!r}")
+            stage["$limit"] = min(limit, max_limit)
+    if not has_limit:
+        pipeline.append({"$limit": default_limit})
+    return pipeline
+
+
+def _serialize(value: Any) -> str:
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{json.dumps(str(k), ensure_ascii=False)}: {_serialize(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_serialize(v) for v in value) + "]"
+    if isinstance(value, bool) or value is None:
+        return repr(value)
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, datetime):
+        return f'ISODate("{value.isoformat()}")'
+    if isinstance(value, ObjectId):
+        return f'ObjectId("{value}")'
+    return json.dumps(str(value), ensure_ascii=False)
+
+
+def to_command(collection: str, pipeline: list) -> str:
+    """Render a pipeline as the Python-literal command `mongodb_query` expects."""
+    return f"db.{collection}.aggregate({_serialize(pipeline)})"
+
+
+def normalize_query(
+    command: str, allowed_collections: list[str], default_limit: int, max_limit: int
+) -> str:
+    """Parse, validate and re-serialize a generated command."""
+    collection, pipeline = parse_query(command)
+    pipeline = validate_pipeline(collection, pipeline, allowed_collections, default_limit, max_limit)
+    return to_command(collection, pipeline)
@@ -0,0 +1,186 @@
+"""Size-aware shaping of Mongo query results before they reach the LLM.
+
+`format_answer` used to paste the whole result, pretty-printed, into
+`FORMAT_SYS`. A "list all variants" question could send tens of thousands
+of tokens to `fast_llm`. Results are now measured first: small ones pass
+through unchanged, larger ones are cut to the top rows that fit the token
+budget, and numeric aggregates over *all* rows are computed locally so the
+answer can still state totals and ranges.
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from app.utils.table_encoder import CHARS_PER_TOKEN, EncodedRows, encode_rows, estimate_tokens
+
+EMPTY_RESULT_ANSWER = "Rất tiếc, mình không tìm thấy thông tin phù hợp với yêu cầu của bạn."
+
+
+@dataclass
+class ShapedResult:
+    docs: str                 # nội dung đưa vào {docs} của FORMAT_SYS
+    total_rows: int
+    shown_rows: int
+    tokens: int
+    raw_tokens: int           # kết quả dạng JSON thụt lề như trước đây
+    format: str = "text"      # "tsv" | "json" | "text"
+    aggregates: dict = field(default_factory=dict)
+
+    @property
+    def empty(self) -> bool:
+        return self.total_rows == 0
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    # Extended JSON của bson.json_util: {"$numberDecimal": "12.5"}, {"$numberLong": "7"}
+    if isinstance(value, dict) and len(value) == 1:
+        (key, inner), = value.items()
+        if key in ("$numberDecimal", "$numberLong", "$numberDouble"):
+            try:
+                return float(inner)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def numeric_aggregates(rows: list) -> dict:
+    """count/sum/min/max/avg for every top-level numeric field (except `_id`)."""
+    columns: dict[str, list[float]] = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        for key, value in row.items():
+            number = _number(value)
+            if key != "_id" and number is not None:
+                columns.setdefault(key, []).append(number)
+
+    aggregates = {}
+    for key, values in columns.items():
+        total = sum(values)
+        aggregates[key] = {
+            "count": len(values),
+            "sum": round(total, 4),
+            "min": min(values),
+            "max": max(values),
+            "avg": round(total / len(values), 4),
+        }
+    return aggregates
+
+
+def _clip(value: Any, cap: int) -> Any:
+    """`value` with strings cut to `cap` chars and arrays to a few items."""
+    if isinstance(value, str):
+        return value if len(value) <= cap else value[:cap] + "…"
+    if isinstance(value, list):
+        keep = max(1, cap // 16)
+        clipped = [_clip(v, cap) for v in value[:keep]]
+        return clipped + [f"… (+{len(value) - keep})"] if len(value) > keep else clipped
+    if isinstance(value, dict):
+        return {k: _clip(v, cap) for k, v in value.items()}
+    return value
+
+
+def _largest_fitting(render, longest: int, budget_chars: int) -> str:
+    """render(cap) for the largest cap that fits `budget_chars` (or the smallest cap)."""
+    low, high = 1, max(1, longest)
+    while low < high:
+        cap = (low + high + 1) // 2
+        if len(render(cap)) <= budget_chars:
+            low = cap
+        else:
+            high = cap - 1
+    return render(low)
+
+
+def _shrink_first_line(encoded: EncodedRows, first_row: Any, budget_chars: int) -> EncodedRows:
+    """Cut long values of the first row so that it alone stays within the budget."""
+    if encoded.format == "tsv":
+        cells = encoded.lines[0].split("\t")
+        line = _largest_fitting(
+            lambda cap: "\t".join(c if len(c) <= cap else c[:cap] + "…" for c in cells),
+            max(len(c) for c in cells),
+            budget_chars,
+        )
+    else:
+        line = _largest_fitting(
+            lambda cap: json.dumps(_clip(first_row, cap), ensure_ascii=False, default=str, separators=(",", ":")),
+            len(encoded.lines[0]),
+            budget_chars,
+        )
+    return EncodedRows(encoded.format, encoded.header, [line, *encoded.lines[1:]])
+
+
+def _fit_lines(lines: list[str], budget_chars: int, max_rows: int) -> int:
+    """Number of encoded rows, in result order, that fit the budget."""
+    count, used = 0, 0
+    for line in lines[:max_rows]:
+        if count and used + len(line) + 2 > budget_chars:
+            break
+        count += 1
+        used += len(line) + 2
+    return count
+
+
+def shape_result(
+    raw: str,
+    token_budget: int = 2000,
+    max_rows: int = 20,
+    truncated_at: Optional[int] = None,
+) -> ShapedResult:
+    """Fit a `run_query` result into `token_budget` tokens.
+
+    `truncated_at` is the row count at which `run_query` stopped reading,
+    when it hit its own document/byte cap.
+    """
+    raw = raw or ""
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        # Thông báo lỗi / văn bản thường: chỉ cắt theo ngân sách
+        text = raw[: token_budget * CHARS_PER_TOKEN]
+        return ShapedResult(text, 1, 1, estimate_tokens(text), estimate_tokens(raw))
+
+    rows = data if isinstance(data, list) else [data]
+    raw_tokens = estimate_tokens(json.dumps(rows, indent=2, ensure_ascii=False, default=str))
+    if not rows:
+        return ShapedResult("[]", 0, 0, 1, raw_tokens)
+
+    encoded = encode_rows(rows)
+    full = encoded.render()
+    if len(rows) <= max_rows and estimate_tokens(full) <= token_budget:
+        return ShapedResult(
+            full, len(rows), len(rows), estimate_tokens(full), raw_tokens, encoded.format
+        )
+
+    aggregates = numeric_aggregates(rows)
+    notes = []
+    if aggregates:
+        notes.append(f"Thống kê trên toàn bộ {len(rows)} dòng: {json.dumps(aggregates, ensure_ascii=False)}")
+    # Chừa chỗ cho header, phần thống kê và ghi chú
+    budget_chars = (
+        token_budget * CHARS_PER_TOKEN
+        - len(encoded.header or "")
+        - sum(len(n) for n in notes)
+        - 200
+    )
+    if encoded.lines and len(encoded.lines[0]) + 2 > budget_chars:
+        # Dòng đầu tiên luôn được hiển thị: rút gọn giá trị dài để không vượt ngân sách
+        encoded = _shrink_first_line(encoded, rows[0], budget_chars - 2)
+        notes.append("Một số giá trị dài ở dòng đầu đã được rút gọn (…).")
+    shown = _fit_lines(encoded.lines, budget_chars, max_rows)
+
+    remaining = len(rows) - shown
+    if remaining:
+        notes.append(f"... và {remaining} dòng khác không được hiển thị.")
+    if truncated_at is not None:
+        notes.append(f"Lưu ý: truy vấn đã bị giới hạn ở {truncated_at} dòng đầu tiên.")
+
+    docs = encoded.render(shown) + "\n\n" + "\n".join(notes)
+    return ShapedResult(
+        docs, len(rows), shown, estimate_tokens(docs), raw_tokens, encoded.format, aggregates
+    )
@@ -1,20 +1,51 @@
 from langchain_openai import ChatOpenAI
 
+from app.cache.embeddings import cached_embeddings
+from app.cache.llm import TieredLLMCache
+from app.core.config import settings
+from app.core.observability import metrics_handler
+
+
+def _response_cache(model: str):
+    """Per-model exact-match cache; None falls back to LangChain's default (no cache)."""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    return TieredLLMCache(
+        settings.LLM_CACHE_PATH,
+        namespace=model,
+        ttl=settings.LLM_CACHE_TTLS.get(model),
+        max_memory_entries=settings.LLM_CACHE_MEMORY_ENTRIES,
+        max_disk_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    )
+
+
 fast_llm = ChatOpenAI(
     model="fast-model",
     openai_api_base="http://localhost:4000",
     openai_api_key="sk-fake",
     temperature=0,
+    cache=_response_cache("fast-model"),
+    stream_usage=True,
+    callbacks=[metrics_handler],
 )
 best_llm = ChatOpenAI(
     model="best-model",
     openai_api_base="http://localhost:4000",
     openai_api_key="sk-fake",
     temperature=0,
+    cache=_response_cache("best-model"),
+    stream_usage=True,
+    callbacks=[metrics_handler],
 )
 mql_llm = ChatOpenAI(
     model="mql-model",
     openai_api_base="http://localhost:4000",
     openai_api_key="sk-fake",
     temperature=0,
+    cache=_response_cache("mql-model"),
+    stream_usage=True,
+    callbacks=[metrics_handler],
 )
+
+# Dùng chung instance với ContextualRAGBuilder (cùng model, cùng cache)
+embeddings = cached_embeddings("gemini-embedding-001")
@@ -1,38 +1,111 @@
+import json
+import logging
+import time
+
+from app.cache.semantic import SemanticAnswerCache
+from app.core.config import settings
+from app.core.lifecycle import subsystems
 from app.graph.flows.mongo_flow import build_mongo_app
-from app.graph.llms import best_llm, fast_llm
+from app.graph.llms import best_llm, embeddings, fast_llm
 from app.graph.prompts.prompts import (
     ANSWER_SYNTHESIS_PROMPT,
+    QUERY_PLANNER_PROMPT,
     QUERY_TRANSLATION,
     ROUTER_SYSTEM_PROMPT,
 )
 from app.graph.retrievers.internet import InternetRetriever
 from app.graph.retrievers.vectordb import VectorDBRetriever
+from app.graph.semantic_router import ROUTES, semantic_router
+from app.utils.docstore import store_generation
+from app.utils.table_encoder import compact_text, estimate_tokens, prompt_savings
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import (
+    adispatch_custom_event,
+    dispatch_custom_event,
+)
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import merge_configs
 
 from .state import ClassificationResult, GraphState
 
-vector_retriever = VectorDBRetriever()
-internet_retriever = InternetRetriever()
+logger = logging.getLogger(__name__)
+
+# Dựng lúc warmup (app.main lifespan) hoặc ở request đầu tiên cần tới, không dựng khi import
+vector_retriever = subsystems.register("vectordb", VectorDBRetriever)
+internet_retriever = subsystems.register("internet", InternetRetriever)
 mongo_app = build_mongo_app()
+answer_cache = SemanticAnswerCache(
+    embeddings,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttls=settings.SEMANTIC_CACHE_TTLS,
+    default_ttl=settings.SEMANTIC_CACHE_DEFAULT_TTL,
+    enabled=settings.SEMANTIC_CACHE_ENABLED,
+    generations={"vectordb_retriever": lambda: store_generation(settings.DOC_DIRECTORY)},
+    excluded_sources=settings.SEMANTIC_CACHE_EXCLUDED_SOURCES,
+)
 
+generate_queries_chain = (
+    ChatPromptTemplate.from_template(QUERY_TRANSLATION)
+    | fast_llm
+    | StrOutputParser()
+    | (lambda x: [q.strip() for q in x.split("\n") if q.strip()])
+)
 
-def query_translation(state: GraphState):
-    print("---NODE: QUERY TRANSLATION---")
+planner_chain = ChatPromptTemplate.from_template(QUERY_PLANNER_PROMPT) | fast_llm
+
+
+def cache_lookup(state: GraphState):
+    logger.info("---NODE: SEMANTIC CACHE LOOKUP---")
+    answer = answer_cache.lookup(state["question"])
+    if answer is None:
+        return {"cache_hit": False}
+    return {"cache_hit": True, "generation": answer}
+
+
+async def acache_lookup(state: GraphState):
+    logger.info("---NODE: SEMANTIC CACHE LOOKUP (async)---")
+    answer = await answer_cache.alookup(state["question"])
+    if answer is None:
+        return {"cache_hit": False}
+    return {"cache_hit": True, "generation": answer}
+
+
+def _answer_sources(state: GraphState) -> set[str]:
+    return {c["source"] for c in state.get("classifications") or []}
+
+
+def cache_store(state: GraphState):
+    answer_cache.store(state["question"], state.get("generation", ""), _answer_sources(state))
+    return {}
 
-    prompt_perspectives = ChatPromptTemplate.from_template(QUERY_TRANSLATION)
 
-    generate_queries_chain = (
-        prompt_perspectives
-        | fast_llm
-        | StrOutputParser()
-        | (lambda x: [q.strip() for q in x.split("\n") if q.strip()])
+async def acache_store(state: GraphState):
+    await answer_cache.astore(
+        state["question"], state.get("generation", ""), _answer_sources(state)
     )
+    return {}
 
-    questions = generate_queries_chain.invoke({"question": state.get("question")})
-    print("Generated query variations:")
+
+def _log_questions(questions: list[str]):
+    logger.info("Generated query variations:")
     for q in questions:
-        print(f"  - {q}")
+        logger.info(f"  - {q}")
+
+
+def query_translation(state: GraphState):
+    logger.info("---NODE: QUERY TRANSLATION---")
+    questions = generate_queries_chain.invoke({"question": state.get("question")})
+    _log_questions(questions)
+    return {"questions": questions}
+
+
+async def aquery_translation(state: GraphState):
+    logger.info("---NODE: QUERY TRANSLATION (async)---")
+    questions = await generate_queries_chain.ainvoke({"question": state.get("question")})
+    _log_questions(questions)
     return {"questions": questions}
 
 
@@ -59,108 +132,358 @@ def query_translation(state: GraphState):
 
 #     return {"classifications": all_classifications}
 
-def classify_query(state: GraphState) -> dict:
-    print("---NODE: QUERY CLASSIFICATION---")
-    questions_to_process = state.get("questions", [state["question"]])
+def _router_messages(q: str) -> list[dict]:
+    return [
+        {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
+        {"role": "user", "content": q},
+    ]
+
+
+def _extract_json_array(raw: str):
+    """Parse `raw` as JSON, falling back to the first [...] span inside it."""
+    # Thử parse JSON; fallback: tìm mảng JSON nằm trong văn bản
+    try:
+        return json.loads(raw)
+    except Exception:
+        # ví dụ expected format: [{"source":"mongodb_retriever","query":"..."}]
+        try:
+            # minimal safe fallback: look for JSON array inside text
+            start = raw.find("[")
+            end = raw.rfind("]") + 1
+            if start != -1 and end != -1 and end > start:
+                return json.loads(raw[start:end])
+        except Exception:
+            pass
+    return None
+
+
+def _parse_classification(resp, q: str) -> list[dict]:
+    """Turn one raw router response into classification entries for `q`."""
+    # Log token usage nếu có
+    if hasattr(resp, "usage_metadata") and resp.usage_metadata:
+        u = resp.usage_metadata
+        logger.debug(f"Classification tokens - In:{u.get('input_tokens',0)} Out:{u.get('output_tokens',0)} Total:{u.get('total_tokens',0)}")
+
+    raw = getattr(resp, "content", "") or str(resp)
+    classifications = []
+
+    parsed = _extract_json_array(raw)
+
+    if isinstance(parsed, list):
+        for item in parsed:
+            src = item.get("source") if isinstance(item, dict) else None
+            if src:
+                classifications.append({"source": src, "query": q})
+    else:
+        # Last-resort: if LLM returned plain text like "mongodb_retriever"
+        if "mongodb" in raw:
+            classifications.append({"source": "mongodb_retriever", "query": q})
+        elif "vector" in raw or "vectordb" in raw:
+            classifications.append({"source": "vectordb_retriever", "query": q})
+        elif "internet" in raw:
+            classifications.append({"source": "internet_retriever", "query": q})
+        elif "greeting" in raw:
+            classifications.append({"source": "greeting", "query": q})
+
+    return classifications
+
+
+def _questions_to_classify(state: GraphState) -> list[str]:
+    # query_translation có thể trả về rỗng khi câu hỏi gốc đủ rõ ràng
+    return state.get("questions") or [state["question"]]
+
+
+def _batch_config() -> dict:
+    return {"max_concurrency": settings.ROUTER_MAX_CONCURRENCY}
+
+
+def _merge_classifications(questions, local_routes, llm_responses) -> list[dict]:
+    """Combine local router answers with LLM answers, in question order."""
     all_classifications = []
+    llm_responses = iter(llm_responses)
+
+    for q, label in zip(questions, local_routes):
+        if label:
+            all_classifications.append({"source": label, "query": q})
+            continue
+
+        classifications = _parse_classification(next(llm_responses), q)
+        semantic_router.record(q, [c["source"] for c in classifications])
+        all_classifications.extend(classifications)
 
-    for q in questions_to_process:
-        # gọi LLM thô (không dùng with_structured_output)
-        resp = fast_llm.invoke(
-            [
-                {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
-                {"role": "user", "content": q},
-            ]
+    return all_classifications
+
+
+def classify_query(state: GraphState) -> dict:
+    logger.info("---NODE: QUERY CLASSIFICATION---")
+    questions_to_process = _questions_to_classify(state)
+
+    # Router cục bộ trả lời trước; chỉ câu hỏi chưa chắc chắn mới gọi LLM
+    local_routes = semantic_router.route_many(questions_to_process)
+    pending = [q for q, label in zip(questions_to_process, local_routes) if not label]
+
+    # gọi LLM thô (không dùng with_structured_output), tất cả câu hỏi con cùng lúc
+    responses = []
+    if pending:
+        responses = fast_llm.batch(
+            [_router_messages(q) for q in pending], config=_batch_config()
         )
 
-        # Log token usage nếu có
-        if hasattr(resp, "usage_metadata"):
-            u = resp.usage_metadata
-            print(f"  Classification tokens - In:{u.get('input_tokens',0)} Out:{u.get('output_tokens',0)} Total:{u.get('total_tokens',0)}")
+    return {
+        "classifications": _merge_classifications(
+            questions_to_process, local_routes, responses
+        )
+    }
 
-        raw = getattr(resp, "content", "") or str(resp)
 
-        # Thử parse JSON; fallback: tìm các dòng 'source: ...' bằng regex/simple parsing
-        parsed = None
-        try:
-            parsed = json.loads(raw)
-        except Exception:
-            # ví dụ expected format: [{"source":"mongodb_retriever","query":"..."}]
-            try:
-                # minimal safe fallback: look for JSON array inside text
-                start = raw.find("[")
-                end = raw.rfind("]") + 1
-                if start != -1 and end != -1 and end > start:
-                    parsed = json.loads(raw[start:end])
-            except Exception:
-                parsed = None
-
-        if isinstance(parsed, list):
-            for item in parsed:
-                src = item.get("source") if isinstance(item, dict) else None
-                if src:
-                    all_classifications.append({"source": src, "query": q})
-        else:
-            # Last-resort: if LLM returned plain text like "mongodb_retriever"
-            if "mongodb" in raw:
-                all_classifications.append({"source": "mongodb_retriever", "query": q})
-            elif "vector" in raw or "vectordb" in raw:
-                all_classifications.append({"source": "vectordb_retriever", "query": q})
-            elif "internet" in raw:
-                all_classifications.append({"source": "internet_retriever", "query": q})
-            elif "greeting" in raw:
-                all_classifications.append({"source": "greeting", "query": q})
-
-    return {"classifications": all_classifications}
-
-
-def vectordb_retriever(state: dict):
+async def aclassify_query(state: GraphState) -> dict:
+    logger.info("---NODE: QUERY CLASSIFICATION (async)---")
+    questions_to_process = _questions_to_classify(state)
+
+    local_routes = await semantic_router.aroute_many(questions_to_process)
+    pending = [q for q, label in zip(questions_to_process, local_routes) if not label]
+
+    responses = []
+    if pending:
+        responses = await fast_llm.abatch(
+            [_router_messages(q) for q in pending], config=_batch_config()
+        )
+
+    return {
+        "classifications": _merge_classifications(
+            questions_to_process, local_routes, responses
+        )
+    }
+
+
+def _parse_plan(resp) -> list[dict]:
+    """Turn the planner response into `{"source", "query"}` classifications."""
+    if hasattr(resp, "usage_metadata") and resp.usage_metadata:
+        u = resp.usage_metadata
+        logger.debug(f"Planner tokens - In:{u.get('input_tokens',0)} Out:{u.get('output_tokens',0)} Total:{u.get('total_tokens',0)}")
+
+    parsed = _extract_json_array(getattr(resp, "content", "") or str(resp))
+    if not isinstance(parsed, list):
+        return []
+
+    classifications = []
+    for item in parsed:
+        if not isinstance(item, dict):
+            continue
+        src, query = item.get("source"), (item.get("query") or "").strip()
+        if src in ROUTES and query:
+            classifications.append({"source": src, "query": query})
+    return classifications
+
+
+def _plan_result(question: str, classifications: list[dict]) -> dict:
+    for c in classifications:
+        semantic_router.record(c["query"], [c["source"]])
+    return {
+        "questions": list(dict.fromkeys(c["query"] for c in classifications)) or [question],
+        "classifications": classifications,
+    }
+
+
+def plan_query(state: GraphState) -> dict:
+    """Produce sub-questions and their sources in a single LLM call."""
+    logger.info("---NODE: QUERY PLANNER---")
+    question = state["question"]
+
+    classifications = _parse_plan(planner_chain.invoke({"question": question}))
+    if not classifications:
+        # Planner trả về sai định dạng: quay về router cho câu hỏi gốc
+        return classify_query({"question": question, "questions": [question]})
+
+    return _plan_result(question, classifications)
+
+
+async def aplan_query(state: GraphState) -> dict:
+    """Async variant of `plan_query`."""
+    logger.info("---NODE: QUERY PLANNER (async)---")
+    question = state["question"]
+
+    classifications = _parse_plan(await planner_chain.ainvoke({"question": question}))
+    if not classifications:
+        return await aclassify_query({"question": question, "questions": [question]})
+
+    return _plan_result(question, classifications)
+
+
+def _progress_event(source: str, documents: list, started: float) -> dict:
+    return {
+        "stage": "retrieved",
+        "source": source,
+        "documents": len(documents),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+def _report_progress(source: str, documents: list, started: float, config: RunnableConfig):
+    """Tell streaming clients that one retrieval branch has finished."""
+    dispatch_custom_event("progress", _progress_event(source, documents, started), config=config)
+
+
+async def _areport_progress(
+    source: str, documents: list, started: float, config: RunnableConfig
+):
+    # Python 3.10 không tự truyền context cho async, nên phải truyền config
+    await adispatch_custom_event(
+        "progress", _progress_event(source, documents, started), config=config
+    )
+
+
+def vectordb_retriever(state: dict, config: RunnableConfig):
+    query = state.get("query")
+    started = time.perf_counter()
+
+    logger.info("---NODE: VECTOR DB RETRIEVER---")
+    logger.info(f"Query: {query}")
+
+    documents = vector_retriever.get().retrieve(query)
+    documents_text = [doc.page_content for doc in documents]
+
+    _report_progress("vectordb_retriever", documents_text, started, config)
+    return {"documents": documents_text}
+
+
+async def avectordb_retriever(state: dict, config: RunnableConfig):
     query = state.get("query")
+    started = time.perf_counter()
 
-    print("---NODE: VECTOR DB RETRIEVER---")
-    print(f"Query: {query}")
+    logger.info("---NODE: VECTOR DB RETRIEVER (async)---")
+    logger.info(f"Query: {query}")
 
-    documents = vector_retriever.retrieve(query)
+    documents = await (await vector_retriever.aget()).aretrieve(query)
     documents_text = [doc.page_content for doc in documents]
 
+    await _areport_progress("vectordb_retriever", documents_text, started, config)
     return {"documents": documents_text}
 
 
-def internet_search_retriever(state: dict):
+def internet_search_retriever(state: dict, config: RunnableConfig):
     query = state.get("query")
-    print("---NODE: INTERNET SEARCH RETRIEVER---")
-    print(f"Query: {query}")
-    documents = internet_retriever.retrieve(query)
+    started = time.perf_counter()
+    logger.info("---NODE: INTERNET SEARCH RETRIEVER---")
+    logger.info(f"Query: {query}")
+    documents = internet_retriever.get().retrieve(query)
     documents_text = [doc.page_content for doc in documents]
+    _report_progress("internet_retriever", documents_text, started, config)
     return {"documents": documents_text}
 
 
-def mongodb_retriever(state: dict):
-    print("---NODE: MONGODB RETRIEVER---")
-    print(f"Query: {state.get('query')}")
+async def ainternet_search_retriever(state: dict, config: RunnableConfig):
+    query = state.get("query")
+    started = time.perf_counter()
+    logger.info("---NODE: INTERNET SEARCH RETRIEVER (async)---")
+    logger.info(f"Query: {query}")
+    documents = await (await internet_retriever.aget()).aretrieve(query)
+    documents_text = [doc.page_content for doc in documents]
+    await _areport_progress("internet_retriever", documents_text, started, config)
+    return {"documents": documents_text}
+
+
+def _mongo_input(state: dict) -> dict:
+    return {"query": state.get("query", ""), "messages": state.get("messages", [])}
+
+
+def mongodb_retriever(state: dict, config: RunnableConfig):
+    logger.info("---NODE: MONGODB RETRIEVER---")
+    logger.info(f"Query: {state.get('query')}")
+    started = time.perf_counter()
     # results = []
     documents = []
 
-    branch_result = mongo_app.invoke(
-        {"query": state.get("query", ""), "messages": state.get("messages", [])}
-    )
+    branch_result = mongo_app.invoke(_mongo_input(state), config)
 
     documents.append(branch_result.get("messages", [])[-1].content)
 
     # print ("MongoDB Retriever Result:", branch_result)
-    return {"documents": documents}
+    _report_progress("mongodb_retriever", documents, started, config)
+    return {"documents": documents, "query_stats": branch_result.get("query_stats", [])}
+
+
+async def amongodb_retriever(state: dict, config: RunnableConfig):
+    logger.info("---NODE: MONGODB RETRIEVER (async)---")
+    logger.info(f"Query: {state.get('query')}")
+    started = time.perf_counter()
+
+    branch_result = await mongo_app.ainvoke(_mongo_input(state), config)
+    documents = [branch_result.get("messages", [])[-1].content]
+
+    await _areport_progress("mongodb_retriever", documents, started, config)
+    return {
+        "documents": documents,
+        "query_stats": branch_result.get("query_stats", []),
+    }
+
 
 def greeting(state: dict):
-    print("---NODE: GREETING---")
+    logger.info("---NODE: GREETING---")
     return {"greeting": "Hello! How can I assist you today?"}
 
-def generate(state: GraphState):
+
+def _synthesis_prompt(state: GraphState) -> str:
     question = state.get("question", "")
     documents = state.get("documents", [])
 
-    docs_text = "\n\n".join(doc for doc in documents)
+    # Kết quả dạng mảng JSON được mã hoá lại thành bảng gọn hơn
+    compacted = [compact_text(doc) for doc in documents]
+    docs_text = "\n\n".join(doc for doc in compacted)
+    prompt_savings.record(
+        "answer_synthesis",
+        sum(estimate_tokens(doc) for doc in documents),
+        estimate_tokens(docs_text),
+    )
+
+    return ANSWER_SYNTHESIS_PROMPT.format(question=question, documents=docs_text)
+
+
+class _TokenTimer(BaseCallbackHandler):
+    """Time of the first streamed token and number of chunks, from callbacks."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.chunks = 0
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token and self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.chunks += 1
 
-    prompt = ANSWER_SYNTHESIS_PROMPT.format(question=question, documents=docs_text)
+    def metrics(self) -> dict:
+        finished = time.perf_counter()
+        # Không stream (cache hit, hoặc gọi invoke ngoài astream_events): token đầu đến cùng câu trả lời
+        first_token_at = self.first_token_at or finished
+        metrics = {
+            "ttft_ms": round((first_token_at - self.started) * 1000, 2),
+            "total_ms": round((finished - self.started) * 1000, 2),
+            "chunks": self.chunks,
+        }
+        logger.info(f"Generation: TTFT {metrics['ttft_ms']} ms, total {metrics['total_ms']} ms")
+        return metrics
+
+
+# invoke/ainvoke (không phải stream) để LLM cache của best-model được đọc và ghi;
+# dưới astream_events, token vẫn được stream qua callback tới SSE
+def generate(state: GraphState, config: RunnableConfig):
+    timer = _TokenTimer()
+    response = best_llm.invoke(_synthesis_prompt(state), merge_configs(config, {"callbacks": [timer]}))
+
+    metrics = timer.metrics()
+    dispatch_custom_event("generation_metrics", metrics, config=config)
+    return {"generation": response.content, "generation_metrics": metrics}
+
+
+async def agenerate(state: GraphState, config: RunnableConfig):
+    timer = _TokenTimer()
+    response = await best_llm.ainvoke(
+        _synthesis_prompt(state), merge_configs(config, {"callbacks": [timer]})
+    )
 
-    resp = best_llm.invoke(prompt)
-    return {"generation": resp.content}
+    metrics = timer.metrics()
+    await adispatch_custom_event("generation_metrics", metrics, config=config)
+    return {"generation": response.content, "generation_metrics": metrics}
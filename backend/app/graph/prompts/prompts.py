@@ -110,14 +110,51 @@ Bạn là một trợ lý chuyên định dạng kết quả truy vấn từ Mon
 
 Biến đầu vào
 • {question} - câu hỏi ngôn ngữ tự nhiên ban đầu của người dùng.
-• {docs} - mảng JSON chứa các tài liệu được trả về từ cơ sở dữ liệu.
+• {docs} - các tài liệu được trả về từ cơ sở dữ liệu, dạng bảng TSV (dòng đầu là tên cột) hoặc mảng JSON. Với kết quả lớn, đây chỉ là các dòng đầu tiên, kèm phần thống kê trên toàn bộ kết quả và số dòng còn lại.
 
 Nhiệm vụ:
 Hãy viết một câu trả lời ngắn gọn bằng định dạng Markdown:
 
 Trình bày các tài liệu một cách rõ ràng (sử dụng danh sách đánh số, bảng hoặc đoạn văn - bất kỳ định dạng nào phù hợp nhất với dữ liệu).
 
+Nếu có phần thống kê hoặc ghi chú "... và N dòng khác", hãy dùng số liệu thống kê cho các con số tổng hợp và nhắc người dùng rằng còn N dòng khác.
+
 Nếu mảng dữ liệu trống, hãy trả lời: "Rất tiếc, mình không tìm thấy thông tin phù hợp với yêu cầu của bạn."
 
 Lưu ý: TUYỆT ĐỐI KHÔNG hiển thị mã JSON thô trong câu trả lời.
-"""
\ No newline at end of file
+"""
+QUERY_PLANNER_PROMPT = """
+Bạn là bộ lập kế hoạch truy vấn cho hệ thống tư vấn của The Shate. Trong MỘT lần trả lời, hãy vừa chia nhỏ câu hỏi của người dùng thành các câu hỏi phụ, vừa chọn nguồn dữ liệu cho từng câu hỏi phụ.
+
+Các nguồn dữ liệu (CHỈ chọn từ 4 nguồn sau):
+
+'mongodb_retriever': Dữ liệu thực tế về sản phẩm (tồn kho, size, giá), chương trình khuyến mãi cụ thể hoặc các bản ghi hệ thống tại The Shate.
+
+'vectordb_retriever': Chính sách nội bộ, tài liệu hướng dẫn, quy trình bảo quản hoặc kiến thức tra cứu theo ngữ nghĩa.
+
+'internet_retriever': Tin tức thời gian thực, giá thị trường bên ngoài hoặc thông tin công cộng chung.
+
+'greeting': Câu chào hỏi, tán gẫu hoặc câu hỏi xã giao không cần truy xuất dữ liệu.
+
+QUY TẮC:
+
+Tạo từ 1 đến 3 câu hỏi phụ, mỗi câu độc lập và trả lời được riêng biệt.
+
+Nếu câu hỏi gốc đã đủ rõ ràng, dùng chính câu hỏi gốc làm câu hỏi phụ duy nhất.
+
+CHỈ trả về một mảng JSON, KHÔNG giải thích, KHÔNG dùng markdown.
+
+Định dạng:
+[{{"query": "<câu hỏi phụ>", "source": "<tên nguồn>"}}]
+
+Ví dụ:
+
+Câu hỏi đầu vào:
+Giày Nike size 42 còn hàng không và nếu không vừa thì đổi thế nào?
+
+Kết quả:
+[{{"query": "Giày Nike size 42 còn hàng không?", "source": "mongodb_retriever"}}, {{"query": "Chính sách đổi size giày như thế nào?", "source": "vectordb_retriever"}}]
+
+Câu hỏi đầu vào:
+{question}
+"""
@@ -1,9 +1,8 @@
-import os
-
-from langchain_cohere import CohereRerank
 from langchain_tavily import TavilySearch
 from langchain_core.documents import Document
 from app.core.config import settings
+from app.core.observability import observe
+from app.graph.retrievers.rerankers import build_reranker
 
 class InternetRetriever:
     def __init__(self):
@@ -13,13 +12,25 @@ class InternetRetriever:
             topic="general",
         )
 
-        self.compressor = CohereRerank(
-            cohere_api_key=os.getenv("COHERE_API_KEY"), 
-            model="rerank-multilingual-v3.0",
-            top_n=self.top_n
-        )
+        self.compressor = build_reranker(self.top_n)
     def retrieve(self, query: str):
-        search_result = self.tavily_search_tool.invoke(query)
+        with observe("tavily", "search"):
+            search_result = self.tavily_search_tool.invoke(query)
+        documents = self._to_documents(search_result)
+
+        # Compressor expects Document objects
+        with observe(self.compressor.name, "rerank"):
+            compressed_docs = self.compressor.compress_documents(documents, query)
+        return compressed_docs
+
+    async def aretrieve(self, query: str):
+        with observe("tavily", "search"):
+            search_result = await self.tavily_search_tool.ainvoke(query)
+        documents = self._to_documents(search_result)
+        with observe(self.compressor.name, "rerank"):
+            return await self.compressor.acompress_documents(documents, query)
+
+    def _to_documents(self, search_result: dict):
         documents = []
         for result in search_result.get("results", []):
             content = result.get("content", "")
@@ -32,7 +43,4 @@ class InternetRetriever:
                 metadata={"title": title, "url": url, "source": "internet"}
             )
             documents.append(doc)
-        
-        # Compressor expects Document objects
-        compressed_docs = self.compressor.compress_documents(documents, query)
-        return compressed_docs
\ No newline at end of file
+        return documents
@@ -0,0 +1,278 @@
+"""Pluggable rerankers for the vector DB and internet retrievers.
+
+`settings.RERANKER` selects the primary implementation:
+
+- "cohere": `CohereRerank` (multilingual v3), one network hop per query.
+- "cross_encoder": a multilingual cross-encoder run locally on CPU, in
+  batches. Needs the optional `sentence-transformers` package.
+- "lexical": BM25 over the candidate set with the Vietnamese tokenizer.
+  It can be blended with embedding cosine (`RERANK_EMBEDDING_WEIGHT`). It
+  is cheap enough to also serve as the fallback.
+
+`build_reranker` wraps the primary in `BudgetedReranker`. When
+`RERANK_BUDGET_MS` is set and the primary takes longer, or when it fails,
+the query is answered with the lexical ranking. This keeps a slow Cohere
+from setting our tail latency. The budget is off by default, so callers
+wait for the primary.
+
+With `RERANKER=cross_encoder` the model is registered as a subsystem, so
+startup warmup loads it before the first request instead of letting early
+queries time out while it loads.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from pydantic import ConfigDict, PrivateAttr
+
+from app.core.config import settings
+from app.core.lifecycle import subsystems
+from app.core.observability import record_error
+from app.utils.vi_tokenizer import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+def _ranked(documents: Sequence[Document], scores: Sequence[float], top_n: int) -> list[Document]:
+    """Top `top_n` copies of `documents` with `relevance_score` set, best first."""
+    order = sorted(range(len(documents)), key=lambda i: -scores[i])[:top_n]
+    ranked = []
+    for i in order:
+        doc = documents[i]
+        ranked.append(
+            Document(
+                page_content=doc.page_content,
+                metadata={**doc.metadata, "relevance_score": float(scores[i])},
+            )
+        )
+    return ranked
+
+
+class LexicalReranker(BaseDocumentCompressor):
+    """BM25 over the candidates, optionally blended with embedding cosine."""
+
+    top_n: int = 3
+    k1: float = 1.5
+    b: float = 0.75
+    embeddings: Any = None
+    embedding_weight: float = 0.0
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _lexical_scores(self, documents: Sequence[Document], query: str) -> np.ndarray:
+        query_terms = set(tokenize(query))
+        doc_terms = [Counter(tokenize(d.page_content)) for d in documents]
+        lengths = np.array([sum(t.values()) for t in doc_terms], dtype=np.float32)
+        avg_length = float(lengths.mean()) or 1.0
+
+        scores = np.zeros(len(documents), dtype=np.float32)
+        for term in query_terms:
+            df = sum(1 for t in doc_terms if term in t)
+            if not df:
+                continue
+            idf = math.log1p((len(documents) - df + 0.5) / (df + 0.5))
+            tf = np.array([t.get(term, 0) for t in doc_terms], dtype=np.float32)
+            scores += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * lengths / avg_length))
+        # Đưa về [0, 1] để trộn được với cosine
+        peak = scores.max() if len(scores) else 0.0
+        return scores / peak if peak > 0 else scores
+
+    def _blend(self, lexical: np.ndarray, query_vector, doc_vectors) -> np.ndarray:
+        q = np.asarray(query_vector, dtype=np.float32)
+        d = np.asarray(doc_vectors, dtype=np.float32)
+        cosine = d @ q / (np.linalg.norm(d, axis=1) * np.linalg.norm(q) + 1e-9)
+        w = self.embedding_weight
+        return (1 - w) * lexical + w * cosine
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        scores = self._lexical_scores(documents, query)
+        if self.embeddings is not None and self.embedding_weight > 0:
+            scores = self._blend(
+                scores,
+                self.embeddings.embed_query(query),
+                self.embeddings.embed_documents([d.page_content for d in documents]),
+            )
+        return _ranked(documents, scores, self.top_n)
+
+    async def acompress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        scores = self._lexical_scores(documents, query)
+        if self.embeddings is not None and self.embedding_weight > 0:
+            query_vector, doc_vectors = await asyncio.gather(
+                self.embeddings.aembed_query(query),
+                self.embeddings.aembed_documents([d.page_content for d in documents]),
+            )
+            scores = self._blend(scores, query_vector, doc_vectors)
+        return _ranked(documents, scores, self.top_n)
+
+
+def load_cross_encoder(model_name: str, max_length: int = 512):
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        raise ImportError(
+            "Could not import sentence_transformers, please install with "
+            "`pip install sentence-transformers` or use RERANKER=lexical."
+        )
+    model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+    logger.info(f"Loaded cross-encoder {model_name}")
+    return model
+
+
+class CrossEncoderReranker(BaseDocumentCompressor):
+    """Local multilingual cross-encoder, scored in batches on CPU."""
+
+    top_n: int = 3
+    model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+    batch_size: int = 16
+    max_length: int = 512
+
+    # Lazy dùng chung (đã đăng ký warmup); None: tự load ở lần gọi đầu
+    model_handle: Any = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _model: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def _encoder(self):
+        if self.model_handle is not None:
+            return self.model_handle.get()
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = load_cross_encoder(self.model_name, self.max_length)
+        return self._model
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        scores = self._encoder().predict(
+            [(query, d.page_content) for d in documents],
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+        )
+        return _ranked(documents, scores, self.top_n)
+
+    async def acompress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        # Tính toán CPU thuần: chạy ở thread để không chặn event loop
+        return await asyncio.to_thread(self.compress_documents, documents, query)
+
+
+# Thread riêng cho nhánh sync: lần gọi chậm vẫn chạy nốt nhưng request không phải chờ
+_budget_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rerank")
+
+
+class BudgetedReranker(BaseDocumentCompressor):
+    """Runs `primary` within `budget_ms`; falls back to `fallback` on timeout or error."""
+
+    primary: BaseDocumentCompressor
+    fallback: BaseDocumentCompressor
+    name: str = "rerank"
+    budget_ms: Optional[float] = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _fall_back(self, outcome: str, detail: str, documents, query):
+        logger.warning(f"Reranker {self.name} {detail}; using {type(self.fallback).__name__}")
+        record_error(f"rerank.{self.name}.{outcome}")
+        return self.fallback.compress_documents(documents, query)
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        if not self.budget_ms:
+            try:
+                return self.primary.compress_documents(documents, query)
+            except Exception as e:
+                return self._fall_back("error", f"failed ({e})", documents, query)
+        future = _budget_pool.submit(self.primary.compress_documents, documents, query)
+        try:
+            return future.result(timeout=self.budget_ms / 1000)
+        except FutureTimeout:
+            return self._fall_back("timeout", f"exceeded {self.budget_ms:.0f} ms", documents, query)
+        except Exception as e:
+            return self._fall_back("error", f"failed ({e})", documents, query)
+
+    async def acompress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        if not documents:
+            return []
+        try:
+            return await asyncio.wait_for(
+                self.primary.acompress_documents(documents, query),
+                timeout=self.budget_ms / 1000 if self.budget_ms else None,
+            )
+        except asyncio.TimeoutError:
+            return self._fall_back("timeout", f"exceeded {self.budget_ms:.0f} ms", documents, query)
+        except Exception as e:
+            return self._fall_back("error", f"failed ({e})", documents, query)
+
+
+# Load model lúc warmup, cùng lúc với các retriever
+cross_encoder_model = (
+    subsystems.register("cross_encoder", lambda: load_cross_encoder(settings.RERANK_MODEL))
+    if settings.RERANKER == "cross_encoder"
+    else None
+)
+
+
+def _lexical(top_n: int) -> LexicalReranker:
+    embeddings = None
+    if settings.RERANK_EMBEDDING_WEIGHT > 0:
+        from app.graph.llms import embeddings
+    return LexicalReranker(
+        top_n=top_n, embeddings=embeddings, embedding_weight=settings.RERANK_EMBEDDING_WEIGHT
+    )
+
+
+def build_reranker(top_n: int) -> BudgetedReranker:
+    """Reranker selected by `settings.RERANKER`, guarded by the latency budget."""
+    kind = settings.RERANKER
+    if kind == "cohere":
+        from langchain_cohere import CohereRerank
+
+        primary = CohereRerank(
+            cohere_api_key=os.getenv("COHERE_API_KEY"),
+            model="rerank-multilingual-v3.0",
+            top_n=top_n,
+        )
+    elif kind == "cross_encoder":
+        primary = CrossEncoderReranker(
+            top_n=top_n, model_name=settings.RERANK_MODEL, model_handle=cross_encoder_model
+        )
+    elif kind == "lexical":
+        primary = _lexical(top_n)
+    else:
+        raise ValueError(f"Unknown reranker: {kind}")
+
+    return BudgetedReranker(
+        primary=primary,
+        # Fallback thuần lexical: không gọi embedding qua mạng khi primary đang chậm
+        fallback=LexicalReranker(top_n=top_n),
+        name=kind,
+        budget_ms=settings.RERANK_BUDGET_MS if kind != "lexical" else None,
+    )
@@ -1,9 +1,7 @@
-import os
-
-from langchain_classic.retrievers import ContextualCompressionRetriever
 from app.utils.indexing import ContextualRAGBuilder
 from app.core.config import settings
-from langchain_cohere import CohereRerank
+from app.core.observability import observe
+from app.graph.retrievers.rerankers import build_reranker
 
 
 class VectorDBRetriever:
@@ -12,23 +10,28 @@ class VectorDBRetriever:
         self.top_n = settings.RERANK_TOP_N
         self.base_retriever = self._build_base_retriever()
 
-        self.compressor = CohereRerank(
-            cohere_api_key=os.getenv("COHERE_API_KEY"),
-            model="rerank-multilingual-v3.0",
-            top_n=self.top_n,
-        )
-
-        self.retriever = ContextualCompressionRetriever(
-            base_retriever=self.base_retriever, base_compressor=self.compressor
-        )
+        self.compressor = build_reranker(self.top_n)
 
     def _build_base_retriever(self):
         builder = ContextualRAGBuilder()
 
-        all_docs = builder.load_documents(self.doc_path)
+        # Chroma và BM25 đều đã được dựng sẵn: chỉ đọc toàn bộ tài liệu khi phải dựng lại
+        all_docs = None
+        if not builder.vector_store_exists():
+            all_docs = builder.load_documents(self.doc_path)
         vector_db = builder.build_vector_store(all_docs)
 
-        return builder.create_ensemble_retriever(vector_db, all_docs)
+        return builder.create_hybrid_retriever(vector_db, all_docs, self.doc_path)
 
+    # Tách hai bước của ContextualCompressionRetriever để đo riêng từng dịch vụ
     def retrieve(self, query: str):
-        return self.retriever.invoke(query)
+        with observe("chroma_bm25", "search"):
+            documents = self.base_retriever.invoke(query)
+        with observe(self.compressor.name, "rerank"):
+            return self.compressor.compress_documents(documents, query)
+
+    async def aretrieve(self, query: str):
+        with observe("chroma_bm25", "search"):
+            documents = await self.base_retriever.ainvoke(query)
+        with observe(self.compressor.name, "rerank"):
+            return await self.compressor.acompress_documents(documents, query)
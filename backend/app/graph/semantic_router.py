@@ -0,0 +1,299 @@
+"""In-process query router that skips the LLM classification hop.
+
+Each route label gets a centroid built from embedded example questions: the
+seed examples below plus past LLM routing decisions logged by
+`classify_query`. When a question is close enough to one centroid (and
+clearly closer than to the runner-up) we answer locally; everything else
+falls through to `fast_llm`.
+
+Train / refresh the centroids with:
+
+    python -m app.graph.semantic_router train
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.graph.llms import embeddings
+
+logger = logging.getLogger(__name__)
+
+ROUTES = ("mongodb_retriever", "vectordb_retriever", "internet_retriever", "greeting")
+
+# Câu hỏi mẫu để router có thể hoạt động ngay cả khi chưa có log định tuyến
+SEED_EXAMPLES = {
+    "mongodb_retriever": [
+        "Giày Nike Air Force 1 size 42 còn hàng không?",
+        "Tổng số lượng hàng tồn kho của shop?",
+        "Có những mã khuyến mãi nào đang hoạt động?",
+        "Sản phẩm nào có giá cao nhất?",
+        "Mẫu giày này có những màu nào?",
+        "Liệt kê các biến thể của sản phẩm có mã SP001",
+    ],
+    "vectordb_retriever": [
+        "Chính sách đổi trả trong bao lâu?",
+        "Điều kiện bảo hành giày là gì?",
+        "Làm sao để chọn size giày phù hợp?",
+        "Cách bảo quản giày da như thế nào?",
+        "Tôi có được đổi hàng nếu đã mang rồi không?",
+        "Phí vận chuyển khi đổi trả ai chịu?",
+    ],
+    "internet_retriever": [
+        "Xu hướng giày sneaker năm nay là gì?",
+        "Giá thị trường của giày Jordan 1 hiện nay?",
+        "Tin tức mới nhất về Adidas",
+        "Thời tiết hôm nay ở Hà Nội thế nào?",
+    ],
+    "greeting": [
+        "Xin chào",
+        "Chào shop",
+        "Cảm ơn bạn nhiều",
+        "Bạn là ai?",
+        "Bây giờ là mấy giờ?",
+    ],
+}
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class SemanticRouter:
+    """Nearest-centroid classifier over query embeddings."""
+
+    def __init__(
+        self,
+        embedder,
+        centroids_path: str,
+        log_path: str,
+        threshold: float,
+        margin: float,
+        enabled: bool = True,
+        log_max_bytes: int = 5_000_000,
+        log_backups: int = 3,
+    ):
+        self.embedder = embedder
+        self.centroids_path = centroids_path
+        self.log_path = log_path
+        self.threshold = threshold
+        self.margin = margin
+        self.enabled = enabled
+        self.log_max_bytes = log_max_bytes
+        self.log_backups = log_backups
+
+        self.labels: list[str] = []
+        self.centroids: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._decision_log: Optional[logging.Logger] = None
+
+        self.load()
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self.centroids is not None
+
+    def load(self):
+        """Load trained centroids from disk, if any."""
+        if not os.path.exists(self.centroids_path):
+            logger.info(f"No router centroids at {self.centroids_path}; LLM routing only.")
+            return
+
+        with open(self.centroids_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        self.labels = data["labels"]
+        self.centroids = _normalize(np.asarray(data["centroids"], dtype=np.float32))
+        logger.info(f"Loaded router centroids for {len(self.labels)} routes.")
+
+    def _decide(self, vectors: np.ndarray) -> list[Optional[str]]:
+        sims = _normalize(vectors) @ self.centroids.T
+        decisions = []
+        for row in sims:
+            order = np.argsort(row)[::-1]
+            best = row[order[0]]
+            runner_up = row[order[1]] if len(order) > 1 else -1.0
+            if best >= self.threshold and best - runner_up >= self.margin:
+                decisions.append(self.labels[order[0]])
+            else:
+                decisions.append(None)
+        return decisions
+
+    def _count(self, decisions: list[Optional[str]]):
+        with self._lock:
+            for label in decisions:
+                if label is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+
+    def route_many(self, questions: list[str]) -> list[Optional[str]]:
+        """Return a label per question, or None where the LLM should decide."""
+        if not self.ready or not questions:
+            return [None] * len(questions)
+        try:
+            vectors = np.asarray(self.embedder.embed_documents(questions), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"Semantic routing skipped: {e}")
+            return [None] * len(questions)
+
+        decisions = self._decide(vectors)
+        self._count(decisions)
+        return decisions
+
+    async def aroute_many(self, questions: list[str]) -> list[Optional[str]]:
+        """Async variant of `route_many`."""
+        if not self.ready or not questions:
+            return [None] * len(questions)
+        try:
+            vectors = np.asarray(
+                await self.embedder.aembed_documents(questions), dtype=np.float32
+            )
+        except Exception as e:
+            logger.warning(f"Semantic routing skipped: {e}")
+            return [None] * len(questions)
+
+        decisions = self._decide(vectors)
+        self._count(decisions)
+        return decisions
+
+    def _decisions(self) -> Optional[logging.Logger]:
+        """Logger writing to the rotating routing log from a background thread."""
+        with self._lock:
+            if self._decision_log is None:
+                try:
+                    os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+                    handler = logging.handlers.RotatingFileHandler(
+                        self.log_path,
+                        maxBytes=self.log_max_bytes,
+                        backupCount=self.log_backups,
+                        encoding="utf-8",
+                    )
+                except OSError as e:
+                    logger.warning(f"Could not open routing log: {e}")
+                    return None
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                # QueueHandler chỉ đưa bản ghi vào hàng đợi: không ghi file trên event loop
+                records: queue.SimpleQueue = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(records, handler)
+                listener.start()
+                # Ghi nốt các bản ghi còn trong hàng đợi khi tắt tiến trình
+                atexit.register(listener.stop)
+                decision_log = logging.getLogger(f"{__name__}.decisions.{id(self)}")
+                decision_log.setLevel(logging.INFO)
+                decision_log.propagate = False
+                decision_log.addHandler(logging.handlers.QueueHandler(records))
+                self._decision_log = decision_log
+            return self._decision_log
+
+    def record(self, question: str, sources: list[str]):
+        """Log an LLM routing decision so it can be used for the next training run."""
+        labels = {s for s in sources if s in ROUTES}
+        # Chỉ học từ các quyết định một nguồn duy nhất
+        if len(labels) != 1:
+            return
+        decision_log = self._decisions()
+        if decision_log is not None:
+            decision_log.info(json.dumps({"question": question, "source": labels.pop()}, ensure_ascii=False))
+
+    def _log_files(self) -> list[str]:
+        """The routing log and its rotated backups, oldest first."""
+        backups = [f"{self.log_path}.{i}" for i in range(self.log_backups, 0, -1)]
+        return [path for path in backups + [self.log_path] if os.path.exists(path)]
+
+    def _training_examples(self, include_seed: bool) -> dict[str, list[str]]:
+        examples = defaultdict(list)
+        if include_seed:
+            for label, questions in SEED_EXAMPLES.items():
+                examples[label].extend(questions)
+
+        for path in self._log_files():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if item.get("source") in ROUTES and item.get("question"):
+                        examples[item["source"]].append(item["question"])
+
+        # Bỏ trùng lặp, giữ thứ tự
+        return {label: list(dict.fromkeys(qs)) for label, qs in examples.items() if qs}
+
+    def train(self, include_seed: bool = True) -> dict:
+        """Rebuild centroids from seed examples and the routing log."""
+        examples = self._training_examples(include_seed)
+        if not examples:
+            raise ValueError("No training examples found for the semantic router.")
+
+        labels, centroids = [], []
+        for label, questions in examples.items():
+            vectors = np.asarray(self.embedder.embed_documents(questions), dtype=np.float32)
+            centroids.append(_normalize(vectors).mean(axis=0))
+            labels.append(label)
+
+        os.makedirs(os.path.dirname(self.centroids_path) or ".", exist_ok=True)
+        with open(self.centroids_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "labels": labels,
+                    "centroids": np.asarray(centroids).tolist(),
+                    "counts": {label: len(qs) for label, qs in examples.items()},
+                },
+                f,
+            )
+
+        self.load()
+        return {label: len(qs) for label, qs in examples.items()}
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "routes": self.labels,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+semantic_router = SemanticRouter(
+    embeddings,
+    centroids_path=settings.ROUTER_CENTROIDS_PATH,
+    log_path=settings.ROUTER_LOG_PATH,
+    threshold=settings.ROUTER_CONFIDENCE,
+    margin=settings.ROUTER_MARGIN,
+    enabled=settings.SEMANTIC_ROUTER_ENABLED,
+    log_max_bytes=settings.ROUTER_LOG_MAX_BYTES,
+    log_backups=settings.ROUTER_LOG_BACKUPS,
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Manage the semantic query router.")
+    parser.add_argument("command", choices=["train", "stats"])
+    parser.add_argument("--no-seed", action="store_true", help="Train on the routing log only.")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        counts = semantic_router.train(include_seed=not args.no_seed)
+        for label, n in counts.items():
+            print(f"{label}: {n} examples")
+    else:
+        print(json.dumps(semantic_router.stats(), indent=2))
@@ -21,9 +21,16 @@ class GraphState(TypedDict):
     documents: Annotated[list[str], operator.add]
     # loop_step: int          # Đếm số lần lặp lại (quan trọng!)
     classifications: list[Classification] 
+    cache_hit: bool         # True nếu câu trả lời lấy từ semantic cache
+    query_stats: Annotated[list[dict], operator.add]  # thống kê các truy vấn MongoDB đã chạy
+    generation_metrics: dict  # TTFT và tổng thời gian sinh câu trả lời (ms)
     # sub_query: str             # Câu hỏi con hiện tại đang được xử lý
     # messages: list[BaseMessage]         
 
 class MongoState(TypedDict):
     query: str
-    messages: Annotated[list, operator.add]
\ No newline at end of file
+    messages: Annotated[list, operator.add]
+    cached_query: bool      # True nếu pipeline lấy từ pipeline cache
+    regenerate: bool        # pipeline từ cache không trả về dòng nào: sinh lại bằng LLM
+    mql_started_at: float   # mốc thời gian bắt đầu sinh pipeline bằng LLM
+    query_stats: Annotated[list[dict], operator.add]  # số document đọc từ cursor / giữ lại, thời gian chạy
\ No newline at end of file
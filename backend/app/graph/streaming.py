@@ -0,0 +1,72 @@
+"""Server-sent events over the RAG graph for the chat frontend.
+
+Maps `astream_events` (v2) onto three event types:
+
+- `progress`: a retrieval branch finished (source, documents, elapsed_ms)
+- `token`: a chunk of the final answer from the `generate` node
+- `done`: the final answer plus request-level latency numbers
+"""
+
+import json
+import logging
+import time
+from typing import AsyncIterator
+
+from app.graph.workflow import app_graph
+
+logger = logging.getLogger(__name__)
+
+# Chỉ stream token của node tổng hợp câu trả lời, không phải của các LLM trung gian
+ANSWER_NODE = "generate"
+
+
+def _sse(event: str, data: dict) -> dict:
+    return {"event": event, "data": json.dumps(data, ensure_ascii=False)}
+
+
+async def stream_answer_events(question: str) -> AsyncIterator[dict]:
+    started = time.perf_counter()
+    first_token_ms = None
+    generation_metrics = None
+
+    try:
+        async for event in app_graph.astream_events({"question": question}, version="v2"):
+            kind = event["event"]
+
+            if kind == "on_custom_event" and event["name"] == "progress":
+                yield _sse("progress", event["data"])
+
+            elif kind == "on_custom_event" and event["name"] == "generation_metrics":
+                generation_metrics = event["data"]
+
+            elif (
+                kind == "on_chat_model_stream"
+                and event["metadata"].get("langgraph_node") == ANSWER_NODE
+            ):
+                content = event["data"]["chunk"].content
+                if not content:
+                    continue
+                if first_token_ms is None:
+                    first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+                yield _sse("token", {"content": content})
+
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                # Sự kiện kết thúc của chính graph gốc
+                output = event["data"].get("output") or {}
+                total_ms = round((time.perf_counter() - started) * 1000, 2)
+                logger.info(
+                    f"Streamed answer: first token {first_token_ms} ms, total {total_ms} ms"
+                )
+                yield _sse(
+                    "done",
+                    {
+                        "generation": output.get("generation", ""),
+                        "cache_hit": bool(output.get("cache_hit")),
+                        "first_token_ms": first_token_ms,
+                        "total_ms": total_ms,
+                        "generation_metrics": generation_metrics,
+                    },
+                )
+    except Exception as e:
+        logger.exception("Streaming answer failed")
+        yield _sse("error", {"message": str(e)})
@@ -1,7 +1,30 @@
 from langgraph.graph import END, StateGraph
+from app.core.config import settings
+from app.core.observability import metrics_handler
 from app.graph.state import GraphState
-from app.graph.nodes import classify_query, query_translation, vectordb_retriever, internet_search_retriever, mongodb_retriever, greeting, generate
-from app.graph.edges import route_to_agents
+from app.graph.nodes import (
+    acache_lookup,
+    acache_store,
+    aclassify_query,
+    agenerate,
+    ainternet_search_retriever,
+    amongodb_retriever,
+    aplan_query,
+    aquery_translation,
+    avectordb_retriever,
+    cache_lookup,
+    cache_store,
+    classify_query,
+    generate,
+    greeting,
+    internet_search_retriever,
+    mongodb_retriever,
+    plan_query,
+    query_translation,
+    vectordb_retriever,
+)
+from app.graph.edges import route_after_cache, route_to_agents
+from langchain_core.runnables import RunnableLambda
 # from app.graph.nodes import *
 # from app.graph.edges import *
 
@@ -9,20 +32,48 @@ from app.graph.edges import route_to_agents
 workflow = StateGraph(GraphState)
 
 # 2. Thêm các Node chính
-workflow.add_node("query_translation", query_translation)
-workflow.add_node("classify_query", classify_query)
-workflow.add_node("vectordb_retriever", vectordb_retriever)
-workflow.add_node("internet_retriever", internet_search_retriever)
-workflow.add_node("mongodb_retriever", mongodb_retriever)
+# Mỗi node có cả bản sync và async: invoke() dùng bản sync,
+# ainvoke()/astream() (langserve /rag) dùng bản async.
+workflow.add_node("cache_lookup", RunnableLambda(cache_lookup, afunc=acache_lookup))
+workflow.add_node("cache_store", RunnableLambda(cache_store, afunc=acache_store))
+if settings.USE_QUERY_PLANNER:
+    # Một lần gọi LLM trả về cả câu hỏi phụ lẫn nguồn dữ liệu
+    workflow.add_node("plan_query", RunnableLambda(plan_query, afunc=aplan_query))
+    router_node = "plan_query"
+else:
+    workflow.add_node(
+        "query_translation", RunnableLambda(query_translation, afunc=aquery_translation)
+    )
+    workflow.add_node(
+        "classify_query", RunnableLambda(classify_query, afunc=aclassify_query)
+    )
+    router_node = "classify_query"
+workflow.add_node(
+    "vectordb_retriever", RunnableLambda(vectordb_retriever, afunc=avectordb_retriever)
+)
+workflow.add_node(
+    "internet_retriever",
+    RunnableLambda(internet_search_retriever, afunc=ainternet_search_retriever),
+)
+workflow.add_node(
+    "mongodb_retriever", RunnableLambda(mongodb_retriever, afunc=amongodb_retriever)
+)
 workflow.add_node("greeting", greeting)
-workflow.add_node("generate", generate)
+workflow.add_node("generate", RunnableLambda(generate, afunc=agenerate))
 
 # 5. Thiết lập luồng đi
-workflow.set_entry_point("query_translation")
-workflow.add_edge("query_translation", "classify_query")
+# Semantic cache đứng trước toàn bộ pipeline: hit thì trả lời ngay
+workflow.set_entry_point("cache_lookup")
+workflow.add_conditional_edges(
+    "cache_lookup",
+    route_after_cache,
+    {"hit": END, "miss": "plan_query" if settings.USE_QUERY_PLANNER else "query_translation"},
+)
+if not settings.USE_QUERY_PLANNER:
+    workflow.add_edge("query_translation", "classify_query")
 # workflow.set_entry_point("classify_query")
 workflow.add_conditional_edges(
-    "classify_query",
+    router_node,
     route_to_agents,
     ["mongodb_retriever", "vectordb_retriever", "internet_retriever","greeting"]
 )
@@ -30,10 +81,12 @@ workflow.add_edge("mongodb_retriever", "generate")
 workflow.add_edge("vectordb_retriever", "generate")
 workflow.add_edge("internet_retriever", "generate")
 workflow.add_edge("greeting", "generate")
-workflow.add_edge("generate", END)
+workflow.add_edge("generate", "cache_store")
+workflow.add_edge("cache_store", END)
 
 # 6. Compile và Chạy
-app_graph = workflow.compile(debug=True)
+# Callback đo thời gian từng node / LLM và ghi trace cho mỗi request
+app_graph = workflow.compile(debug=True).with_config(callbacks=[metrics_handler])
 
 # if __name__ == "__main__":
 #     result = app_workflow.invoke({
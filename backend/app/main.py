@@ -1,22 +1,53 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 from typing import List
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from langserve import add_routes
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sse_starlette.sse import EventSourceResponse
 
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import get_database, init_db
+from app.core.lifecycle import subsystems
 from app.models.models import User
-from app.utils.schema_helper import get_all_schemas
+from app.utils.schema_helper import schema_registry
 from app.schemas import GraphInput
 from app.graph.workflow import app_graph
+from app.graph.streaming import stream_answer_events
+from app.graph.semantic_router import semantic_router
+from app.graph.llms import embeddings
+from app.graph.nodes import answer_cache
+from app.graph.flows.mongo_flow import pipeline_cache
+from app.utils.table_encoder import prompt_savings
+
+logging.basicConfig(
+    level=settings.LOG_LEVEL,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
+subsystems.record("import", _IMPORT_STARTED)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    started = time.perf_counter()
     await init_db()
+    await schema_registry.refresh(get_database())
+    subsystems.record("startup", started)
+
+    # Không chờ warmup: server nhận request ngay, /ready báo khi retriever đã sẵn sàng
+    warmup = asyncio.create_task(subsystems.warmup()) if settings.WARMUP_ON_STARTUP else None
     yield
-    pass
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -41,6 +72,12 @@ async def health_check():
         "database": "connected"
     }
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 503 until every critical subsystem is warmed up."""
+    status = subsystems.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.get("/users", response_model=List[User])
 async def get_users():
     users = await User.find_all().to_list()
@@ -48,7 +85,50 @@ async def get_users():
 
 @app.get("/db_schema", response_model=str)
 async def get_db_schema():
-    return get_all_schemas()
+    await schema_registry.aensure_fresh(get_database())
+    return schema_registry.render()
+
+@app.post("/db_schema/refresh", response_model=str)
+async def refresh_db_schema():
+    await schema_registry.refresh(get_database())
+    return schema_registry.render()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus: latency theo node / dịch vụ ngoài, token LLM, lỗi."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/router/stats")
+async def get_router_stats():
+    return semantic_router.stats()
+
+@app.get("/prompts/stats")
+async def get_prompt_stats():
+    return prompt_savings.stats()
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return answer_cache.stats()
+
+@app.get("/cache/embeddings/stats")
+async def get_embedding_cache_stats():
+    if not hasattr(embeddings, "stats"):
+        return {"enabled": False}
+    return embeddings.stats()
+
+@app.get("/cache/pipelines/stats")
+async def get_pipeline_cache_stats():
+    return pipeline_cache.stats()
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(source: Optional[str] = None):
+    """Drop cached answers built from `source` (all answers if omitted)."""
+    return {"invalidated": answer_cache.invalidate(source)}
+
+@app.post("/chat/stream")
+async def chat_stream(payload: GraphInput):
+    """SSE cho frontend: progress từng nguồn, token của câu trả lời, rồi done."""
+    return EventSourceResponse(stream_answer_events(payload.question))
 
 typed_graph = app_graph.with_types(input_type=GraphInput)
 
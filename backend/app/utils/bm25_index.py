@@ -0,0 +1,179 @@
+"""Inverted-index BM25 with NumPy scoring over posting lists.
+
+`rank_bm25` (behind `BM25Retriever`) scores every document for every
+query. Here postings are stored in CSR form: `indptr[t]:indptr[t + 1]`
+slices `doc_ids`/`weights` for term `t`. A query only touches the postings of
+its own terms, so its cost grows with the number of matches, not with the
+corpus size. Tokenization defaults to `vi_tokenizer.tokenize`.
+
+The retriever can hold either the documents themselves or just their ids
+plus a `JsonlDocStore`. In the second case only the hits of a query are
+read from disk.
+"""
+
+import logging
+from typing import Any, Callable, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from app.utils.hybrid_retriever import chunk_key
+from app.utils.vi_tokenizer import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class BM25Index:
+    """Okapi BM25 over a CSR inverted index."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: dict[str, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)  # phần tf đã chuẩn hoá độ dài, tính sẵn
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.num_docs = 0
+
+    @classmethod
+    def build(cls, corpus: Iterable[List[str]], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1=k1, b=b)
+
+        # corpus có thể là generator: mỗi danh sách token được bỏ đi ngay sau khi đếm
+        postings: dict[int, dict[int, int]] = {}
+        doc_lengths: list[int] = []
+        for doc_id, tokens in enumerate(corpus):
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term = index.vocabulary.setdefault(token, len(index.vocabulary))
+                counts = postings.setdefault(term, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        index.num_docs = len(doc_lengths)
+        lengths = np.asarray(doc_lengths, dtype=np.float32)
+        num_terms = len(index.vocabulary)
+        index.indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        for term, counts in postings.items():
+            index.indptr[term + 1] = len(counts)
+        np.cumsum(index.indptr, out=index.indptr)
+
+        index.doc_ids = np.empty(index.indptr[-1], dtype=np.int32)
+        tfs = np.empty(index.indptr[-1], dtype=np.float32)
+        for term, counts in postings.items():
+            start, end = index.indptr[term], index.indptr[term + 1]
+            index.doc_ids[start:end] = list(counts.keys())
+            tfs[start:end] = list(counts.values())
+
+        # BM25 tách được thành idf(term) * w(term, doc): w không phụ thuộc query nên tính luôn
+        avg_length = float(lengths.mean()) if index.num_docs else 0.0
+        norm = k1 * (1 - b + b * lengths[index.doc_ids] / (avg_length or 1.0))
+        index.weights = (tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        df = np.diff(index.indptr).astype(np.float64)
+        index.idf = np.log1p((index.num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        return index
+
+    def search(self, query_tokens: List[str], k: int) -> list[tuple[int, float]]:
+        """Top `k` (doc_id, score) pairs, best first; only docs sharing a term."""
+        counts: dict[int, int] = {}
+        for token in query_tokens:
+            term = self.vocabulary.get(token)
+            if term is not None:
+                counts[term] = counts.get(term, 0) + 1
+        if not counts or k <= 0:
+            return []
+
+        ids, scores = [], []
+        for term, count in counts.items():
+            start, end = self.indptr[term], self.indptr[term + 1]
+            ids.append(self.doc_ids[start:end])
+            scores.append(self.weights[start:end] * (self.idf[term] * count))
+        ids = np.concatenate(ids)
+        candidates, inverse = np.unique(ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+
+        if len(candidates) > k:
+            top = np.argpartition(-totals, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(int(candidates[i]), float(totals[i])) for i in top]
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.doc_ids.nbytes + self.weights.nbytes + self.idf.nbytes
+
+
+class InvertedBM25Retriever(BaseRetriever):
+    """Keyword retriever over `BM25Index`, a drop-in for `BM25Retriever`.
+
+    Hits are resolved from `docs` or, when it is empty, from `docstore`
+    through `doc_ids` (BM25 doc number -> store id).
+    """
+
+    index: BM25Index
+    docs: List[Document] = []
+    doc_ids: List[str] = []
+    docstore: Any = None
+    k: int = 4
+    preprocess_func: Callable[[str], List[str]] = tokenize
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: List[Document],
+        preprocess_func: Callable[[str], List[str]] = tokenize,
+        k1: float = 1.5,
+        b: float = 0.75,
+        **kwargs,
+    ) -> "InvertedBM25Retriever":
+        documents = list(documents)
+        index = BM25Index.build([preprocess_func(d.page_content) for d in documents], k1=k1, b=b)
+        cls._log_built(index)
+        return cls(index=index, docs=documents, preprocess_func=preprocess_func, **kwargs)
+
+    @classmethod
+    def from_docstore(
+        cls,
+        docstore,
+        preprocess_func: Callable[[str], List[str]] = tokenize,
+        k1: float = 1.5,
+        b: float = 0.75,
+        **kwargs,
+    ) -> "InvertedBM25Retriever":
+        """Index a `JsonlDocStore` by streaming it; documents stay on disk."""
+        doc_ids: List[str] = []
+
+        def corpus():
+            for doc in docstore:
+                doc_ids.append(chunk_key(doc))
+                yield preprocess_func(doc.page_content)
+
+        index = BM25Index.build(corpus(), k1=k1, b=b)
+        cls._log_built(index)
+        return cls(index=index, doc_ids=doc_ids, docstore=docstore, preprocess_func=preprocess_func, **kwargs)
+
+    @staticmethod
+    def _log_built(index: BM25Index):
+        logger.info(
+            f"Built BM25 inverted index: {index.num_docs} docs, "
+            f"{len(index.vocabulary)} terms, {index.nbytes / 1024:.0f} KiB"
+        )
+
+    def search(self, query: str, k: Optional[int] = None) -> list[tuple[Document, float]]:
+        hits = self.index.search(self.preprocess_func(query), k or self.k)
+        if self.docs:
+            return [(self.docs[doc_id], score) for doc_id, score in hits]
+        docs = self.docstore.get_many([self.doc_ids[doc_id] for doc_id, _ in hits]) if hits else []
+        return [(doc, score) for doc, (_, score) in zip(docs, hits)]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [doc for doc, _ in self.search(query)]
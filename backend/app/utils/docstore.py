@@ -0,0 +1,449 @@
+"""Append-only JSONL document store with an offset index.
+
+The old store wrote every contextual chunk as one indented JSON array and
+read it back with a single `json.load`. Here each document is one line,
+`{"id", "page_content", "metadata"}`. A sidecar index (`<path>.idx`)
+maps each id to the byte offset of its line. With that:
+
+- incremental indexing appends only new or changed chunks via `appender()`;
+- queries fetch only the chunks they hit, via `get_many(ids)`;
+- BM25 stores ids instead of a second copy of every document.
+
+Existing lines are never modified. A changed document is appended again,
+and the last line for an id wins. A removed one gets a tombstone line,
+`{"id", "deleted": true}`. Readers only follow offsets they have indexed,
+so an append under them is invisible until they reopen. Once dead lines
+outnumber live ones, the store is compacted: `writer()` streams the live
+documents into a temp file, which is swapped in with `os.replace`.
+`sha256` changes with every commit, so BM25 and the semantic cache can
+detect a new version. After an append it hashes the previous value plus
+the new lines.
+
+The index records the size and mtime of the data file it describes. If
+they no longer match (missing index, crash mid-append or between the two
+renames, a file copied by hand), the index is rebuilt by one sequential
+scan of the data file.
+
+`open_docstore(path)` also accepts the legacy `contextual_docs.json`.
+The first time, it migrates the file to `.jsonl` next to it.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+from app.utils.hybrid_retriever import chunk_key
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def _encode(doc: Document) -> bytes:
+    record = {"id": chunk_key(doc), "page_content": doc.page_content, "metadata": doc.metadata}
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _decode(line: bytes) -> Document:
+    record = json.loads(line)
+    return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+
+def _tombstone(doc_id: str) -> bytes:
+    return (json.dumps({"id": doc_id, "deleted": True}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _write_index(path: str, index: dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+class DocStoreWriter:
+    """Writes a new generation of the store; it only becomes visible on `commit()`."""
+
+    def __init__(self, store: "JsonlDocStore"):
+        self.store = store
+        self._tmp_path = f"{store.path}.{os.getpid()}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._digest = hashlib.sha256()
+        self._offsets: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._records = 0
+
+    def add(self, doc: Document):
+        line = _encode(doc)
+        doc_id = chunk_key(doc)
+        if doc_id not in self._offsets:
+            self._ids.append(doc_id)
+        # Id lặp lại: dòng sau thắng, dòng trước bị bỏ qua khi đọc
+        self._offsets[doc_id] = self._file.tell()
+        self._file.write(line)
+        self._digest.update(line)
+        self._records += 1
+
+    def extend(self, docs: Iterable[Document]):
+        for doc in docs:
+            self.add(doc)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def commit(self):
+        self._file.close()
+        stat = os.stat(self._tmp_path)
+        index = {
+            "version": INDEX_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self._digest.hexdigest(),
+            "records": self._records,
+            "ids": self._ids,
+            "offsets": [self._offsets[i] for i in self._ids],
+        }
+        index_tmp = f"{self.store.index_path}.{os.getpid()}.tmp"
+        with open(index_tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        # Data trước, index sau: lệch nhau (size/mtime) thì lần mở sau tự quét lại
+        os.replace(self._tmp_path, self.store.path)
+        os.replace(index_tmp, self.store.index_path)
+        self.store._reopen()
+        logger.info(f"Saved {len(self._ids)} documents to {self.store.path}")
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self) -> "DocStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class DocStoreAppender:
+    """Appends to the live file; the new index is published on `commit()`.
+
+    `abort()` truncates the file back, so nothing appended becomes visible.
+    """
+
+    def __init__(self, store: "JsonlDocStore"):
+        self.store = store
+        self._file = open(store.path, "ab")
+        self._start = self._file.tell()
+        if self._start and not _ends_with_newline(store.path):
+            self._file.write(b"\n")  # dòng ghi dở từ lần append bị ngắt
+        with store._lock:
+            self._offsets = dict(store._offsets)
+            self._records = store._records
+            # Mã thế hệ nối tiếp: sha của thế hệ trước + các dòng mới
+            self._digest = hashlib.sha256((store.sha256 or "").encode("utf-8"))
+        self.appended = 0
+        self.deleted = 0
+
+    def _write(self, line: bytes) -> int:
+        offset = self._file.tell()
+        self._file.write(line)
+        self._digest.update(line)
+        self._records += 1
+        return offset
+
+    def add(self, doc: Document):
+        self._offsets[chunk_key(doc)] = self._write(_encode(doc))
+        self.appended += 1
+
+    def extend(self, docs: Iterable[Document]):
+        for doc in docs:
+            self.add(doc)
+
+    def delete(self, ids: Iterable[str]):
+        for doc_id in ids:
+            if self._offsets.pop(doc_id, None) is not None:
+                self._write(_tombstone(doc_id))
+                self.deleted += 1
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def commit(self):
+        self._file.close()
+        if self._records == self.store._records:
+            return
+        stat = os.stat(self.store.path)
+        _write_index(self.store.index_path, {
+            "version": INDEX_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self._digest.hexdigest(),
+            "records": self._records,
+            "ids": list(self._offsets),
+            "offsets": list(self._offsets.values()),
+        })
+        self.store._reopen()
+        logger.info(
+            f"Appended {self.appended} documents and {self.deleted} deletions to {self.store.path} "
+            f"({len(self.store)} live, {self.store.dead_records} dead)"
+        )
+        if self.store.dead_records > len(self.store):
+            self.store.compact()
+
+    def abort(self):
+        self._file.truncate(self._start)
+        self._file.close()
+
+    def __enter__(self) -> "DocStoreAppender":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class JsonlDocStore:
+    """Lazy, thread-safe access to documents by id."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.sha256: Optional[str] = None
+        self._offsets: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._records = 0
+        self._file = None
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._reopen()
+
+    # --- Đọc ---
+
+    def exists(self) -> bool:
+        return self._file is not None
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._offsets
+
+    @property
+    def dead_records(self) -> int:
+        """Lines kept only for history: superseded versions and tombstones."""
+        return self._records - len(self._ids)
+
+    def get(self, doc_id: str) -> Document:
+        return self.get_many([doc_id])[0]
+
+    def get_many(self, ids: List[str]) -> List[Document]:
+        """Documents for `ids`, in the same order; raises KeyError for an unknown id."""
+        if not ids:
+            return []
+        if self._file is None:
+            raise FileNotFoundError(f"{self.path} not found.")
+        # Đọc theo thứ tự offset để truy cập file gần như tuần tự
+        wanted = sorted(set(ids), key=lambda i: self._offsets[i])
+        lines = {}
+        with self._lock:
+            for doc_id in wanted:
+                self._file.seek(self._offsets[doc_id])
+                lines[doc_id] = self._file.readline()
+        return [_decode(lines[i]) for i in ids]
+
+    def __iter__(self) -> Iterator[Document]:
+        """Stream every live document in write order without loading the file."""
+        if self._file is None:
+            return
+        # Bản cũ, tombstone và dòng ghi dở không nằm ở offset sống nào
+        live = set(self._offsets.values())
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                record_offset, offset = offset, offset + len(line)
+                if record_offset in live:
+                    yield _decode(line)
+
+    # --- Ghi ---
+
+    def writer(self) -> DocStoreWriter:
+        Path(os.path.dirname(os.path.abspath(self.path))).mkdir(parents=True, exist_ok=True)
+        return DocStoreWriter(self)
+
+    def write(self, docs: Iterable[Document]):
+        with self.writer() as writer:
+            writer.extend(docs)
+
+    def appender(self) -> DocStoreAppender:
+        Path(os.path.dirname(os.path.abspath(self.path))).mkdir(parents=True, exist_ok=True)
+        if self._file is None:
+            self.write([])  # tạo file rỗng cùng index
+        return DocStoreAppender(self)
+
+    def compact(self):
+        """Rewrite the live documents into a new generation, dropping dead lines."""
+        dead = self.dead_records
+        self.write(iter(self))
+        logger.info(f"Compacted {self.path}: dropped {dead} dead records")
+
+    # --- Index ---
+
+    def _reopen(self):
+        new_file = open(self.path, "rb")
+        stat = os.fstat(new_file.fileno())
+        index = self._read_index(stat)
+        if index is None:
+            index = self._scan(new_file, stat)
+        with self._lock:
+            old_file, self._file = self._file, new_file
+            self._ids = index["ids"]
+            self._offsets = dict(zip(index["ids"], index["offsets"]))
+            self._records = index.get("records", len(index["ids"]))
+            self.sha256 = index["sha256"]
+        if old_file is not None:
+            old_file.close()
+
+    def _read_index(self, stat: os.stat_result) -> Optional[dict]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            index.get("version") != INDEX_VERSION
+            or index.get("size") != stat.st_size
+            or index.get("mtime_ns") != stat.st_mtime_ns
+        ):
+            return None
+        return index
+
+    def _scan(self, f, stat: os.stat_result) -> dict:
+        """Rebuild the offset index with one pass over the data file."""
+        logger.info(f"Rebuilding document index for {self.path}")
+        digest = hashlib.sha256()
+        offsets: Dict[str, int] = {}
+        records = 0
+        offset = 0
+        f.seek(0)
+        for line in f:
+            digest.update(line)
+            try:
+                record = json.loads(line) if line.strip() else None
+            except ValueError:
+                # Dòng cuối ghi dở khi append bị ngắt
+                logger.warning(f"Skipping unreadable record at offset {offset} in {self.path}")
+                record = None
+            if record is not None:
+                records += 1
+                if record.get("deleted"):
+                    offsets.pop(record["id"], None)
+                else:
+                    offsets[record.get("id") or chunk_key(_decode(line))] = offset
+            offset += len(line)
+
+        index = {
+            "version": INDEX_VERSION,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest.hexdigest(),
+            "records": records,
+            "ids": list(offsets),
+            "offsets": list(offsets.values()),
+        }
+        try:
+            _write_index(self.index_path, index)
+        except OSError as e:
+            # Thư mục chỉ đọc: vẫn dùng được index trong bộ nhớ
+            logger.warning(f"Cannot save document index {self.index_path}: {e}")
+        return index
+
+
+def store_path_for(path: str) -> str:
+    """JSONL store path for `path`; a legacy `.json` path maps to the `.jsonl` next to it."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.jsonl" if ext == ".json" else path
+
+
+# path -> (mtime_ns, size, sha256): chỉ đọc lại index khi file data đã bị thay
+_generations: Dict[str, tuple] = {}
+
+
+def store_generation(path: str) -> Optional[str]:
+    """sha256 of the generation currently at `path`, or None if there is no store.
+
+    Costs one `stat` while the file is unchanged, so it can be checked per request.
+    """
+    path = store_path_for(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    cached = _generations.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    try:
+        with open(f"{path}.idx", "r", encoding="utf-8") as f:
+            index = json.load(f)
+        fresh = index.get("size") == stat.st_size and index.get("mtime_ns") == stat.st_mtime_ns
+        sha = index["sha256"] if fresh else None
+    except (OSError, ValueError, KeyError):
+        sha = None
+    # Index chưa được dựng lại: stat của file data vẫn đổi theo mỗi thế hệ
+    sha = sha or f"{stat.st_mtime_ns}:{stat.st_size}"
+    _generations[path] = (stat.st_mtime_ns, stat.st_size, sha)
+    return sha
+
+
+def migrate_json(json_path: str, store_path: str) -> JsonlDocStore:
+    """One-shot conversion of the legacy JSON array into a JSONL store."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        raw_docs = json.load(f)
+    store = JsonlDocStore(store_path)
+    store.write(Document(page_content=item["page_content"], metadata=item["metadata"]) for item in raw_docs)
+    logger.info(f"Migrated {len(raw_docs)} documents from {json_path} to {store_path}")
+    return store
+
+
+def open_docstore(path: str) -> JsonlDocStore:
+    """Store at `path`, migrating the legacy `.json` file on first use.
+
+    A `.json` path (old `DOC_DIRECTORY` values) maps to the `.jsonl` next to it.
+    """
+    store_path = store_path_for(path)
+    legacy_path = f"{os.path.splitext(path)[0]}.json"
+
+    store = JsonlDocStore(store_path)
+    if not store.exists() and os.path.exists(legacy_path) and os.path.getsize(legacy_path) > 0:
+        store = migrate_json(legacy_path, store_path)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Convert contextual_docs.json to the JSONL document store.")
+    parser.add_argument("json_path")
+    parser.add_argument("store_path", nargs="?")
+    args = parser.parse_args()
+    migrate_json(args.json_path, args.store_path or f"{os.path.splitext(args.json_path)[0]}.jsonl")
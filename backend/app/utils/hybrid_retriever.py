@@ -0,0 +1,119 @@
+"""Hybrid sparse + dense retrieval with reciprocal rank fusion.
+
+Replaces `EnsembleRetriever(weights=[0.5, 0.5])`. The two searches run
+concurrently, each `candidate_k` deep. Their rankings are fused with
+weighted RRF, `score(d) = sum_i w_i / (rrf_k + rank_i(d))`. Chunks are
+de-duplicated on `metadata["id"]` (assigned by `process_document`), so a
+chunk found by both sides is sent to the reranker once. Only the best
+`top_k` are returned, which keeps reranking cheap while the candidate
+depth is tuned separately.
+"""
+
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+logger = logging.getLogger(__name__)
+
+# Nhánh sync: dense (gọi embedding qua mạng) chạy ở thread, sparse chạy luôn ở thread gọi
+_dense_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-dense")
+
+
+def chunk_key(doc: Document) -> str:
+    """`metadata["id"]`, or a content hash for documents indexed without one."""
+    chunk_id = doc.metadata.get("id")
+    if chunk_id:
+        return str(chunk_id)
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]],
+    weights: Sequence[float],
+    top_k: int,
+    rrf_k: int = 60,
+) -> List[Document]:
+    """Fuse ranked lists; each chunk appears once, carrying its fused score."""
+    keys: dict[str, int] = {}
+    docs: list[Document] = []
+    positions, ranks, list_weights = [], [], []
+    for weight, ranking in zip(weights, rankings):
+        for rank, doc in enumerate(ranking):
+            key = chunk_key(doc)
+            if key not in keys:
+                keys[key] = len(docs)
+                docs.append(doc)
+            positions.append(keys[key])
+            ranks.append(rank)
+            list_weights.append(weight)
+    if not docs:
+        return []
+
+    scores = np.zeros(len(docs))
+    np.add.at(
+        scores,
+        np.asarray(positions),
+        np.asarray(list_weights) / (rrf_k + np.asarray(ranks) + 1),
+    )
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [
+        Document(page_content=docs[i].page_content, metadata={**docs[i].metadata, "rrf_score": float(scores[i])})
+        for i in order
+    ]
+
+
+class HybridRetriever(BaseRetriever):
+    """Concurrent sparse + dense search fused with RRF, de-duplicated by chunk id."""
+
+    sparse: BaseRetriever
+    dense: BaseRetriever
+    top_k: int = 5
+    candidate_k: int = 20
+    weights: List[float] = [0.5, 0.5]
+    rrf_k: int = 60
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def model_post_init(self, __context) -> None:
+        # Độ sâu ứng viên của từng nhánh, độc lập với top_k trả về
+        self.sparse.k = self.candidate_k
+        if hasattr(self.dense, "search_kwargs"):
+            self.dense.search_kwargs = {**self.dense.search_kwargs, "k": self.candidate_k}
+
+    def _fuse(self, sparse_docs: List[Document], dense_docs: List[Document]) -> List[Document]:
+        fused = reciprocal_rank_fusion(
+            [sparse_docs, dense_docs], self.weights, self.top_k, self.rrf_k
+        )
+        logger.debug(
+            f"Hybrid retrieval: {len(sparse_docs)} sparse + {len(dense_docs)} dense -> {len(fused)}"
+        )
+        return fused
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense_future = _dense_pool.submit(
+            self.dense.invoke, query, {"callbacks": run_manager.get_child("dense")}
+        )
+        sparse_docs = self.sparse.invoke(query, {"callbacks": run_manager.get_child("sparse")})
+        return self._fuse(sparse_docs, dense_future.result())
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        sparse_docs, dense_docs = await asyncio.gather(
+            self.sparse.ainvoke(query, {"callbacks": run_manager.get_child("sparse")}),
+            self.dense.ainvoke(query, {"callbacks": run_manager.get_child("dense")}),
+        )
+        return self._fuse(sparse_docs, dense_docs)
@@ -1,8 +1,10 @@
 import os
-import uuid
 import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Any
+import pickle
+import time
+from typing import List, Dict, Any, Optional
 from glob import glob
 from pathlib import Path
 import json
@@ -14,42 +16,128 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.retrievers import BM25Retriever
 from langchain_chroma import Chroma
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
-from langchain_classic.retrievers import EnsembleRetriever
+from openai import RateLimitError
+from tenacity import (
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+    AsyncRetrying,
+)
 import os
 from dotenv import load_dotenv
 
+from app.cache.embeddings import cached_embeddings
+from app.cache.llm import TieredLLMCache, track_hits
+from app.utils.bm25_index import InvertedBM25Retriever
+from app.utils.docstore import JsonlDocStore, open_docstore
+from app.utils.hybrid_retriever import HybridRetriever, chunk_key
+from app.utils.rate_limiter import RateLimiter
+from app.utils.table_encoder import estimate_tokens
+
 load_dotenv()
 
+# Đường dẫn tính từ thư mục gốc repo để chạy được từ bất kỳ cwd nào
+ROOT_DIR = Path(__file__).resolve().parents[3]
+
 # --- CONFIGURATION ---
 class Config:
     CHUNK_SIZE = 1000
     CHUNK_OVERLAP = 200
-    PDF_PATH_PATTERN = '../../../research/data/*.pdf'
-    PERSIST_DIRECTORY = "../../../data/vector_db"
-    DOCUMENT_DIRECTORY = "../../../data/contextual_docs.json"
+    PDF_PATH_PATTERN = str(ROOT_DIR / "research" / "data" / "*.pdf")
+    PERSIST_DIRECTORY = str(ROOT_DIR / "data" / "vector_db")
+    # BM25 dựng sẵn lúc indexing, nằm cạnh thư mục Chroma
+    BM25_INDEX_PATH = str(ROOT_DIR / "data" / "bm25_index.pkl")
+    # "inverted": chỉ mục ngược + tokenizer tiếng Việt; "rank_bm25": BM25Retriever cũ
+    BM25_ENGINE = "inverted"
+    # JSONL + index offset; file contextual_docs.json cũ được chuyển đổi ở lần mở đầu tiên
+    DOCUMENT_DIRECTORY = str(ROOT_DIR / "data" / "contextual_docs.jsonl")
     COLLECTION_NAME = "vector_db"
     EMBEDDING_MODEL = "gemini-embedding-001"
-    RETRIEVAL_K = 5
+    RETRIEVAL_K = 5  # số chunk sau khi trộn, đưa sang reranker
+    RETRIEVAL_CANDIDATE_K = 20  # độ sâu tìm kiếm của từng nhánh BM25 / vector
+    HYBRID_WEIGHTS = [0.5, 0.5]  # [BM25, vector] trong RRF
+    RRF_K = 60
+    # Sinh context cho chunk: song song có giới hạn, theo quota của proxy
+    CONTEXT_CONCURRENCY = 8
+    CONTEXT_REQUESTS_PER_MINUTE = 60
+    CONTEXT_TOKENS_PER_MINUTE = 200_000
+    CONTEXT_OUTPUT_TOKENS = 150  # ước lượng token trả về mỗi chunk (3-4 câu)
+    CONTEXT_MAX_ATTEMPTS = 5  # số lần thử khi bị 429
+    # "batched": gửi tài liệu một lần kèm nhiều chunk; "per_chunk": mỗi chunk một lần gọi
+    CONTEXT_MODE = "batched"
+    CONTEXT_WINDOW_TOKENS = 128_000  # context window của fast-model
+    CONTEXT_BATCH_MAX_CHUNKS = 16
+    # Indexing tăng dần: hash từng file/chunk, checkpoint để chạy tiếp khi bị ngắt giữa chừng
+    MANIFEST_PATH = str(ROOT_DIR / "data" / "index_manifest.json")
+    CHECKPOINT_PATH = str(ROOT_DIR / "data" / "index_checkpoint.jsonl")
+    # Cache prompt -> context, để chạy lại indexing không phải trả tiền lại
+    LLM_CACHE_PATH = str(ROOT_DIR / "data" / "llm_cache.sqlite")
+
+MANIFEST_VERSION = 1
+CONTEXT_UNAVAILABLE = "Context unavailable."
+# Token của phần chữ cố định trong prompt (ước lượng)
+_CONTEXT_PROMPT_TOKENS = 150
+_BATCH_PROMPT_TOKENS = 200
+
+# Tăng khi đổi định dạng file BM25 để worker tự dựng lại thay vì load nhầm
+BM25_INDEX_VERSION = 3
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+
+def file_sha256(path: str) -> str:
+    """Content hash of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_key(file_path: str) -> str:
+    """Path relative to the repo root, so ids do not depend on the checkout location."""
+    return Path(os.path.relpath(os.path.abspath(file_path), ROOT_DIR)).as_posix()
+
+
+def chunk_ids(source: str, chunks: List[Document]) -> List[str]:
+    """Stable ids: hash of source + chunk text (+ occurrence for repeated text)."""
+    seen: Dict[str, int] = {}
+    ids = []
+    for chunk in chunks:
+        occurrence = seen.get(chunk.page_content, 0)
+        seen[chunk.page_content] = occurrence + 1
+        raw = f"{source}\x00{occurrence}\x00{chunk.page_content}"
+        ids.append(hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32])
+    return ids
+
+
 class ContextualRAGBuilder:
     def __init__(self):
-        self.embeddings = GoogleGenerativeAIEmbeddings(model=Config.EMBEDDING_MODEL)
+        self.embeddings = cached_embeddings(Config.EMBEDDING_MODEL)
         self.llm  = ChatOpenAI(
             model="fast-model", 
             openai_api_base="http://localhost:4000",
             openai_api_key="sk-fake",
-            temperature=0
+            temperature=0,
+            cache=TieredLLMCache(Config.LLM_CACHE_PATH, namespace="contextual-chunk"),
+            # 429 được retry (có backoff) trong _generate_chunk_context
+            max_retries=0,
         )
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=Config.CHUNK_SIZE, 
             chunk_overlap=Config.CHUNK_OVERLAP
         )
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=Config.CONTEXT_REQUESTS_PER_MINUTE,
+            tokens_per_minute=Config.CONTEXT_TOKENS_PER_MINUTE,
+        )
+        # Token đầu vào (ước lượng) đã gửi, và số sẽ gửi nếu chạy per_chunk
+        self.input_tokens = 0
+        self.per_chunk_input_tokens = 0
 
 
     def _get_context_prompt(self) -> ChatPromptTemplate:
@@ -71,52 +159,426 @@ Answer only with the succinct context starting with 'Focuses on...'.
 Do not mention 'this chunk' or 'this section'."""
         return ChatPromptTemplate.from_template(template)
 
-    async def _generate_chunk_context(self, full_paper_text: str, chunk_content: str) -> str:
-        """Asynchronously generate context for a single chunk."""
+    def _get_batch_context_prompt(self) -> ChatPromptTemplate:
+        """Prompt for situating several chunks against one copy of the paper."""
+        template = """You are an AI assistant specializing in research paper analysis.
+Situating chunks of text within the overall document to improve search retrieval.
+
+<paper>
+{paper}
+</paper>
+
+<chunks>
+{chunks}
+</chunks>
+
+For every chunk, provide a concise context (3-4 sentences max).
+Focus on explaining what that section contributes to the overall paper.
+Each context starts with 'Focuses on...' and does not mention 'this chunk' or 'this section'.
+Answer only with a JSON array, one object per chunk, in the same order:
+[{{"id": <chunk id>, "context": "Focuses on..."}}]"""
+        return ChatPromptTemplate.from_template(template)
+
+    async def _ainvoke_limited(
+        self, chain, inputs: Dict[str, Any], input_tokens: int, output_tokens: int, per_chunk_tokens: int
+    ) -> tuple[Any, bool]:
+        """Wait for rate-limit budget, then invoke; 429s are retried with backoff.
+
+        Returns (output, sent). `sent` is False when the LLM cache answered;
+        the token counters only grow for requests that reached the model.
+        """
+        sent = True
+        try:
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception_type(RateLimitError),
+                wait=wait_exponential_jitter(initial=2, max=60),
+                stop=stop_after_attempt(Config.CONTEXT_MAX_ATTEMPTS),
+                reraise=True,
+            ):
+                with attempt:
+                    if attempt.retry_state.attempt_number > 1:
+                        logger.warning(f"Rate limited, retry {attempt.retry_state.attempt_number}")
+                    await self.rate_limiter.acquire(input_tokens + output_tokens)
+                    with track_hits() as lookups:
+                        output = await chain.ainvoke(inputs)
+                    sent = not (lookups and all(lookups))
+            return output, sent
+        finally:
+            if sent:
+                self.input_tokens += input_tokens
+                self.per_chunk_input_tokens += per_chunk_tokens
+
+    def _per_chunk_tokens(self, full_paper_text: str, chunk_content: str) -> int:
+        return estimate_tokens(full_paper_text) + estimate_tokens(chunk_content) + _CONTEXT_PROMPT_TOKENS
+
+    async def _generate_chunk_context(
+        self, full_paper_text: str, chunk_content: str, count_baseline: bool = True
+    ) -> str:
+        """Asynchronously generate context for a single chunk.
+
+        Waits for rate-limit budget first and retries 429s with exponential
+        backoff; any other failure degrades to a placeholder context.
+        `count_baseline=False` is for batch fallbacks whose per-chunk cost
+        the batch request already counted.
+        """
         chain = self._get_context_prompt() | self.llm | StrOutputParser()
+        tokens = self._per_chunk_tokens(full_paper_text, chunk_content)
         try:
-            return await chain.ainvoke({'paper': full_paper_text, 'chunk': chunk_content})
+            context, _ = await self._ainvoke_limited(
+                chain,
+                {'paper': full_paper_text, 'chunk': chunk_content},
+                tokens,
+                Config.CONTEXT_OUTPUT_TOKENS,
+                tokens if count_baseline else 0,
+            )
+            return context
         except Exception as e:
             logger.error(f"Error generating context: {e}")
-            return "Context unavailable."
+            return CONTEXT_UNAVAILABLE
 
-    async def process_document(self, file_path: str) -> List[Document]:
-        """Load, split, and enrich a PDF document with context."""
-        logger.info(f"Processing: {file_path}")
-        
+    def _plan_batches(self, full_paper_text: str, chunks: List[Document]) -> List[List[int]]:
+        """Group chunk indices so each request fits the model's context window.
+
+        Returns [] when even a single chunk does not fit next to the paper;
+        the caller then falls back to per-chunk requests.
+        """
+        budget = Config.CONTEXT_WINDOW_TOKENS - estimate_tokens(full_paper_text) - _BATCH_PROMPT_TOKENS
+        batches: List[List[int]] = []
+        current: List[int] = []
+        used = 0
+        for i, chunk in enumerate(chunks):
+            # Mỗi chunk tốn token đầu vào của chính nó và token đầu ra cho context
+            cost = estimate_tokens(chunk.page_content) + Config.CONTEXT_OUTPUT_TOKENS
+            if current and (used + cost > budget or len(current) >= Config.CONTEXT_BATCH_MAX_CHUNKS):
+                batches.append(current)
+                current, used = [], 0
+            if cost > budget:
+                return []
+            current.append(i)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _parse_batch_contexts(text: str, count: int) -> Dict[int, str]:
+        """{chunk position: context} from the model's JSON array; unusable items are skipped."""
+        start, end = text.find("["), text.rfind("]")
+        if start == -1 or end <= start:
+            raise ValueError("no JSON array in response")
+        contexts = {}
+        for item in json.loads(text[start:end + 1]):
+            if not isinstance(item, dict):
+                continue
+            position, context = item.get("id"), item.get("context")
+            if isinstance(position, int) and 0 <= position < count and isinstance(context, str) and context.strip():
+                contexts[position] = context.strip()
+        return contexts
+
+    async def _generate_batch_contexts(self, full_paper_text: str, chunk_contents: List[str]) -> List[str]:
+        """Contexts for several chunks from one request; per-chunk fallback for the gaps."""
+        chain = self._get_batch_context_prompt() | self.llm | StrOutputParser()
+        chunks_xml = "\n".join(
+            f'<chunk id="{position}">\n{content}\n</chunk>' for position, content in enumerate(chunk_contents)
+        )
+        tokens = estimate_tokens(full_paper_text) + estimate_tokens(chunks_xml) + _BATCH_PROMPT_TOKENS
+
+        parsed: Dict[int, str] = {}
+        # Lỗi vẫn tính là đã gửi; chỉ cache hit là chưa tính chi phí per-chunk của lô
+        sent = True
+        try:
+            response, sent = await self._ainvoke_limited(
+                chain,
+                {'paper': full_paper_text, 'chunks': chunks_xml},
+                tokens,
+                Config.CONTEXT_OUTPUT_TOKENS * len(chunk_contents),
+                sum(self._per_chunk_tokens(full_paper_text, c) for c in chunk_contents),
+            )
+            parsed = self._parse_batch_contexts(response, len(chunk_contents))
+        except Exception as e:
+            logger.warning(f"Batched context generation failed ({e}); falling back to per-chunk requests")
+
+        missing = [position for position in range(len(chunk_contents)) if position not in parsed]
+        if missing and parsed:
+            logger.warning(f"Batch response missed {len(missing)}/{len(chunk_contents)} chunks; retrying them one by one")
+        fallback = await asyncio.gather(
+            *(
+                self._generate_chunk_context(full_paper_text, chunk_contents[position], count_baseline=not sent)
+                for position in missing
+            )
+        )
+        parsed.update(zip(missing, fallback))
+        return [parsed[position] for position in range(len(chunk_contents))]
+
+    def _split_document(self, file_path: str) -> tuple[List[Document], str]:
         loader = PyPDFLoader(file_path)
         pages = loader.load()
         chunks = self.splitter.split_documents(pages)
-        
-        full_paper_text = "\n".join([p.page_content for p in pages])
-        contextual_docs = []
+        return chunks, "\n".join([p.page_content for p in pages])
 
-        # Process chunks with rate limiting (10s delay as requested)
-        for i, chunk in enumerate(chunks):
-            context = await self._generate_chunk_context(full_paper_text, chunk.page_content)
-            
+    async def _contextualize(
+        self, file_path: str, full_paper_text: str, chunks: List[Document], on_context=None
+    ) -> List[str]:
+        """Contexts for `chunks`, in order; `on_context(i, context)` fires as each finishes."""
+        contexts: List[str] = [""] * len(chunks)
+        semaphore = asyncio.Semaphore(Config.CONTEXT_CONCURRENCY)
+        started = time.perf_counter()
+        done = 0
+
+        def finished(i: int, context: str):
+            nonlocal done
+            contexts[i] = context
+            if on_context is not None:
+                on_context(i, context)
+            done += 1
+
+        def progress():
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Progress [{os.path.basename(file_path)}]: {done}/{len(chunks)} "
+                f"({done / elapsed:.2f} chunks/s)"
+            )
+
+        async def enrich(i: int, chunk: Document):
+            async with semaphore:
+                context = await self._generate_chunk_context(full_paper_text, chunk.page_content)
+            finished(i, context)
+            progress()
+
+        async def enrich_batch(indices: List[int]):
+            async with semaphore:
+                batch = await self._generate_batch_contexts(
+                    full_paper_text, [chunks[i].page_content for i in indices]
+                )
+            for i, context in zip(indices, batch):
+                finished(i, context)
+            progress()
+
+        input_before, baseline_before = self.input_tokens, self.per_chunk_input_tokens
+        batches = self._plan_batches(full_paper_text, chunks) if Config.CONTEXT_MODE == "batched" else []
+        if Config.CONTEXT_MODE == "batched" and not batches and chunks:
+            logger.warning(f"{os.path.basename(file_path)} does not fit the context window; using per-chunk mode")
+
+        # Các chunk/lô chạy song song; kết quả ghi theo index nên giữ đúng thứ tự
+        if batches:
+            await asyncio.gather(*(enrich_batch(indices) for indices in batches))
+        else:
+            await asyncio.gather(*(enrich(i, chunk) for i, chunk in enumerate(chunks)))
+
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for c in contexts if c == CONTEXT_UNAVAILABLE)
+        sent = self.input_tokens - input_before
+        baseline = self.per_chunk_input_tokens - baseline_before
+        logger.info(
+            f"Finished {os.path.basename(file_path)}: {len(chunks)} chunks in {len(batches) or len(chunks)} requests, "
+            f"{elapsed:.1f}s ({len(chunks) / elapsed if elapsed else 0:.2f} chunks/s), {failed} without context, "
+            f"{self.rate_limiter.waited:.1f}s waited on rate limits, ~{sent} input tokens "
+            f"(per-chunk mode: ~{baseline}, saved {1 - sent / baseline if baseline else 0:.0%})"
+        )
+        return contexts
+
+    def _to_contextual_docs(
+        self, file_path: str, chunks: List[Document], contexts: List[str], ids: List[str]
+    ) -> List[Document]:
+        contextual_docs = []
+        for chunk, context, chunk_id in zip(chunks, contexts, ids):
             new_metadata = {
-                'id': str(uuid.uuid4()),
+                'id': chunk_id,
                 'page': chunk.metadata.get('page', 0),
                 'source': file_path,
-                'title': os.path.basename(file_path)
+                'title': os.path.basename(file_path),
+                'context': context,
             }
             
             enriched_content = f"{context}\n\n{chunk.page_content}"
             contextual_docs.append(Document(page_content=enriched_content, metadata=new_metadata))
-            
-            logger.info(f"Progress [{os.path.basename(file_path)}]: {i+1}/{len(chunks)}")
-            await asyncio.sleep(2) # Reduced sleep for performance, adjust if hitting rate limits
-
         return contextual_docs
 
+    async def process_document(self, file_path: str) -> List[Document]:
+        """Load, split, and enrich a PDF document with context."""
+        logger.info(f"Processing: {file_path}")
+        chunks, full_paper_text = self._split_document(file_path)
+        contexts = await self._contextualize(file_path, full_paper_text, chunks)
+        return self._to_contextual_docs(file_path, chunks, contexts, chunk_ids(source_key(file_path), chunks))
+
+    # --- incremental indexing ---------------------------------------------
+
+    @staticmethod
+    def _load_manifest() -> Dict[str, Any]:
+        if os.path.exists(Config.MANIFEST_PATH):
+            with open(Config.MANIFEST_PATH, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+        return {"version": MANIFEST_VERSION, "files": {}}
+
+    @staticmethod
+    def _load_checkpoint() -> Dict[str, str]:
+        """Contexts generated by an interrupted run, by chunk id."""
+        contexts: Dict[str, str] = {}
+        if not os.path.exists(Config.CHECKPOINT_PATH):
+            return contexts
+        with open(Config.CHECKPOINT_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # dòng ghi dở lúc bị ngắt
+                contexts[entry["id"]] = entry["context"]
+        return contexts
+
+    @staticmethod
+    def _split_context(doc: Document) -> tuple[Optional[str], str]:
+        """(context, chunk text) of a contextual document; context is None if unknown."""
+        context = doc.metadata.get("context")
+        if context is not None:
+            prefix = f"{context}\n\n"
+            if doc.page_content.startswith(prefix):
+                return context, doc.page_content[len(prefix):]
+            return None, doc.page_content
+        # Index cũ chưa lưu metadata["context"]: tách ở dòng trống đầu tiên
+        context, sep, chunk_text = doc.page_content.partition("\n\n")
+        return (context, chunk_text) if sep else (None, doc.page_content)
+
+    @classmethod
+    def _known_contexts(cls, documents: List[Document]) -> Dict[tuple, str]:
+        """(file name, chunk text) -> context from already indexed documents.
+
+        Matching on text rather than id also reuses contexts from indexes
+        built before chunk ids were content hashes (and with Windows paths).
+        """
+        known = {}
+        for doc in documents:
+            context, chunk_text = cls._split_context(doc)
+            if context is not None and context != CONTEXT_UNAVAILABLE:
+                name = os.path.basename(doc.metadata.get("source", "").replace("\\", "/"))
+                known[(name, chunk_text)] = context
+        return known
+
+    async def update_index(self, pdf_files: List[str]) -> Dict[str, Any]:
+        """Bring the document store, Chroma and the manifest in line with `pdf_files`.
+
+        Only chunks whose text is new get a context generated and an
+        embedding computed; removed chunks are deleted from Chroma by id.
+        Generated contexts are checkpointed as they arrive, so rerunning
+        after a crash resumes instead of paying for them again. Only new or
+        changed documents are appended to the store and removed ones get a
+        tombstone, so a run touching one file does not rewrite the corpus;
+        only the chunks headed for Chroma are kept in memory.
+        """
+        started = time.perf_counter()
+        manifest = self._load_manifest()
+        existing = open_docstore(Config.DOCUMENT_DIRECTORY)
+        known = None
+        checkpoint = self._load_checkpoint()
+        report = {
+            "files_unchanged": 0, "files_changed": 0, "files_removed": 0,
+            "chunks_reused": 0, "chunks_generated": 0, "upserted": 0, "deleted": 0,
+        }
+
+        # Chưa có Chroma: mọi chunk đều phải embed, ngược lại chỉ chunk mới / đổi nội dung
+        rebuild_vectors = not self.vector_store_exists()
+        to_embed: List[Document] = []
+        new_ids = set()
+        files: Dict[str, Dict[str, Any]] = {}
+        Path(os.path.dirname(Config.CHECKPOINT_PATH)).mkdir(parents=True, exist_ok=True)
+        writer = existing.appender()
+        try:
+            with open(Config.CHECKPOINT_PATH, "a", encoding="utf-8") as checkpoint_file:
+                for file_path in sorted(pdf_files):
+                    key = source_key(file_path)
+                    digest = file_sha256(file_path)
+                    entry = manifest["files"].get(key)
+                    complete = entry is not None and all(i in existing for i in entry["chunks"])
+                    previous = existing.get_many(entry["chunks"]) if complete else []
+                    complete = complete and not any(
+                        self._split_context(doc)[0] == CONTEXT_UNAVAILABLE for doc in previous
+                    )
+                    if complete and entry["sha256"] == digest:
+                        new_ids.update(entry["chunks"])
+                        if rebuild_vectors:
+                            to_embed.extend(previous)
+                        files[key] = entry
+                        report["files_unchanged"] += 1
+                        report["chunks_reused"] += len(entry["chunks"])
+                        continue
+
+                    logger.info(f"Processing: {file_path}")
+                    report["files_changed"] += 1
+                    if known is None:
+                        known = self._known_contexts(existing)
+                    chunks, full_paper_text = self._split_document(file_path)
+                    ids = chunk_ids(key, chunks)
+                    name = os.path.basename(file_path)
+                    contexts = [checkpoint.get(i) or known.get((name, c.page_content)) for i, c in zip(ids, chunks)]
+                    todo = [i for i, context in enumerate(contexts) if context is None]
+                    report["chunks_reused"] += len(chunks) - len(todo)
+                    report["chunks_generated"] += len(todo)
+
+                    def remember(j: int, context: str, todo=todo, ids=ids):
+                        if context != CONTEXT_UNAVAILABLE:
+                            checkpoint_file.write(json.dumps({"id": ids[todo[j]], "context": context}, ensure_ascii=False) + "\n")
+                            checkpoint_file.flush()
+
+                    if todo:
+                        generated = await self._contextualize(
+                            file_path, full_paper_text, [chunks[i] for i in todo], on_context=remember
+                        )
+                        for i, context in zip(todo, generated):
+                            contexts[i] = context
+
+                    docs = self._to_contextual_docs(file_path, chunks, contexts, ids)
+                    present = [i for i in ids if i in existing]
+                    stored = dict(zip(present, (d.page_content for d in existing.get_many(present))))
+                    writer.extend(doc for doc in docs if stored.get(doc.metadata["id"]) != doc.page_content)
+                    new_ids.update(ids)
+                    to_embed.extend(
+                        doc for doc in docs
+                        if rebuild_vectors or stored.get(doc.metadata["id"]) != doc.page_content
+                    )
+                    files[key] = {"sha256": digest, "chunks": ids}
+
+            report["files_removed"] = len(set(manifest["files"]) - set(files))
+            stale_ids = [i for i in existing.ids if i not in new_ids]
+            writer.delete(stale_ids)
+
+            if rebuild_vectors:
+                self.build_vector_store(to_embed)
+            else:
+                vector_db = self.build_vector_store()
+                # Xoá theo metadata id: hoạt động cả với collection cũ mà Chroma tự sinh id
+                for start in range(0, len(stale_ids), 500):
+                    vector_db.delete(where={"id": {"$in": stale_ids[start:start + 500]}})
+                if to_embed:
+                    vector_db.add_documents(to_embed, ids=[doc.metadata["id"] for doc in to_embed])
+                report["deleted"] = len(stale_ids)
+            report["upserted"] = len(to_embed)
+        except BaseException:
+            writer.abort()
+            raise
+
+        # Chroma đã cập nhật xong mới công bố index mới của document store
+        writer.commit()
+        with open(Config.MANIFEST_PATH, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": files}, f, ensure_ascii=False, indent=2)
+        # Mọi thứ đã được ghi: checkpoint không còn cần nữa
+        os.remove(Config.CHECKPOINT_PATH)
+
+        report["documents"] = len(writer)
+        report["input_tokens"] = self.input_tokens
+        report["input_tokens_saved"] = self.per_chunk_input_tokens - self.input_tokens
+        report["seconds"] = round(time.perf_counter() - started, 2)
+        logger.info(f"Index updated: {report}")
+        return report
+
+    def vector_store_exists(self) -> bool:
+        return os.path.exists(Config.PERSIST_DIRECTORY) and \
+               len(os.listdir(Config.PERSIST_DIRECTORY)) > 0
+
     def build_vector_store(self, documents: List[Document] = None) -> Chroma:
         """Load ChromaDB if exists, otherwise create it."""
-        
-        db_exists = os.path.exists(Config.PERSIST_DIRECTORY) and \
-                    len(os.listdir(Config.PERSIST_DIRECTORY)) > 0
 
-        if db_exists:
+        if self.vector_store_exists():
             logger.info(f"Loading existing Vector Store from {Config.PERSIST_DIRECTORY}...")
             db = Chroma(
                 persist_directory=Config.PERSIST_DIRECTORY,
@@ -130,6 +592,7 @@ Do not mention 'this chunk' or 'this section'."""
             logger.info("Creating NEW Vector Store...")
             db = Chroma.from_documents(
                 documents=documents,
+                ids=[doc.metadata["id"] for doc in documents],
                 embedding=self.embeddings,
                 persist_directory=Config.PERSIST_DIRECTORY,
                 collection_name=Config.COLLECTION_NAME,
@@ -138,91 +601,141 @@ Do not mention 'this chunk' or 'this section'."""
         
         return db
 
-    def create_ensemble_retriever(self, vector_db: Chroma, documents: List[Document]) -> EnsembleRetriever:
-        """Configure Hybrid Search (BM25 + Vector)."""
-        logger.info("Configuring Ensemble Retriever...")
+    def _new_bm25_retriever(self, documents: List[Document]):
+        if Config.BM25_ENGINE == "inverted":
+            return InvertedBM25Retriever.from_documents(documents)
+        if Config.BM25_ENGINE == "rank_bm25":
+            return BM25Retriever.from_documents(documents=documents)
+        raise ValueError(f"Unknown BM25 engine: {Config.BM25_ENGINE}")
+
+    def build_bm25_index(self, documents: Optional[List[Document]] = None, docstore: JsonlDocStore = None):
+        """Tokenize and index the store (or `documents` already in memory), then persist it.
+
+        The pickle holds chunk ids, not documents; hits are read back from
+        the store at query time.
+        """
+        docstore = docstore or open_docstore(Config.DOCUMENT_DIRECTORY)
+        if Config.BM25_ENGINE == "inverted" and documents is None:
+            bm25_retriever = InvertedBM25Retriever.from_docstore(docstore)
+            doc_ids = bm25_retriever.doc_ids
+        else:
+            documents = list(docstore) if documents is None else documents
+            bm25_retriever = self._new_bm25_retriever(documents)
+            doc_ids = [chunk_key(doc) for doc in documents]
+
+        payload = {
+            "version": BM25_INDEX_VERSION,
+            "engine": Config.BM25_ENGINE,
+            "source_sha256": docstore.sha256,
+            "doc_ids": doc_ids,
+        }
+        if Config.BM25_ENGINE == "inverted":
+            payload["index"] = bm25_retriever.index
+        else:
+            payload["vectorizer"] = bm25_retriever.vectorizer
+        Path(os.path.dirname(Config.BM25_INDEX_PATH)).mkdir(parents=True, exist_ok=True)
+        # Ghi file tạm rồi rename: worker khác không bao giờ đọc phải file ghi dở
+        tmp_path = f"{Config.BM25_INDEX_PATH}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, Config.BM25_INDEX_PATH)
+
+        logger.info(f"Saved BM25 index ({len(doc_ids)} docs) to {Config.BM25_INDEX_PATH}")
+        return bm25_retriever
+
+    def load_bm25_index(self, docstore: JsonlDocStore = None):
+        """Prebuilt BM25 retriever, or None if missing, stale or built differently."""
+        docstore = docstore or open_docstore(Config.DOCUMENT_DIRECTORY)
+        if not os.path.exists(Config.BM25_INDEX_PATH):
+            return None
+
+        try:
+            with open(Config.BM25_INDEX_PATH, "rb") as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Cannot read BM25 index {Config.BM25_INDEX_PATH}: {e}")
+            return None
+
+        if payload.get("version") != BM25_INDEX_VERSION or payload.get("engine") != Config.BM25_ENGINE:
+            logger.info("BM25 index format or engine changed, rebuilding")
+            return None
+        if not docstore.exists() or payload.get("source_sha256") != docstore.sha256:
+            logger.info(f"{docstore.path} changed since the BM25 index was built, rebuilding")
+            return None
+
+        logger.info(f"Loaded BM25 index ({len(payload['doc_ids'])} docs) from {Config.BM25_INDEX_PATH}")
+        if Config.BM25_ENGINE == "inverted":
+            return InvertedBM25Retriever(index=payload["index"], doc_ids=payload["doc_ids"], docstore=docstore)
+        return BM25Retriever(vectorizer=payload["vectorizer"], docs=docstore.get_many(payload["doc_ids"]))
+
+    def create_hybrid_retriever(
+        self, vector_db: Chroma, documents: List[Document] = None, source_path: str = None
+    ) -> HybridRetriever:
+        """Configure Hybrid Search (BM25 + Vector) fused with RRF.
+
+        Uses the persisted BM25 index when it matches the store at
+        `source_path`; otherwise builds it from `documents`, or by streaming
+        the store when they are not given.
+        """
+        logger.info("Configuring Hybrid Retriever...")
         
-        vector_retriever = vector_db.as_retriever(
-            search_type="similarity", 
-            search_kwargs={"k": Config.RETRIEVAL_K}
-        )
+        vector_retriever = vector_db.as_retriever(search_type="similarity")
         
-        bm25_retriever = BM25Retriever.from_documents(documents=documents)
-        bm25_retriever.k = Config.RETRIEVAL_K
+        docstore = open_docstore(source_path or Config.DOCUMENT_DIRECTORY)
+        bm25_retriever = self.load_bm25_index(docstore)
+        if bm25_retriever is None:
+            bm25_retriever = self.build_bm25_index(documents, docstore)
         
-        return EnsembleRetriever(
-            retrievers=[bm25_retriever, vector_retriever],
-            weights=[0.5, 0.5]
+        return HybridRetriever(
+            sparse=bm25_retriever,
+            dense=vector_retriever,
+            top_k=Config.RETRIEVAL_K,
+            candidate_k=Config.RETRIEVAL_CANDIDATE_K,
+            weights=Config.HYBRID_WEIGHTS,
+            rrf_k=Config.RRF_K,
         )
-    def save_documents(self, documents: List[Document], save_path: str):
-        """Save processed documents to JSON for reuse."""
-        
-        Path(os.path.dirname(save_path)).mkdir(parents=True, exist_ok=True)
-        for doc in documents:
-            print("page_content:", doc.page_content[:100])  
 
-        serializable_docs = [
-            {
-                "page_content": doc.page_content,
-                "metadata": doc.metadata
-            }
-            for doc in documents
-        ]
-
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(serializable_docs, f, ensure_ascii=False, indent=2)
-
-        logger.info(f"Saved {len(documents)} documents to {save_path}")
+    def save_documents(self, documents: List[Document], save_path: str):
+        """Save processed documents to the JSONL store for reuse."""
+        open_docstore(save_path).write(documents)
 
     def load_documents(self, load_path: str = None) -> List[Document]:
-        """Load previously saved documents.
+        """Load previously saved documents (migrating a legacy JSON file first).
         """
 
         # Nếu không truyền path → dùng config
         if load_path is None:
             load_path = Config.DOCUMENT_DIRECTORY
 
-        if not os.path.exists(load_path):
+        docstore = open_docstore(load_path)
+        if not docstore.exists():
             raise FileNotFoundError(f"{load_path} not found.")
 
-        if os.path.getsize(load_path) == 0:
+        if len(docstore) == 0:
             raise ValueError(f"{load_path} is empty.")
 
-        with open(load_path, "r", encoding="utf-8") as f:
-            raw_docs = json.load(f)
+        documents = list(docstore)
 
-        documents = [
-            Document(
-                page_content=item["page_content"],
-                metadata=item["metadata"]
-            )
-            for item in raw_docs
-        ]
-
-        logger.info(f"Loaded {len(documents)} documents from {load_path}")
+        logger.info(f"Loaded {len(documents)} documents from {docstore.path}")
         return documents
 # --- MAIN EXECUTION ---
 async def main():
     builder = ContextualRAGBuilder()
     pdf_files = glob(Config.PDF_PATH_PATTERN)
-    
-    if (os.path.exists(Config.DOCUMENT_DIRECTORY)):
-        logger.info("Loading existing contextual documents...")
-        all_contextual_docs = builder.load_documents(Config.DOCUMENT_DIRECTORY)
+
+    if pdf_files:
+        # Chỉ sinh context / embedding cho chunk mới hoặc đã thay đổi
+        await builder.update_index(pdf_files)
     else:
-        all_contextual_docs = []
-        for file in pdf_files:
-            docs = await builder.process_document(file)
-            all_contextual_docs.extend(docs)
-        builder.save_documents(all_contextual_docs, Config.DOCUMENT_DIRECTORY)  
+        logger.warning(f"No PDF matches {Config.PDF_PATH_PATTERN}; keeping the existing index.")
 
-    if not all_contextual_docs:
+    if not open_docstore(Config.DOCUMENT_DIRECTORY).exists():
         logger.warning("No documents processed. Check your data folder.")
         return
 
-    # Build DB and Retriever
-    vector_db = builder.build_vector_store(all_contextual_docs)
-    retriever = builder.create_ensemble_retriever(vector_db, all_contextual_docs)
+    # Build DB and Retriever (BM25 index được lưu ở đây để worker chỉ cần load)
+    vector_db = builder.build_vector_store()
+    retriever = builder.create_hybrid_retriever(vector_db, source_path=Config.DOCUMENT_DIRECTORY)
     
     logger.info("RAG Pipeline is ready.")
     return retriever
@@ -0,0 +1,63 @@
+"""Async token-bucket rate limiter for requests/min and tokens/min quotas.
+
+Each bucket refills continuously at `per_minute / 60` units per second, up
+to a capacity of one minute's quota. `acquire(tokens)` waits until both
+the request bucket and the token bucket can pay, so bursts are allowed up
+to the quota while the long-run rate never exceeds it.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken (0 if available now)."""
+        self._refill(now)
+        # Yêu cầu lớn hơn cả dung lượng: cho qua khi bucket đầy, tránh chờ mãi
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets; `None` disables a dimension."""
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    async def acquire(self, tokens: int = 0):
+        # Lock giữ thứ tự FIFO: request đến trước được phục vụ trước
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                wait = max(
+                    self.requests.wait_time(1, now) if self.requests else 0.0,
+                    self.tokens.wait_time(tokens, now) if self.tokens else 0.0,
+                )
+                if wait <= 0:
+                    break
+                self.waited += wait
+                await asyncio.sleep(wait)
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
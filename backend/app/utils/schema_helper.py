@@ -1,31 +1,202 @@
-from typing import Type
-from beanie import Document
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import typing
+from enum import Enum
+from typing import Optional, Type
+
+from beanie import Document, Link
+
+from app.core.config import settings
+from app.core.database import DOCUMENT_MODELS
+
+logger = logging.getLogger(__name__)
 
-def get_model_schema(model_class: Type[Document]) -> str:
-    """
-    Chuyển đổi Beanie Model thành chuỗi mô tả schema đơn giản
-    để tiết kiệm token cho LLM.
-    """
-    schema_desc = f"Collection: {model_class.get_collection_name()}\nFields:\n"
-    
-    # Lấy thông tin fields từ Pydantic model
-    for name, field in model_class.model_fields.items():
-        # Lấy tên field (ưu tiên alias nếu có vì DB lưu alias camelCase)
-        field_name = field.alias if field.alias else name
-        field_type = str(field.annotation).replace("typing.", "").replace("<class '", "").replace("'>", "")
-        
-        # Mô tả thêm nếu cần (ví dụ enum values)
-        schema_desc += f"- {field_name} ({field_type})\n"
-        
-    return schema_desc
 
 # Hàm tổng hợp toàn bộ Schema
 def get_all_schemas():
-    from app.models.models import User, Order, Product
-    # Import hết các model cần query
-    
-    models = [User, Order, Product]
-    full_context = ""
-    for model in models:
-        full_context += get_model_schema(model) + "\n"
-    return full_context
\ No newline at end of file
+    return schema_registry.render()
+
+
+# ================= SCHEMA REGISTRY =================
+
+def _collection_key(name: str) -> str:
+    # "product_variants" (Beanie) và "productvariants" (Mongoose) là cùng một collection
+    return name.replace("_", "").lower()
+
+
+def _model_collection(model_class: Type[Document]) -> str:
+    model_settings = getattr(model_class, "Settings", None)
+    return getattr(model_settings, "name", None) or model_class.__name__.lower()
+
+
+def _describe_type(annotation) -> str:
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+
+    if origin is Link:
+        target = args[0] if args else None
+        target = getattr(target, "__forward_arg__", None) or getattr(target, "__name__", str(target))
+        return f"ObjectId -> {target}"
+    if origin is typing.Union:
+        inner = [a for a in args if a is not type(None)]
+        described = " | ".join(_describe_type(a) for a in inner)
+        return f"{described} | null" if len(inner) < len(args) else described
+    if origin is typing.Annotated:
+        return _describe_type(args[0])
+    if origin in (list, typing.List):
+        return f"array<{_describe_type(args[0])}>" if args else "array"
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        values = ", ".join(repr(m.value) for m in annotation)
+        return f"enum[{values}]"
+    if isinstance(annotation, type):
+        if hasattr(annotation, "model_fields"):
+            fields = ", ".join(f.alias or n for n, f in annotation.model_fields.items())
+            return f"object{{{fields}}}"
+        return annotation.__name__
+    return str(annotation).replace("typing.", "")
+
+
+def _field_indexes(model_class: Type[Document]) -> list[str]:
+    indexes = []
+    for name, field in model_class.model_fields.items():
+        for meta in [field.annotation, *field.metadata]:
+            indexed = getattr(meta, "_indexed", None)
+            if indexed:
+                options = indexed[1] if len(indexed) > 1 else {}
+                unique = " unique" if options.get("unique") else ""
+                indexes.append(f"({field.alias or name}){unique}")
+                break
+
+    model_settings = getattr(model_class, "Settings", None)
+    for index in getattr(model_settings, "indexes", None) or []:
+        document = getattr(index, "document", {})
+        keys = ", ".join(document.get("key", {}).keys())
+        options = [opt for opt in ("unique", "sparse") if document.get(opt)]
+        if "expireAfterSeconds" in document:
+            options.append("ttl")
+        indexes.append(f"({keys}) {' '.join(options)}".strip())
+    return indexes
+
+
+def describe_model(model_class: Type[Document]) -> dict:
+    """Field types (DB names), enum values and indexes of a Beanie model."""
+    fields = {}
+    for name, field in model_class.model_fields.items():
+        field_name = field.alias if field.alias else name
+        fields[field_name] = _describe_type(field.annotation)
+    return {
+        "model": model_class.__name__,
+        "fields": fields,
+        "indexes": _field_indexes(model_class),
+    }
+
+
+def _sample_repr(value, limit: int = 60) -> str:
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+class SchemaRegistry:
+    """In-memory collection schemas: Beanie models plus one sampled document each.
+
+    Built once at startup and served to both the MQL prompt and `/db_schema`,
+    so Mongo questions no longer sample the database on every request.
+    """
+
+    def __init__(self, models: list, collections: list[str], ttl: Optional[float] = None):
+        self.models = {_collection_key(_model_collection(m)): m for m in models}
+        self.collections = list(collections)
+        self.ttl = ttl
+
+        self._descriptions: dict[str, dict] = {}
+        self._samples: dict[str, dict] = {}
+        self._rendered = ""
+        self._fingerprint = ""
+        self.refreshed_at: Optional[float] = None
+        # Hết TTL: chỉ một request refresh, các request khác chờ kết quả
+        self._refresh_lock = asyncio.Lock()
+
+    def _build(self):
+        self._descriptions = {}
+        for name in self.collections:
+            model = self.models.get(_collection_key(name))
+            if model is None:
+                logger.warning(f"No Beanie model found for collection '{name}'.")
+                continue
+            self._descriptions[name] = describe_model(model)
+
+        self._rendered = "\n\n".join(self._render_collection(name) for name in self.collections)
+
+        # Fingerprint chỉ dựa trên cấu trúc (không dựa trên giá trị mẫu)
+        structure = {
+            name: [self._descriptions.get(name), sorted(self._samples.get(name) or {})]
+            for name in self.collections
+        }
+        self._fingerprint = hashlib.sha256(
+            json.dumps(structure, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def _render_collection(self, name: str) -> str:
+        desc = self._descriptions.get(name, {"fields": {}, "indexes": []})
+        sample = self._samples.get(name) or {}
+
+        lines = [f"Collection: {name}", "Fields:"]
+        for field_name, field_type in desc["fields"].items():
+            example = f" e.g. {_sample_repr(sample[field_name])}" if field_name in sample else ""
+            lines.append(f"- {field_name} ({field_type}){example}")
+
+        # Field có trong dữ liệu thật nhưng không có trong model (vd. __v của Mongoose)
+        for field_name, value in sample.items():
+            if field_name not in desc["fields"]:
+                lines.append(f"- {field_name} ({type(value).__name__}) e.g. {_sample_repr(value)}")
+
+        if desc["indexes"]:
+            lines.append("Indexes: " + "; ".join(desc["indexes"]))
+        return "\n".join(lines)
+
+    async def refresh(self, database=None):
+        """Rebuild from the models and sample one document per collection."""
+        if database is not None:
+            samples = {}
+            for name in self.collections:
+                try:
+                    samples[name] = await database[name].find_one({}) or {}
+                except Exception as e:
+                    logger.warning(f"Could not sample collection '{name}': {e}")
+            self._samples = samples
+
+        self._build()
+        self.refreshed_at = time.time()
+        logger.info(f"Schema registry refreshed for {len(self._descriptions)} collections.")
+
+    @property
+    def stale(self) -> bool:
+        if self.refreshed_at is None:
+            return True
+        return self.ttl is not None and time.time() - self.refreshed_at > self.ttl
+
+    async def aensure_fresh(self, database=None):
+        if not self.stale:
+            return
+        async with self._refresh_lock:
+            if self.stale:
+                await self.refresh(database)
+
+    def render(self) -> str:
+        if not self._rendered:
+            # Chưa refresh (vd. chạy sync ngoài server): dùng schema từ model
+            self._build()
+        return self._rendered
+
+    @property
+    def fingerprint(self) -> str:
+        self.render()
+        return self._fingerprint
+
+
+schema_registry = SchemaRegistry(
+    DOCUMENT_MODELS, settings.ALLOWED_COLLECTIONS, ttl=settings.SCHEMA_REGISTRY_TTL
+)
@@ -0,0 +1,162 @@
+"""Token-efficient encoding of structured rows for LLM prompts.
+
+Query results used to reach the model as indented JSON, repeating every
+key on every row. Homogeneous rows are instead written as a header line
+plus one TSV line per row. Nested values are flattened first: Extended
+JSON scalars ($oid, $date, ...) become plain strings, `ImageInfo` objects
+become their URL, and Beanie `Link`s (DBRefs) become the referenced id.
+Whichever of TSV or compact JSON is shorter is used.
+"""
+
+import json
+import logging
+import math
+import threading
+from dataclasses import dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ước lượng thô ~3 ký tự/token (tiếng Việt có dấu tốn token hơn tiếng Anh)
+CHARS_PER_TOKEN = 3
+
+_EXTENDED_SCALARS = ("$oid", "$date", "$numberLong", "$numberDecimal", "$numberDouble", "$numberInt")
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+def _scalar(value: Any) -> Any:
+    """Collapse Extended JSON wrappers, ImageInfo and DBRef to a single value."""
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        (key, inner), = value.items()
+        if key in _EXTENDED_SCALARS:
+            # {"$date": {"$numberLong": "..."}} khi ngày nằm ngoài khoảng ISO
+            return _scalar(inner)
+    if "$ref" in value and "$id" in value:
+        return _scalar(value["$id"])
+    if "url" in value and set(value) <= {"url", "public_id"}:
+        return value.get("url")
+    return value
+
+
+def flatten_row(row: dict) -> dict:
+    """One level of dotted keys; deeper structures are kept as compact JSON."""
+    flat = {}
+    for key, value in row.items():
+        value = _scalar(value)
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                flat[f"{key}.{sub_key}"] = _scalar(sub_value)
+        elif isinstance(value, list):
+            flat[key] = [_scalar(v) for v in value]
+        else:
+            flat[key] = value
+    return flat
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        if all(not isinstance(v, (dict, list)) for v in value):
+            return "|".join(_cell(v) for v in value)
+        return _dumps(value)
+    if isinstance(value, dict):
+        return _dumps(value)
+    return str(value).replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+
+@dataclass
+class EncodedRows:
+    format: str                # "tsv" | "json"
+    header: Optional[str]
+    lines: list[str]           # một dòng cho mỗi row, theo thứ tự kết quả
+
+    def render(self, count: Optional[int] = None) -> str:
+        lines = self.lines if count is None else self.lines[:count]
+        if self.format == "tsv":
+            return "\n".join([self.header, *lines])
+        return "[" + ",\n".join(lines) + "]"
+
+
+def _as_table(rows: list[dict]) -> Optional[EncodedRows]:
+    flat = [flatten_row(r) for r in rows]
+    columns: list[str] = []
+    for row in flat:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+
+    # Bảng chỉ có lợi khi các dòng dùng chung phần lớn cột
+    filled = sum(len(row) for row in flat)
+    if not columns or filled < 0.5 * len(columns) * len(flat):
+        return None
+
+    lines = ["\t".join(_cell(row.get(c)) for c in columns) for row in flat]
+    return EncodedRows("tsv", "\t".join(columns), lines)
+
+
+def encode_rows(rows: list) -> EncodedRows:
+    """Most compact encoding of `rows` (TSV table or compact JSON)."""
+    as_json = EncodedRows("json", None, [_dumps(r) for r in rows])
+    if len(rows) < 2 or not all(isinstance(r, dict) for r in rows):
+        return as_json
+
+    table = _as_table(rows)
+    if table is not None and len(table.render()) < len(as_json.render()):
+        return table
+    return as_json
+
+
+def compact_text(text: str) -> str:
+    """Re-encode `text` if it is a JSON array of objects; otherwise return it unchanged."""
+    stripped = (text or "").strip()
+    if not stripped.startswith("["):
+        return text
+    try:
+        rows = json.loads(stripped)
+    except ValueError:
+        return text
+    if not isinstance(rows, list) or not rows:
+        return text
+    encoded = encode_rows(rows).render()
+    return encoded if len(encoded) < len(stripped) else text
+
+
+class PromptSavings:
+    """Running totals of tokens saved by compact encoding, per prompt."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: dict[str, dict] = {}
+
+    def record(self, prompt: str, baseline_tokens: int, sent_tokens: int):
+        saved = max(baseline_tokens - sent_tokens, 0)
+        with self._lock:
+            totals = self._totals.setdefault(
+                prompt, {"requests": 0, "baseline_tokens": 0, "sent_tokens": 0, "saved_tokens": 0}
+            )
+            totals["requests"] += 1
+            totals["baseline_tokens"] += baseline_tokens
+            totals["sent_tokens"] += sent_tokens
+            totals["saved_tokens"] += saved
+        if saved:
+            logger.info(f"{prompt}: ~{saved} prompt tokens saved ({baseline_tokens} -> {sent_tokens}).")
+        return saved
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {prompt: dict(totals) for prompt, totals in self._totals.items()}
+
+
+prompt_savings = PromptSavings()
@@ -0,0 +1,96 @@
+"""Vietnamese-aware tokenization for keyword search.
+
+Text extracted by `PyPDFLoader` often splits one syllable in two
+("ho ặc", "ngư ời", "s ản"). It also mixes NFC and NFD forms. Users
+frequently type without diacritics. `tokenize` therefore does four steps:
+
+1. Normalize to NFC and lowercase.
+2. Rejoin broken syllables. Two fragments are merged only when the left
+   one is a bare onset or has no tone mark, the right one starts with a
+   vowel, and the result is a valid Vietnamese syllable with at most one
+   tone mark.
+3. Fold diacritics ("được" -> "duoc"), so accented and unaccented
+   queries match the same terms.
+4. Add syllable bigrams ("doi_tra"). They recover part of the precision
+   lost by folding and weight multi-syllable words like "bảo hành".
+"""
+
+import re
+import unicodedata
+
+# Dấu thanh (huyền, sắc, hỏi, ngã, nặng); dấu mũ/trăng/móc là một phần của nguyên âm
+_TONE_MARKS = {"\u0300", "\u0301", "\u0303", "\u0309", "\u0323"}
+
+_ONSETS = (
+    "ngh", "ng", "nh", "ch", "gh", "gi", "kh", "ph", "qu", "th", "tr",
+    "b", "c", "d", "đ", "g", "h", "k", "l", "m", "n", "p", "r", "s", "t", "v", "x",
+)
+_NUCLEI = (
+    "iêu", "yêu", "oai", "oay", "oao", "oeo", "uây", "uôi", "uya", "uyê", "uyu", "ươi", "ươu",
+    "ai", "ao", "au", "ay", "âu", "ây", "eo", "êu", "ia", "iê", "iu", "oa", "oă", "oe", "oi",
+    "ôi", "ơi", "oo", "ua", "uâ", "uê", "ui", "uy", "uô", "uơ", "ưa", "ưi", "ươ", "ưu", "yê",
+    "a", "ă", "â", "e", "ê", "i", "o", "ô", "ơ", "u", "ư", "y",
+)
+_CODAS = ("ch", "ng", "nh", "c", "m", "n", "p", "t")
+
+_SYLLABLE = re.compile(
+    "^({})?({})({})?$".format("|".join(_ONSETS), "|".join(_NUCLEI), "|".join(_CODAS))
+)
+_VOWELS = set("aăâeêioôơuưy")
+_WORD = re.compile(r"\w+")
+
+
+def _strip_tones(syllable: str) -> tuple[str, int]:
+    """(syllable without tone marks, number of tone marks), input in NFC."""
+    decomposed = unicodedata.normalize("NFD", syllable)
+    tones = sum(1 for ch in decomposed if ch in _TONE_MARKS)
+    bare = "".join(ch for ch in decomposed if ch not in _TONE_MARKS)
+    return unicodedata.normalize("NFC", bare), tones
+
+
+def is_syllable(text: str) -> bool:
+    bare, tones = _strip_tones(text)
+    return tones <= 1 and _SYLLABLE.match(bare) is not None
+
+
+def _should_join(left: str, right: str) -> bool:
+    right_bare, right_tones = _strip_tones(right)
+    if not right_bare or right_bare[0] not in _VOWELS:
+        return False
+    left_bare, left_tones = _strip_tones(left)
+    if left_tones:
+        return False
+    onset_only = not any(ch in _VOWELS for ch in left_bare)
+    # "cho anh" là hai từ hợp lệ: chỉ nối khi nửa phải mang dấu thanh
+    if not onset_only and not right_tones:
+        return False
+    return is_syllable(left + right)
+
+
+def repair_syllables(words: list[str]) -> list[str]:
+    """Merge PDF-broken fragments ("ngư", "ời") back into one syllable."""
+    repaired: list[str] = []
+    for word in words:
+        if repaired and _should_join(repaired[-1], word):
+            repaired[-1] += word
+        else:
+            repaired.append(word)
+    return repaired
+
+
+def fold_diacritics(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text.replace("đ", "d").replace("Đ", "D"))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def words(text: str) -> list[str]:
+    """Lowercased NFC words with broken syllables repaired."""
+    return repair_syllables(_WORD.findall(unicodedata.normalize("NFC", text or "").lower()))
+
+
+def tokenize(text: str, bigrams: bool = True) -> list[str]:
+    """Folded syllables, plus `a_b` syllable bigrams."""
+    syllables = [fold_diacritics(w) for w in words(text)]
+    if not bigrams:
+        return syllables
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
@@ -0,0 +1,234 @@
+"""OpenAI-compatible stand-in for the LiteLLM proxy on localhost:4000.
+
+Answers `/chat/completions` (and `/v1/chat/completions`) for every model
+alias the backend uses, with canned outputs shaped like what each prompt
+expects: sub-questions for query translation, a JSON source list for the
+router and planner, a `mongodb_query` tool call for MQL generation, and
+plain Vietnamese prose for formatting and synthesis. Streaming (SSE) and
+`stream_options.include_usage` are supported.
+
+    python -m benchmarks.fake_llm_server --latency-ms 300 --tokens-per-sec 80
+
+`--responses rules.json` adds canned outputs ahead of the defaults:
+`[{"contains": "khuyến mãi", "model": "fast-model", "content": "..."}]`.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake LLM proxy")
+
+
+class ServerConfig:
+    latency_ms: float = 300.0       # thời gian tới token đầu tiên
+    jitter_ms: float = 50.0
+    tokens_per_sec: float = 80.0    # tốc độ sinh token khi stream
+    rules: list[dict] = []
+    mql_query: str = 'db.productvariants.aggregate([{"$match": {"stock": {"$gt": 0}}}, {"$sort": {"price": -1}}, {"$limit": 20}])'
+
+
+config = ServerConfig()
+
+_ROUTES = [
+    (r"tồn kho|còn hàng|size|giá|khuyến mãi|mã giảm|sản phẩm", "mongodb_retriever"),
+    (r"chính sách|đổi trả|bảo hành|vận chuyển|bảo quản", "vectordb_retriever"),
+    (r"tin tức|thị trường|xu hướng|mới nhất", "internet_retriever"),
+    (r"xin chào|chào|hello|hi\b|cảm ơn", "greeting"),
+]
+
+_ANSWER = (
+    "Dạ, theo thông tin hiện có tại The Shate, mẫu giày bạn quan tâm vẫn còn hàng ở nhiều size "
+    "với mức giá ưu đãi. Bạn có thể tham khảo thêm chính sách đổi trả trong 30 ngày và chương "
+    "trình khuyến mãi đang áp dụng. Mình có thể hỗ trợ gì thêm cho bạn không ạ?"
+)
+
+
+def _text(content) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _source_for(question: str) -> str:
+    for pattern, source in _ROUTES:
+        if re.search(pattern, question, re.IGNORECASE):
+            return source
+    return "vectordb_retriever"
+
+
+def _last_question(prompt: str) -> str:
+    """The user question embedded at the end of a single-message template."""
+    lines = [line.strip() for line in prompt.strip().splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+_CHUNK_ID = re.compile(r'<chunk id="(\d+)">')
+
+
+def _canned(model: str, messages: list[dict]) -> str:
+    system = " ".join(_text(m.get("content")) for m in messages if m.get("role") == "system")
+    user = _text(messages[-1].get("content")) if messages else ""
+    prompt = f"{system}\n{user}"
+
+    for rule in config.rules:
+        if rule.get("model") not in (None, model):
+            continue
+        if rule.get("contains", "") in prompt:
+            return rule["content"]
+
+    if "<chunks>" in prompt:
+        # Context theo lô khi đánh index: một context cho mỗi chunk id trong prompt
+        return json.dumps(
+            [{"id": int(i), "context": f"Focuses on part {i} of the paper."} for i in _CHUNK_ID.findall(prompt)]
+        )
+    if "bộ điều phối dữ liệu" in system:
+        return json.dumps([{"source": _source_for(user)}])
+    if "bộ lập kế hoạch truy vấn" in prompt:
+        question = _last_question(user)
+        return json.dumps([{"query": question, "source": _source_for(question)}], ensure_ascii=False)
+    if "chia nhỏ các câu hỏi phức tạp" in prompt:
+        question = _last_question(user)
+        return f"{question}\n{question} tại The Shate"
+    if "định dạng kết quả truy vấn" in prompt:
+        return "Dưới đây là các sản phẩm phù hợp:\n1. Giày chạy bộ - còn 12 đôi\n2. Giày thể thao - còn 8 đôi"
+    return _ANSWER
+
+
+def _usage(messages: list[dict], completion: str) -> dict:
+    prompt_chars = sum(len(_text(m.get("content"))) for m in messages)
+    prompt_tokens, completion_tokens = prompt_chars // 4 + 1, len(completion) // 4 + 1
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _tool_call(body: dict) -> Optional[dict]:
+    tools = body.get("tools") or []
+    if not tools:
+        return None
+    name = tools[0]["function"]["name"]
+    arguments = {"query": config.mql_query} if name == "mongodb_query" else {}
+    return {
+        "id": f"call_{uuid.uuid4().hex[:12]}",
+        "type": "function",
+        "function": {"name": name, "arguments": json.dumps(arguments)},
+    }
+
+
+async def _first_token_delay():
+    delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+    await asyncio.sleep(max(delay, 0) / 1000)
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish: Optional[str] = None, usage=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if usage is None else [],
+    }
+    if usage is not None:
+        payload["usage"] = usage
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream(body: dict, content: str, tool_call: Optional[dict], usage: dict):
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    model = body.get("model", "fake")
+    await _first_token_delay()
+
+    if tool_call is not None:
+        delta = {"role": "assistant", "content": None, "tool_calls": [dict(tool_call, index=0)]}
+        yield _chunk(completion_id, model, delta)
+        yield _chunk(completion_id, model, {}, finish="tool_calls")
+    else:
+        words = re.findall(r"\S+\s*", content)
+        per_token = 1 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0
+        for i, word in enumerate(words):
+            delta = {"content": word} if i else {"role": "assistant", "content": word}
+            yield _chunk(completion_id, model, delta)
+            await asyncio.sleep(per_token)
+        yield _chunk(completion_id, model, {}, finish="stop")
+
+    if (body.get("stream_options") or {}).get("include_usage"):
+        yield _chunk(completion_id, model, {}, usage=usage)
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    tool_call = _tool_call(body)
+    content = "" if tool_call else _canned(body.get("model", ""), messages)
+    usage = _usage(messages, content or json.dumps(tool_call))
+
+    if body.get("stream"):
+        return StreamingResponse(
+            _stream(body, content, tool_call, usage), media_type="text/event-stream"
+        )
+
+    await _first_token_delay()
+    # Thời gian sinh phần còn lại của câu trả lời
+    if config.tokens_per_sec > 0:
+        await asyncio.sleep(usage["completion_tokens"] / config.tokens_per_sec)
+
+    message = {"role": "assistant", "content": content or None}
+    if tool_call is not None:
+        message["tool_calls"] = [tool_call]
+    return JSONResponse(
+        {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if tool_call else "stop",
+                }
+            ],
+            "usage": usage,
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms)
+    parser.add_argument("--tokens-per-sec", type=float, default=config.tokens_per_sec)
+    parser.add_argument("--mql-query", default=config.mql_query)
+    parser.add_argument("--responses", help="JSON file of extra canned-output rules")
+    args = parser.parse_args()
+
+    config.latency_ms = args.latency_ms
+    config.jitter_ms = args.jitter_ms
+    config.tokens_per_sec = args.tokens_per_sec
+    config.mql_query = args.mql_query
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            config.rules = json.load(f)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""In-process stand-ins for the paid services used by the RAG graph.
+
+`install()` must run before anything under `app.graph` is imported: it
+swaps the Gemini embeddings, Cohere reranker and Tavily search classes
+for local fakes with configurable latency, so the graph is exercised end
+to end without any external bill. LLM calls are not patched here; they go
+to `fake_llm_server.py` on the LiteLLM proxy port instead.
+"""
+
+import asyncio
+import hashlib
+import random
+import time
+from typing import Optional, Sequence
+
+from langchain_core.callbacks import Callbacks
+from langchain_core.documents import BaseDocumentCompressor, Document
+from langchain_core.embeddings import Embeddings
+
+
+class Latency:
+    """Fixed delay plus uniform jitter, in milliseconds."""
+
+    def __init__(self, mean_ms: float = 0.0, jitter_ms: float = 0.0):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+
+    def seconds(self) -> float:
+        return max(self.mean_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0) / 1000
+
+    def sleep(self):
+        time.sleep(self.seconds())
+
+    async def asleep(self):
+        await asyncio.sleep(self.seconds())
+
+
+EMBEDDING_LATENCY = Latency(40, 10)
+RERANK_LATENCY = Latency(120, 30)
+SEARCH_LATENCY = Latency(600, 150)
+
+
+class FakeGeminiEmbeddings(Embeddings):
+    """Deterministic hash embeddings, accepting GoogleGenerativeAIEmbeddings' arguments."""
+
+    def __init__(self, model: str = "fake", size: int = 256, **kwargs):
+        self.model = model
+        self.size = size
+
+    def _vector(self, text: str) -> list[float]:
+        # Bag of hashed words: câu gần nhau cho vector gần nhau, đủ cho router/cache
+        vector = [0.0] * self.size
+        for word in (text or "").lower().split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.size] += 1.0
+        return vector if any(vector) else [1.0] + [0.0] * (self.size - 1)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        EMBEDDING_LATENCY.sleep()
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        EMBEDDING_LATENCY.sleep()
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await EMBEDDING_LATENCY.asleep()
+        return [self._vector(t) for t in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await EMBEDDING_LATENCY.asleep()
+        return self._vector(text)
+
+
+class FakeReranker(BaseDocumentCompressor):
+    """Keeps the first `top_n` documents, scored by word overlap with the query."""
+
+    top_n: int = 3
+    model: str = "fake-rerank"
+    cohere_api_key: Optional[str] = None
+
+    def _rank(self, documents: Sequence[Document], query: str) -> list[Document]:
+        words = set(query.lower().split())
+        scored = []
+        for doc in documents:
+            overlap = len(words & set(doc.page_content.lower().split()))
+            scored.append((overlap / (len(words) or 1), doc))
+        scored.sort(key=lambda item: -item[0])
+        ranked = []
+        for score, doc in scored[: self.top_n]:
+            doc = Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+            doc.metadata["relevance_score"] = score
+            ranked.append(doc)
+        return ranked
+
+    def compress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        RERANK_LATENCY.sleep()
+        return self._rank(documents, query)
+
+    async def acompress_documents(
+        self, documents: Sequence[Document], query: str, callbacks: Callbacks = None
+    ) -> Sequence[Document]:
+        await RERANK_LATENCY.asleep()
+        return self._rank(documents, query)
+
+
+class FakeTavilySearch:
+    """Returns `max_results` canned web results shaped like TavilySearch output."""
+
+    def __init__(self, max_results: int = 10, **kwargs):
+        self.max_results = max_results
+
+    def _results(self, query: str) -> dict:
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"Kết quả {i + 1} cho: {query}",
+                    "url": f"https://example.com/search/{i + 1}",
+                    "content": f"Tin tức giả lập số {i + 1} liên quan đến {query}. " * 5,
+                }
+                for i in range(self.max_results)
+            ],
+        }
+
+    def invoke(self, query, config=None, **kwargs) -> dict:
+        SEARCH_LATENCY.sleep()
+        return self._results(str(query))
+
+    async def ainvoke(self, query, config=None, **kwargs) -> dict:
+        await SEARCH_LATENCY.asleep()
+        return self._results(str(query))
+
+
+def install(
+    embedding_ms: Optional[float] = None,
+    rerank_ms: Optional[float] = None,
+    search_ms: Optional[float] = None,
+):
+    """Patch the service classes; call before importing `app.graph`."""
+    import langchain_cohere
+    import langchain_google_genai
+    import langchain_tavily
+
+    if embedding_ms is not None:
+        EMBEDDING_LATENCY.mean_ms = embedding_ms
+    if rerank_ms is not None:
+        RERANK_LATENCY.mean_ms = rerank_ms
+    if search_ms is not None:
+        SEARCH_LATENCY.mean_ms = search_ms
+
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = FakeGeminiEmbeddings
+    langchain_cohere.CohereRerank = FakeReranker
+    langchain_tavily.TavilySearch = FakeTavilySearch
@@ -0,0 +1,316 @@
+"""Offline end-to-end throughput benchmark for the RAG graph.
+
+Pushes N questions through `app_graph.ainvoke` with bounded concurrency and
+reports p50/p95/p99 latency, requests/sec and a per-node breakdown (taken
+from the structured traces `app.core.observability` logs per request).
+External services are replaced by local stand-ins:
+
+- LLMs: `benchmarks.fake_llm_server` on localhost:4000 (start it first)
+- embeddings / rerank / web search: `benchmarks.fakes`
+- MongoDB: a local instance seeded by `benchmarks.seed_mongo`
+
+Run from `backend/`:
+
+    python -m benchmarks.fake_llm_server --latency-ms 300 &
+    python -m benchmarks.seed_mongo --uri mongodb://localhost:27017 --db bench
+    MONGO_URI=mongodb://localhost:27017 MONGO_DB_NAME=bench \\
+        python -m benchmarks.run_benchmark -n 200 -c 16 --baseline benchmarks/results/last.json
+
+Results are written as JSON (`--output`) so releases can be compared;
+`--baseline` prints the deltas and `--fail-on-regression` turns a p95 or
+throughput regression beyond `--tolerance` into a non-zero exit code.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+CACHE_DIR = BENCH_DIR / ".cache"
+RESULTS_DIR = BENCH_DIR / "results"
+
+DEFAULT_QUESTIONS = [
+    "Giày chạy bộ Nike size 42 còn hàng không?",
+    "Mẫu sneaker nào đang có giá dưới 2 triệu?",
+    "Hiện có chương trình khuyến mãi nào đang áp dụng?",
+    "Tổng tồn kho của các mẫu giày màu đen là bao nhiêu?",
+    "Chính sách đổi trả của cửa hàng như thế nào?",
+    "Bảo hành giày da trong bao lâu?",
+    "Cách bảo quản giày da lộn đúng cách?",
+    "Phí vận chuyển cho đơn hàng nội thành là bao nhiêu?",
+    "Tin tức mới nhất về thị trường giày thể thao?",
+    "Xu hướng sneaker năm nay là gì?",
+    "Xin chào shop!",
+    "Giày Adidas size 40 còn màu trắng không và có được đổi size không?",
+]
+
+
+class TraceCollector(logging.Handler):
+    """Collects the per-request JSON traces logged on `app.trace`."""
+
+    def __init__(self):
+        super().__init__(level=logging.INFO)
+        self.traces: list[dict] = []
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.traces.append(json.loads(record.getMessage()))
+        except ValueError:
+            pass
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Linear-interpolated percentile, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def _distribution(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2) if values else 0.0,
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2) if values else 0.0,
+    }
+
+
+def _configure_environment(args):
+    """Settings are read at import time, so this must run before importing `app`."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    if not args.with_caches:
+        for name in (
+            "SEMANTIC_CACHE_ENABLED", "LLM_CACHE_ENABLED", "PIPELINE_CACHE_ENABLED", "EMBEDDING_CACHE_ENABLED",
+        ):
+            os.environ[name] = "false"
+    os.environ.setdefault("LLM_CACHE_PATH", str(CACHE_DIR / "llm_cache.sqlite"))
+    # Vector của fake embeddings không được lẫn với cache Gemini thật
+    os.environ["EMBEDDING_CACHE_PATH"] = str(CACHE_DIR / "embedding_cache.sqlite")
+    os.environ["ROUTER_LOG_PATH"] = str(CACHE_DIR / "routing_log.jsonl")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Toolkit langchain_mongodb đọc MONGODB_URI, phần còn lại dùng settings.MONGO_URI
+    if "MONGO_URI" in os.environ:
+        os.environ.setdefault("MONGODB_URI", os.environ["MONGO_URI"])
+    for key in ("COHERE_API_KEY", "TAVILY_API_KEY", "GOOGLE_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+
+    from benchmarks import fakes
+
+    fakes.install(
+        embedding_ms=args.embedding_ms, rerank_ms=args.rerank_ms, search_ms=args.search_ms
+    )
+
+    # Vector store riêng, dựng bằng fake embeddings (khác số chiều với Gemini)
+    from app.utils.indexing import Config
+
+    Config.PERSIST_DIRECTORY = str(CACHE_DIR / "vector_db")
+    Config.BM25_INDEX_PATH = str(CACHE_DIR / "bm25_index.pkl")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+async def _run(app_graph, questions: list[str], total: int, concurrency: int) -> tuple[list[dict], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    results: list[dict] = []
+
+    async def one(i: int):
+        question = questions[i % len(questions)]
+        async with semaphore:
+            started = time.perf_counter()
+            record = {"question": question}
+            try:
+                output = await app_graph.ainvoke({"question": question})
+                record["ok"] = bool(output.get("generation"))
+                record["ttft_ms"] = (output.get("generation_metrics") or {}).get("ttft_ms")
+                record["cache_hit"] = bool(output.get("cache_hit"))
+            except Exception as e:
+                record["ok"] = False
+                record["error"] = f"{type(e).__name__}: {e}"
+            record["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            results.append(record)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return results, time.perf_counter() - started
+
+
+def _node_breakdown(traces: list[dict]) -> dict:
+    by_node: dict[str, list[float]] = defaultdict(list)
+    for trace in traces:
+        for span in trace.get("spans", []):
+            if span.get("kind") == "node":
+                by_node[span["name"]].append(span["ms"])
+    return {name: _distribution(values) for name, values in sorted(by_node.items())}
+
+
+def _external_totals() -> dict:
+    """(sum seconds, count) per service.operation; the histogram is cumulative."""
+    from app.core.observability import EXTERNAL_LATENCY
+
+    totals: dict[str, list[float]] = defaultdict(lambda: [0.0, 0.0])
+    for metric in EXTERNAL_LATENCY.collect():
+        for sample in metric.samples:
+            key = f"{sample.labels.get('service')}.{sample.labels.get('operation')}"
+            if sample.name.endswith("_sum"):
+                totals[key][0] = sample.value
+            elif sample.name.endswith("_count"):
+                totals[key][1] = sample.value
+    return dict(totals)
+
+
+def _external_calls(before: dict) -> dict:
+    """External calls made since the `before` snapshot (warmup excluded)."""
+    calls = {}
+    for key, (total, count) in sorted(_external_totals().items()):
+        prev_total, prev_count = before.get(key, (0.0, 0.0))
+        count -= prev_count
+        if count > 0:
+            calls[key] = {
+                "count": int(count),
+                "mean_ms": round((total - prev_total) / count * 1000, 2),
+            }
+    return calls
+
+
+def _compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Human-readable deltas; lines starting with "REGRESSION" exceed the tolerance."""
+    lines = []
+    current, previous = report["summary"], baseline.get("summary", {})
+    for key in ("p50", "p95", "p99"):
+        new, old = current["latency_ms"][key], previous.get("latency_ms", {}).get(key)
+        if not old:
+            continue
+        change = (new - old) / old
+        flag = "REGRESSION" if key == "p95" and change > tolerance else "          "
+        lines.append(f"{flag} latency {key}: {old:.1f} -> {new:.1f} ms ({change:+.1%})")
+    old_rps = previous.get("requests_per_sec")
+    if old_rps:
+        change = (current["requests_per_sec"] - old_rps) / old_rps
+        flag = "REGRESSION" if change < -tolerance else "          "
+        lines.append(f"{flag} throughput: {old_rps:.2f} -> {current['requests_per_sec']:.2f} req/s ({change:+.1%})")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for app_graph.")
+    parser.add_argument("-n", "--requests", type=int, default=100)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--questions", help="Text file with one question per line")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--baseline", help="Previous result JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--with-caches", action="store_true", help="Keep semantic/LLM/pipeline/embedding caches on")
+    parser.add_argument("--embedding-ms", type=float)
+    parser.add_argument("--rerank-ms", type=float)
+    parser.add_argument("--search-ms", type=float)
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    _configure_environment(args)
+
+    from app.core.database import get_database
+    from app.core.lifecycle import subsystems
+    from app.graph.workflow import app_graph
+    from app.utils.schema_helper import schema_registry
+
+    # indexing.py gọi logging.basicConfig(INFO) khi import
+    logging.getLogger().setLevel(os.environ["LOG_LEVEL"])
+    collector = TraceCollector()
+    trace_logger = logging.getLogger("app.trace")
+    trace_logger.addHandler(collector)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+    async def run_all():
+        await schema_registry.refresh(get_database())
+        await subsystems.warmup()
+        if args.warmup:
+            await _run(app_graph, questions, args.warmup, args.warmup)
+        collector.traces.clear()
+        before = _external_totals()
+        results, elapsed = await _run(app_graph, questions, args.requests, args.concurrency)
+        return results, elapsed, before
+
+    results, elapsed, external_before = asyncio.run(run_all())
+
+    latencies = [r["latency_ms"] for r in results if r["ok"]]
+    ttfts = [r["ttft_ms"] for r in results if r.get("ttft_ms") is not None]
+    errors = [r for r in results if not r["ok"]]
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "questions": len(questions),
+            "with_caches": args.with_caches,
+            "embedding_ms": args.embedding_ms,
+            "rerank_ms": args.rerank_ms,
+            "search_ms": args.search_ms,
+        },
+        "summary": {
+            "ok": len(latencies),
+            "errors": len(errors),
+            "duration_s": round(elapsed, 3),
+            "requests_per_sec": round(len(results) / elapsed, 3) if elapsed else 0.0,
+            "latency_ms": _distribution(latencies),
+            "generation_ttft_ms": _distribution(ttfts),
+        },
+        "nodes": _node_breakdown(collector.traces),
+        "external_calls": _external_calls(external_before),
+        "errors": sorted({e.get("error", "empty generation") for e in errors})[:20],
+    }
+
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    summary = report["summary"]
+    print(f"{summary['ok']} ok / {summary['errors']} errors in {summary['duration_s']} s "
+          f"({summary['requests_per_sec']} req/s)")
+    print("latency ms: " + ", ".join(f"{k}={summary['latency_ms'][k]}" for k in ("p50", "p95", "p99")))
+    for name, stats in report["nodes"].items():
+        print(f"  {name:<22} n={stats['count']:<5} p50={stats['p50']:<9} p95={stats['p95']}")
+    print(f"Saved {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            lines = _compare(report, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        if args.fail_on_regression and any(line.startswith("REGRESSION") for line in lines):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
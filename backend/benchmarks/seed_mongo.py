@@ -0,0 +1,165 @@
+"""Seed a local MongoDB with synthetic shop data for benchmarks.
+
+Documents are generated from the Beanie models in `app/models/models.py`
+(field aliases, enums, nested `ImageInfo`, `Link` references), so the
+seeded data has the same shape the schema registry and MQL prompts
+describe. Collections are written under the names the production data
+uses (`settings.ALLOWED_COLLECTIONS`, e.g. `productvariants`).
+
+    python -m benchmarks.seed_mongo --uri mongodb://localhost:27017 --db bench --products 500
+"""
+
+import argparse
+import random
+import typing
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+
+from beanie import Link
+from bson import DBRef, ObjectId
+from pymongo import MongoClient
+
+from app.models.models import Category, Product, ProductVariant, Promotion
+
+COLORS = ["Đen", "Trắng", "Đỏ", "Xanh navy", "Be", "Xám"]
+SIZES = [str(s) for s in range(36, 45)]
+BRANDS = ["Nike", "Adidas", "Puma", "Converse", "Vans", "New Balance", "Asics"]
+KINDS = ["Giày chạy bộ", "Giày thể thao", "Sneaker", "Giày da", "Dép sandal", "Giày lười"]
+
+# Tên collection thật trong DB cho từng model
+COLLECTIONS = {
+    Category: "categories",
+    Product: "products",
+    ProductVariant: "productvariants",
+    Promotion: "promotions",
+}
+
+
+def _unwrap(annotation):
+    """Strip Optional/Annotated; returns (inner annotation, is_optional)."""
+    optional = False
+    while True:
+        origin = typing.get_origin(annotation)
+        if origin is typing.Annotated:
+            annotation = typing.get_args(annotation)[0]
+        elif origin is typing.Union:
+            args = [a for a in typing.get_args(annotation) if a is not type(None)]
+            optional = optional or len(args) < len(typing.get_args(annotation))
+            annotation = args[0]
+        else:
+            return annotation, optional
+
+
+def _link_target(annotation):
+    target = typing.get_args(annotation)[0]
+    name = getattr(target, "__forward_arg__", None) or target.__name__
+    return next((model for model in COLLECTIONS if model.__name__ == name), None)
+
+
+def fake_value(name: str, annotation, rng: random.Random, refs: dict, index: int):
+    annotation, optional = _unwrap(annotation)
+    if optional and rng.random() < 0.2:
+        return None
+
+    origin = typing.get_origin(annotation)
+    if origin is Link:
+        target = _link_target(annotation)
+        ids = refs.get(target) if target is not None else None
+        return DBRef(COLLECTIONS[target], rng.choice(ids)) if ids else None
+    if origin in (list, typing.List):
+        return [fake_value(name, typing.get_args(annotation)[0], rng, refs, index) for _ in range(rng.randint(0, 3))]
+    if isinstance(annotation, type) and issubclass(annotation, Enum):
+        return rng.choice(list(annotation)).value
+    if isinstance(annotation, type) and hasattr(annotation, "model_fields"):
+        # ImageInfo và các model lồng nhau khác
+        return {
+            (f.alias or n): fake_value(n, f.annotation, rng, refs, index)
+            for n, f in annotation.model_fields.items()
+        }
+    if annotation is datetime:
+        return datetime.now(timezone.utc) + timedelta(days=rng.randint(-180, 180))
+    if annotation is bool:
+        return rng.random() < 0.5
+    if annotation is int:
+        return rng.randint(0, 200)
+    if annotation is float:
+        return float(rng.randrange(100_000, 5_000_000, 10_000))
+    if name in ("url",):
+        return f"https://res.cloudinary.com/demo/image/upload/{index}.jpg"
+    return f"{name}-{index}"
+
+
+def fake_document(model, rng: random.Random, refs: dict, index: int, **overrides) -> dict:
+    doc = {"_id": ObjectId()}
+    for name, field in model.model_fields.items():
+        if name in ("id", "revision_id"):
+            continue
+        key = field.alias or name
+        doc[key] = overrides[name] if name in overrides else fake_value(name, field.annotation, rng, refs, index)
+    return doc
+
+
+def seed(uri: str, database: str, products: int, variants_per_product: int, promotions: int, seed_value: int):
+    rng = random.Random(seed_value)
+    db = MongoClient(uri)[database]
+    refs: dict = {}
+
+    def insert(model, docs: list[dict]):
+        collection = db[COLLECTIONS[model]]
+        collection.drop()
+        if docs:
+            collection.insert_many(docs)
+        refs[model] = [d["_id"] for d in docs]
+        print(f"{COLLECTIONS[model]}: {len(docs)} documents")
+
+    insert(Category, [
+        fake_document(Category, rng, refs, i, name=kind, slug=f"category-{i}", parent_id=None)
+        for i, kind in enumerate(KINDS)
+    ])
+
+    insert(Product, [
+        fake_document(
+            Product, rng, refs, i,
+            code=f"SP{i:05d}",
+            title=f"{rng.choice(KINDS)} {rng.choice(BRANDS)} {i}",
+            slug=f"product-{i}",
+            tag=rng.sample(BRANDS, 2),
+        )
+        for i in range(products)
+    ])
+
+    variants = []
+    for product_id in refs[Product]:
+        combos = rng.sample([(c, s) for c in COLORS for s in SIZES], variants_per_product)
+        for color, size in combos:
+            variants.append(fake_document(
+                ProductVariant, rng, refs, len(variants),
+                sku=f"SKU{len(variants):07d}",
+                color=color,
+                size=size,
+                product_id=DBRef("products", product_id),
+                product_variant_image_id=None,
+            ))
+    insert(ProductVariant, variants)
+
+    insert(Promotion, [
+        fake_document(Promotion, rng, refs, i, code=f"SALE{i:03d}")
+        for i in range(promotions)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed MongoDB with synthetic benchmark data.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="test")
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--variants-per-product", type=int, default=8)
+    parser.add_argument("--promotions", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    seed(args.uri, args.db, args.products, args.variants_per_product, args.promotions, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from app.cache.mql import PipelineCache
+
+TOP_SIZES = (
+    'db.orderitems.aggregate([{"$match": {"brand": "Nike"}}, '
+    '{"$group": {"_id": "$size", "sold": {"$sum": 1}}}, '
+    '{"$sort": {"sold": -1}}, {"$project": {"size": "$_id", "_id": 0, "sold": 1}}, '
+    '{"$limit": 1}])'
+)
+
+
+def test_structural_constants_stay_fixed():
+    cache = PipelineCache()
+    cache.store("Top 1 size Nike bán chạy nhất", TOP_SIZES, llm_seconds=1.0)
+
+    query = cache.lookup("Top 5 size Adidas bán chạy nhất")
+
+    assert query == (
+        'db.orderitems.aggregate([{"$match": {"brand": "Adidas"}}, '
+        '{"$group": {"_id": "$size", "sold": {"$sum": 1}}}, '
+        '{"$sort": {"sold": -1}}, {"$project": {"size": "$_id", "_id": 0, "sold": 1}}, '
+        '{"$limit": 5}])'
+    )
+
+
+def test_match_values_are_lifted():
+    cache = PipelineCache()
+    cache.store(
+        "Giày Nike size 42 còn bao nhiêu",
+        'db.products.aggregate([{"$match": {"brand": "Nike", "size": {"$gte": 42}}}, '
+        '{"$group": {"_id": null, "stock": {"$sum": "$stock"}}}])',
+        llm_seconds=1.0,
+    )
+
+    query = cache.lookup("Giày Adidas size 40 còn bao nhiêu?")
+
+    assert '"brand": "Adidas"' in query
+    assert '{"$gte": 40}' in query